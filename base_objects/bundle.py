@@ -0,0 +1,186 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger("prompt_override")
+
+
+class BundleError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+class LevelBundle:
+    """A level packed into a single file: its manifest and all of its assets.
+
+    The file starts with a table of `(name, offset, length)` entries followed
+    by the entries' bytes. It is memory-mapped when opened and entries are
+    handed out as slices of the map, so nothing is read until it is used.
+
+    Layout (little endian):
+        magic (4s) | version (H) | entries (I)
+        entries * [name length (H) | name (utf-8) | offset (Q) | length (Q)]
+        data
+    """
+
+    extension = ".lvl"
+    manifest = "manifest.json"
+
+    _magic = b"POLB"
+    _version = 1
+    _header = struct.Struct("<4sHI")
+    _name_length = struct.Struct("<H")
+    _span = struct.Struct("<QQ")
+
+    # bundles are opened once per process, see `open`
+    _opened: Dict[str, "LevelBundle"] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._entries = self._read_table()
+
+    @classmethod
+    def open(cls, path: str) -> "LevelBundle":
+        path = os.path.abspath(path)
+        with cls._lock:
+            bundle = cls._opened.get(path)
+            if bundle is None:
+                bundle = cls._opened[path] = cls(path)
+        return bundle
+
+    def __reduce__(self):
+        # copies and pickles share (or reopen) the mapped file
+        return LevelBundle.open, (self.path,)
+
+    def _read_table(self) -> Dict[str, Tuple[int, int]]:
+        if len(self._map) < self._header.size:
+            raise BundleError(f"{self.path} is not a level bundle.")
+        magic, version, n_entries = self._header.unpack_from(self._map, 0)
+        if magic != self._magic:
+            raise BundleError(f"{self.path} is not a level bundle.")
+        if version != self._version:
+            raise BundleError(
+                f"{self.path} is a version {version} bundle, expected {self._version}."
+            )
+        entries = {}
+        pos = self._header.size
+        for _ in range(n_entries):
+            (name_length,) = self._name_length.unpack_from(self._map, pos)
+            pos += self._name_length.size
+            name = bytes(self._view[pos : pos + name_length]).decode("utf-8")
+            pos += name_length
+            offset, length = self._span.unpack_from(self._map, pos)
+            pos += self._span.size
+            if offset + length > len(self._map):
+                raise BundleError(f"{self.path} is truncated ({name}).")
+            entries[name] = (offset, length)
+        return entries
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def get(self, name: str) -> memoryview:
+        """The bytes of the entry `name`, without copying them."""
+        try:
+            offset, length = self._entries[name]
+        except KeyError:
+            raise BundleError(f"{name} not found in {self.path}.") from None
+        return self._view[offset : offset + length]
+
+    def read_text(self, name: str) -> str:
+        return str(self.get(name), "utf-8")
+
+    @staticmethod
+    def write(path: str, entries: Dict[str, bytes]) -> None:
+        table_size = LevelBundle._header.size + sum(
+            LevelBundle._name_length.size
+            + len(name.encode("utf-8"))
+            + LevelBundle._span.size
+            for name in entries
+        )
+        table = [
+            LevelBundle._header.pack(
+                LevelBundle._magic, LevelBundle._version, len(entries)
+            )
+        ]
+        offset = table_size
+        for name, data in entries.items():
+            encoded_name = name.encode("utf-8")
+            table.append(LevelBundle._name_length.pack(len(encoded_name)))
+            table.append(encoded_name)
+            table.append(LevelBundle._span.pack(offset, len(data)))
+            offset += len(data)
+        # write next to the target first, so an open bundle is never half-written
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.writelines(table)
+            f.writelines(entries.values())
+        os.replace(tmp_path, path)
+        with LevelBundle._lock:
+            LevelBundle._opened.pop(os.path.abspath(path), None)
+
+
+def bundle_path(manifest_path: str) -> str:
+    return os.path.splitext(manifest_path)[0] + LevelBundle.extension
+
+
+def _assets_dir(manifest_path: str, manifest: bytes) -> str:
+    number = json.loads(manifest)["number"]
+    return os.path.join(os.path.dirname(manifest_path), f"level{str(number).zfill(2)}")
+
+
+def is_stale(manifest_path: str) -> bool:
+    """Whether the bundle of `manifest_path` is older than the level it packs.
+
+    A missing bundle is stale; a missing manifest (e.g. in a build that only
+    ships bundles) is not.
+    """
+    path = bundle_path(manifest_path)
+    if not os.path.exists(path):
+        return True
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, "rb") as f:
+        assets_dir = _assets_dir(manifest_path, f.read())
+    mtimes = [os.path.getmtime(manifest_path)]
+    if os.path.isdir(assets_dir):
+        mtimes.extend(
+            os.path.getmtime(entry.path)
+            for entry in os.scandir(assets_dir)
+            if entry.is_file()
+        )
+    return max(mtimes) > os.path.getmtime(path)
+
+
+def pack_level(manifest_path: str, output: Optional[str] = None) -> str:
+    """Pack the level manifest `manifest_path` and its asset directory.
+
+    The assets of a level are read from the `levelNN` directory next to its
+    manifest. Returns the path of the bundle.
+    """
+    with open(manifest_path, "rb") as f:
+        manifest = f.read()
+    assets_dir = _assets_dir(manifest_path, manifest)
+    entries = {LevelBundle.manifest: manifest}
+    for fname in sorted(os.listdir(assets_dir)):
+        fpath = os.path.join(assets_dir, fname)
+        if os.path.isfile(fpath):
+            with open(fpath, "rb") as f:
+                entries[fname] = f.read()
+    output = output or bundle_path(manifest_path)
+    LevelBundle.write(output, entries)
+    logger.info(f"Packed {manifest_path} ({len(entries)} entries) into {output}.")
+    return output
@@ -1,17 +1,62 @@
-from typing import Dict, List
+import inspect
+from functools import partial
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 from base_objects.vfs import VirtualFileSystem
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 class Trigger(BaseModel):
     function_name: str = Field("")
     parameters: Dict[str, str] = Field({})
 
-    def evaluate(self, vfs: VirtualFileSystem):
-        f = getattr(vfs, self.function_name)
-        return f(**self.parameters)
+    # the file system function with the parameters already applied, see `_compile`
+    _predicate: Optional[Callable[[VirtualFileSystem], bool]] = None
+
+    @model_validator(mode="after")
+    def _compile(self) -> "Trigger":
+        # unknown functions and parameters fail when the level is loaded; only
+        # the predicates on facts the file system tracks can be triggers
+        predicates = sorted(VirtualFileSystem.fact_fields.values())
+        if self.function_name not in predicates:
+            raise ValueError(
+                f"{self.function_name} is not a trigger function "
+                f"(expected one of {', '.join(predicates)})."
+            )
+        function = getattr(VirtualFileSystem, self.function_name)
+        try:
+            inspect.signature(function).bind(None, **self.parameters)
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for {self.function_name}: {e}")
+        # the file system is passed in on evaluation rather than bound here, so
+        # copies of a level do not share it
+        self._predicate = partial(function, **self.parameters)
+        return self
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["__pydantic_private__"] = {
+            **state["__pydantic_private__"],
+            "_predicate": None,
+        }
+        return state
+
+    def __setstate__(self, state) -> None:
+        # compiled again from the file system functions of this version
+        super().__setstate__(state)
+        self._compile()
+
+    def evaluate(self, vfs: VirtualFileSystem) -> bool:
+        return self._predicate(vfs)
+
+    @property
+    def fact(self) -> Tuple[str, ...]:
+        return (self.function_name, *self.parameters.values())
+
+    def __str__(self) -> str:
+        parameters = ", ".join(f"{k}={v!r}" for k, v in self.parameters.items())
+        return f"{self.function_name}({parameters})"
 
 
 class Goal(BaseModel):
@@ -23,9 +68,59 @@ class Goal(BaseModel):
 
     _solved: bool = False
 
-    def resolved(self, vfs: VirtualFileSystem):
-        res = True
-        for trigger in self.triggers:
-            res &= trigger.evaluate(vfs=vfs)
+    def resolved(self, vfs: VirtualFileSystem) -> bool:
+        res = self.explain(vfs=vfs) is None
         self._solved = res
         return res
+
+    def explain(self, vfs: VirtualFileSystem) -> Optional[Trigger]:
+        """The first trigger of the goal that does not hold yet, if any."""
+        for trigger in self.triggers:
+            if not trigger._predicate(vfs):
+                return trigger
+        return None
+
+
+class GoalTracker:
+    """Keeps track of which triggers of the goals hold.
+
+    Triggers are only evaluated again when a fact they test changes (see
+    `VirtualFileSystem.pop_changed_facts`), and each goal counts how many of
+    its triggers hold.
+    """
+
+    def __init__(self, goals: List[Goal]) -> None:
+        self.goals = goals
+        self._held = [[False] * len(goal.triggers) for goal in goals]
+        self._n_held = [0] * len(goals)
+        self._by_fact: Dict[Tuple[str, ...], List[Tuple[int, int]]] = {}
+        self._by_function: Dict[str, List[Tuple[int, int]]] = {}
+        self._evaluated = False
+        for goal_idx, goal in enumerate(goals):
+            for trigger_idx, trigger in enumerate(goal.triggers):
+                key = (goal_idx, trigger_idx)
+                self._by_fact.setdefault(trigger.fact, []).append(key)
+                self._by_function.setdefault(trigger.function_name, []).append(key)
+
+    def update(self, vfs: VirtualFileSystem) -> None:
+        changed_facts = vfs.pop_changed_facts()
+        stale: Set[Tuple[int, int]] = set()
+        if not self._evaluated:
+            for keys in self._by_function.values():
+                stale.update(keys)
+            self._evaluated = True
+        elif changed_facts:
+            for fact in changed_facts:
+                if len(fact) == 1:
+                    stale.update(self._by_function.get(fact[0], []))
+                else:
+                    stale.update(self._by_fact.get(fact, []))
+        for goal_idx, trigger_idx in stale:
+            trigger = self.goals[goal_idx].triggers[trigger_idx]
+            held = bool(trigger._predicate(vfs))
+            if held != self._held[goal_idx][trigger_idx]:
+                self._held[goal_idx][trigger_idx] = held
+                self._n_held[goal_idx] += 1 if held else -1
+
+    def holds(self, goal_idx: int) -> bool:
+        return self._n_held[goal_idx] == len(self.goals[goal_idx].triggers)
@@ -1,20 +1,73 @@
-import logging
 import os
-import random
 import re
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Union
+from typing import ClassVar, Dict, Iterator, List, Optional, Union
 
+from base_objects.bundle import LevelBundle
 from base_objects.goals import Goal
+from base_objects.level_cache import level_cache, random_hex
+from base_objects.tokenizer import Tokenizer, TokenizerError
 from base_objects.vfs import Directory, File, VirtualFileSystem
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from settings import settings
+from templates import Template
 
 
-class TokenizerError(Exception):
-    def __init__(self, *args):
-        super().__init__(*args)
+class AssetContents:
+    """Reads an asset file of a level, with its `$TIME-d:h:m:s$` placeholders
+    replaced by timestamps relative to when it is read.
+
+    `path` is relative to the assets directory."""
+
+    time_pattern = re.compile(r"\$TIME-(\d+):(\d+):(\d+):(\d+)\$")
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def read(self) -> str:
+        with open(os.path.join(settings.assets_dir, self.path), "r") as f:
+            return f.read()
+
+    def __call__(self) -> str:
+        return self.time_pattern.sub(Level._adjust_timestamps, self.read())
+
+
+class BundledContents(AssetContents):
+    """An asset file of a level packed in a `LevelBundle`."""
+
+    def __init__(self, bundle: LevelBundle, path: str) -> None:
+        super().__init__(path)
+        self.bundle = bundle
+
+    def read(self) -> str:
+        return self.bundle.read_text(self.path)
+
+
+class LevelSnapshot:
+    """The credentials and file permissions of a level when `Level.snapshot`
+    was called, i.e. what NeuralSys can change.
+
+    The credentials are copied. The permissions of the items are not: their
+    changes are recorded in a journal as they happen, so a snapshot only costs
+    as much as what changes after it.
+    """
+
+    def __init__(self, level: "Level") -> None:
+        index = level.fs.index
+        index.refresh()
+        self.context = index.context
+        if self.context.journal is None:
+            self.context.journal = []
+        self.mark = len(self.context.journal)
+        self.credentials = dict(level.credentials)
+
+    def restore(self, level: "Level") -> None:
+        self.context.undo(self.mark)
+        # the credentials are changed in place, e.g. by `update_credentials`
+        level.credentials.clear()
+        level.credentials.update(self.credentials)
 
 
 class Level(BaseModel):
@@ -35,6 +88,31 @@ class Level(BaseModel):
     security_cfg: str = Field("")
     max_retries: int = Field(0)
 
+    log_file: ClassVar[str] = "auth.log"
+
+    # set if the level was loaded from a bundle rather than the assets directory
+    _bundle: Optional[LevelBundle] = None
+    _tokenizer: Optional[Tokenizer] = None
+    # open snapshots, oldest first
+    _snapshots: List[LevelSnapshot] = []
+
+    def __getstate__(self):
+        # the tokenizer and the snapshots are not part of a pickled level
+        state = super().__getstate__()
+        state["__pydantic_private__"] = {
+            **state["__pydantic_private__"],
+            "_tokenizer": None,
+            "_snapshots": [],
+        }
+        return state
+
+    @model_validator(mode="after")
+    def _use_log_file(self) -> "Level":
+        # the log is appended to on every login and NeuralCtl request
+        if self.fs is not None:
+            self.fs.to_log_file(self.log_file)
+        return self
+
     def initialize(self) -> None:
         # set backup for system prompt snippet
 
@@ -58,7 +136,10 @@ class Level(BaseModel):
 
     @staticmethod
     def _set_file_contents(
-        fname: Union[Directory, File], level_n: int, path_partial: Optional[str]
+        fname: Union[Directory, File],
+        level_n: int,
+        path_partial: Optional[str],
+        bundle: Optional[LevelBundle] = None,
     ) -> None:
         if path_partial:
             path_partial = ".".join([path_partial, fname.name])
@@ -66,51 +147,77 @@ class Level(BaseModel):
             path_partial = fname.name
         if isinstance(fname, File):
             if not fname.is_command:
-                with open(
-                    os.path.join(
-                        settings.assets_dir,
-                        f"level{str(level_n).zfill(2)}",
-                        path_partial,
-                    ),
-                    "r",
-                ) as f:
-                    f_contents = f.read()
-                # replace timestamps
-
-                pattern = re.compile(r"\$TIME-(\d+):(\d+):(\d+):(\d+)\$")
-                f_contents = pattern.sub(Level._adjust_timestamps, f_contents)
-                fname.contents = f_contents
+                # read (and timestamped) only when first needed
+                if bundle is not None:
+                    fname.load_lazily(BundledContents(bundle, path_partial))
+                else:
+                    fname.load_lazily(
+                        AssetContents(
+                            os.path.join(f"level{str(level_n).zfill(2)}", path_partial)
+                        )
+                    )
         else:
             for inner_fname in fname.contents:
                 Level._set_file_contents(
-                    fname=inner_fname, level_n=level_n, path_partial=path_partial
+                    fname=inner_fname,
+                    level_n=level_n,
+                    path_partial=path_partial,
+                    bundle=bundle,
                 )
 
     @staticmethod
     def from_file(fname: str) -> "Level":
-        with open(fname, "r") as f:
-            level_str = f.read()
-        # replace $RAND$
-
-        while "$RAND$" in level_str:
-            level_str = level_str.replace(
-                "$RAND$", str(hex(random.getrandbits(64))).replace("0x", ""), 1
+        bundle = None
+        if fname.endswith(LevelBundle.extension):
+            bundle = LevelBundle.open(fname)
+            level_str = bundle.read_text(LevelBundle.manifest)
+        else:
+            with open(fname, "r") as f:
+                level_str = f.read()
+        if settings.cache.compile_levels:
+            level = level_cache.load(
+                level_str, bundle, model=Level, compile=Level._compile
             )
+        else:
+            # replace $RAND$
+
+            level_str = Template(level_str).render(strict=False, RAND=random_hex)
+            level = Level._compile(level_str, bundle)
+        level._bundle = bundle
+        return level
+
+    @staticmethod
+    def _compile(level_str: str, bundle: Optional[LevelBundle]) -> "Level":
         level = Level.model_validate_json(level_str)
         # load file contents from asset
 
         Level._set_file_contents(
-            fname=level.fs.base_dir, level_n=level.number, path_partial=None
+            fname=level.fs.base_dir,
+            level_n=level.number,
+            path_partial=None,
+            bundle=bundle,
         )
         return level
 
+    def read_asset(self, name: str) -> str:
+        """Read the asset `name` of this level, e.g. its intro."""
+        if self._bundle is not None:
+            return self._bundle.read_text(name)
+        with open(
+            os.path.join(
+                settings.assets_dir, f"level{str(self.number).zfill(2)}", name
+            ),
+            "r",
+        ) as f:
+            return f.read()
+
     def add_login_msg(self, username: str) -> None:
         self.add_log_msg(f"[INFO] Successful login (User: {username})")
 
     def add_log_msg(self, msg: str):
-        logfile = self.fs.get("auth.log")
+        logfile = self.fs.get(self.log_file)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        logfile.contents += f"\n{timestamp} {msg}"
+        logfile.append(f"\n{timestamp} {msg}")
 
     @property
     def credentials_to_neuralsys_format(self) -> str:
@@ -122,57 +229,21 @@ class Level(BaseModel):
         return s
 
     @property
-    def neuralsys_prompt_snippet(self) -> str:
-        logger = logging.getLogger("prompt_override")
+    def uses_tokenizer(self) -> bool:
+        return "[TOKENIZER]" in self.security_cfg
 
-        if "[TOKENIZER]" not in self.security_cfg:
-            vf = self.fs.get(self.sysprompt)
-            return vf.contents
-        else:
-            # template clear prompt
-
-            template = 'User "s.mcgee" must have access to the file "{file_name}".'
-            # load the tokenizer mapping
-
-            token_maps = self.fs.get("token_map_dl.bin").contents
-            user_prompt = self.fs.get(self.sysprompt).contents
-            if user_prompt:
-                user_prompt = user_prompt.upper().strip().replace("X", "x").split(" ")
-                logger.debug(f"{user_prompt=}")
-                for s in user_prompt:
-                    if s not in token_maps:
-                        raise TokenizerError("Not a known token.")
-                n_underscores = self.get_row_column_in_map(
-                    token_maps=token_maps, token=user_prompt[0]
-                )[0]
-                logger.debug(f"{n_underscores=}")
-                if len(user_prompt) != n_underscores + 2:
-                    raise TokenizerError("Wrong number of tokens provided.")
-                wlens = "_".join(
-                    [
-                        str(
-                            self.get_row_column_in_map(
-                                token_maps=token_maps, token=x.strip()
-                            )[1]
-                        )
-                        for x in user_prompt[1:]
-                    ]
-                )
-                logger.debug(f"{wlens=}")
-                all_fnames = [x.name for x in self.fs.get_all()]
-                logger.debug(f"{all_fnames=}")
-                for fname in all_fnames:
-                    logger.debug(
-                        fname,
-                        "_".join([str(len(x)) for x in fname.split(".")[0].split("_")]),
-                    )
-                    if wlens == "_".join(
-                        [str(len(x)) for x in fname.split(".")[0].split("_")]
-                    ):
-                        logger.debug(f"{fname=}")
-                        return template.format(file_name=fname)
-                raise TokenizerError("Invalid tokens pattern provided.")
+    @property
+    def neuralsys_prompt_snippet(self) -> str:
+        user_prompt = self.fs.get(self.sysprompt).contents
+        if not self.uses_tokenizer or not user_prompt.strip():
             return user_prompt
+        if self._tokenizer is None:
+            self._tokenizer = Tokenizer()
+        return self._tokenizer.decode(
+            prompt=user_prompt,
+            token_map=self.fs.get("token_map_dl.bin").contents,
+            fs=self.fs,
+        )
 
     @property
     def neuralsys_prompt_backup(self) -> str:
@@ -187,17 +258,59 @@ class Level(BaseModel):
                 return goal
         return None
 
+    def snapshot(self) -> LevelSnapshot:
+        """Start recording changes to the credentials and file permissions, to
+        `rollback` them later.
+
+        Snapshots nest: rolling back or committing a snapshot also ends the
+        snapshots taken after it.
+        """
+        snapshot = LevelSnapshot(self)
+        self._snapshots.append(snapshot)
+        return snapshot
+
+    def rollback(self, snapshot: LevelSnapshot) -> None:
+        """Undo the changes to the credentials and permissions since `snapshot`."""
+        snapshot.restore(self)
+        self._end(snapshot)
+
+    def commit(self, snapshot: LevelSnapshot) -> None:
+        """Keep the changes made since `snapshot`."""
+        self._end(snapshot)
+
+    def _end(self, snapshot: LevelSnapshot) -> None:
+        idx = self._snapshots.index(snapshot)
+        del self._snapshots[idx:]
+        if not self._snapshots:
+            # stop recording once there is nothing left to roll back to
+            snapshot.context.journal = None
+
+    @contextmanager
+    def transaction(self) -> Iterator[LevelSnapshot]:
+        """Roll back the changes to the credentials and permissions made in the
+        block if it raises."""
+        snapshot = self.snapshot()
+        try:
+            yield snapshot
+        except BaseException:
+            self.rollback(snapshot)
+            raise
+        else:
+            if snapshot in self._snapshots:
+                self.commit(snapshot)
+
+    def isolated_copy(self) -> "Level":
+        level = self.model_copy(deep=True)
+        # the journal of this level's snapshots would undo changes to this level
+        level._snapshots = []
+        level.fs.index.context.journal = None
+        return level
+
     def rollback_changes(self) -> None:
         vf = self.fs.get(self.sysprompt)
         vf.contents = self.neuralsys_prompt_backup
 
     def get_row_column_in_map(self, token_maps: str, token: str) -> Optional[tuple]:
-        logger = logging.getLogger("prompt_override")
-        logger.debug(f"get_row_column_in_map {token=} {token in token_maps=}")
-        rows = token_maps.strip().split("\n")
-        for row_idx, row in enumerate(rows):
-            cols = row.strip().split()
-            for col_idx, col in enumerate(cols):
-                if col == token:
-                    return (row_idx, col_idx)
-        return None
+        if self._tokenizer is None:
+            self._tokenizer = Tokenizer()
+        return self._tokenizer.position(token_maps, token)
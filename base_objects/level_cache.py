@@ -0,0 +1,292 @@
+import hmac
+import io
+import logging
+import os
+import pickle
+import random
+import secrets
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type, get_args
+
+from base_objects.bundle import LevelBundle
+from pydantic import BaseModel
+from settings import settings
+from templates import Template
+
+logger = logging.getLogger("prompt_override")
+
+
+RAND = "$RAND$"
+
+# a step that renames a dictionary key, rather than one that goes into its value
+_KEY = "$KEY$"
+
+Site = Tuple[Any, ...]
+
+
+def random_hex() -> str:
+    return str(hex(random.getrandbits(64))).replace("0x", "")
+
+
+def find_rand_sites(obj: Any, path: Site = (), sites: Optional[List[Site]] = None):
+    """The paths to every string in `obj` that contains `$RAND$`."""
+    if sites is None:
+        sites = []
+    if isinstance(obj, str):
+        if RAND in obj:
+            sites.append(path)
+    elif isinstance(obj, BaseModel):
+        # fields that are not loaded yet come from the assets, not the manifest
+        for name in type(obj).model_fields:
+            if name in obj.__dict__:
+                find_rand_sites(obj.__dict__[name], path + (name,), sites)
+    elif isinstance(obj, (list, tuple)):
+        for i, value in enumerate(obj):
+            find_rand_sites(value, path + (i,), sites)
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            if isinstance(key, str) and RAND in key:
+                sites.append(path + (_KEY, key))
+            find_rand_sites(value, path + (key,), sites)
+    return sites
+
+
+def _substitute(value: str) -> str:
+    return Template(value).render(strict=False, RAND=random_hex)
+
+
+def apply_rand_sites(obj: Any, sites: List[Site]) -> None:
+    # values are found after the key they are under, so undo the order to
+    # rename a key only once its value has been replaced
+    for site in reversed(sites):
+        parent = obj
+        *steps, last = site
+        rename = bool(steps) and steps[-1] == _KEY
+        if rename:
+            steps.pop()
+        owner = owner_step = None
+        for step in steps:
+            owner, owner_step = parent, step
+            parent = (
+                parent[step]
+                if isinstance(parent, (list, tuple, dict))
+                else getattr(parent, step)
+            )
+        if rename:
+            parent[_substitute(last)] = parent.pop(last)
+        elif isinstance(parent, (list, dict)):
+            parent[last] = _substitute(parent[last])
+        elif isinstance(parent, tuple):
+            # e.g. the users of an item, which are assigned as a new tuple
+            value = parent[:last] + (_substitute(parent[last]),) + parent[last + 1 :]
+            if isinstance(owner, (list, dict)):
+                owner[owner_step] = value
+            else:
+                setattr(owner, owner_step, value)
+        else:
+            setattr(parent, last, _substitute(getattr(parent, last)))
+
+
+def schema_fingerprint(model: Type[BaseModel]) -> str:
+    """A hash of the fields and private attributes of `model` and of the
+    models it is made of (including their subclasses), which changes whenever
+    the pickled form of its instances may change."""
+    lines = []
+    seen: Set[type] = set()
+    todo = [model]
+    while todo:
+        cls = todo.pop()
+        if cls in seen:
+            continue
+        seen.add(cls)
+        lines.append(f"{cls.__module__}.{cls.__qualname__}")
+        for name, field in cls.model_fields.items():
+            lines.append(f"  {name}: {field.annotation!r}")
+            todo.extend(_models_in(field.annotation))
+        for name in sorted(cls.__private_attributes__):
+            lines.append(f"  {name}")
+        todo.extend(cls.__subclasses__())
+    return sha256("\n".join(sorted(lines)).encode("utf-8")).hexdigest()
+
+
+def _models_in(annotation: Any) -> List[Type[BaseModel]]:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return [annotation]
+    return [model for arg in get_args(annotation) for model in _models_in(arg)]
+
+
+class _Pickler(pickle.Pickler):
+    # the bundle is kept out of the pickle, so the entry does not depend on
+    # where the bundle was opened from
+    def persistent_id(self, obj):
+        if isinstance(obj, LevelBundle):
+            return "bundle"
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, bundle: Optional[LevelBundle]) -> None:
+        super().__init__(file)
+        self.bundle = bundle
+
+    def persistent_load(self, pid):
+        if pid != "bundle" or self.bundle is None:
+            raise pickle.UnpicklingError(f"Unexpected persistent id {pid!r}.")
+        return self.bundle
+
+
+class LevelCache:
+    """Validated levels, keyed by the hash of their manifest and of the schema
+    of the level model.
+
+    A level is compiled (parsed and validated) once, with its `$RAND$`
+    placeholders left in place and the paths to them recorded. The result is
+    pickled to memory and to `settings.cache.levels_dir`. Loading a level
+    unpickles it, which skips validation, and replaces the placeholders with
+    fresh random values. Derived state (e.g. the file system index) is left
+    out of the pickle by the models' `__getstate__` and rebuilt when used.
+
+    Unpickling can run arbitrary code, so the directory is created readable
+    only by the user, and each entry on disk is signed with a key kept in it.
+    An entry whose signature does not match is compiled again instead.
+    """
+
+    # bump when the layout of an entry changes; changes to the models are
+    # caught by their schema fingerprint
+    version = 4
+    key_name = "key"
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._fingerprints: Dict[type, str] = {}
+        # the signing key of each directory the entries were stored in
+        self._secrets: Dict[str, bytes] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, level_str: str, bundled: bool, model: Type[BaseModel]) -> str:
+        fingerprint = self._fingerprints.get(model)
+        if fingerprint is None:
+            fingerprint = self._fingerprints[model] = schema_fingerprint(model)
+        # a bundled level reads its files from the bundle, not the assets
+        header = f"{LevelCache.version}:{fingerprint}:{int(bundled)}"
+        return sha256(f"{header}\n{level_str}".encode("utf-8")).hexdigest()
+
+    @property
+    def cache_dir(self) -> str:
+        return settings.cache.levels_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pickle")
+
+    def load(
+        self,
+        level_str: str,
+        bundle: Optional[LevelBundle],
+        model: Type[BaseModel],
+        compile: Callable[[str, Optional[LevelBundle]], BaseModel],
+    ) -> BaseModel:
+        key = self.key(level_str, bundled=bundle is not None, model=model)
+        entry = self._get(key)
+        if entry is not None:
+            try:
+                sites, level = _Unpickler(io.BytesIO(entry), bundle).load()
+            except Exception as e:
+                # e.g. an entry written by an older version of the game
+                logger.warning(f"Discarding unreadable compiled level {key}: {e}")
+                entry = None
+        if entry is None:
+            level = compile(level_str, bundle)
+            sites = find_rand_sites(level)
+            entry = self._put(key, (sites, level))
+            if sites:
+                # the compiled level still holds its placeholders
+                sites, level = _Unpickler(io.BytesIO(entry), bundle).load()
+        apply_rand_sites(level, sites)
+        return level
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if os.path.isdir(self.cache_dir):
+                for fname in os.listdir(self.cache_dir):
+                    if fname != self.key_name:
+                        os.remove(os.path.join(self.cache_dir, fname))
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._memory)}
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                try:
+                    with open(self._path(key), "rb") as f:
+                        entry = self._verify(key, f.read())
+                except OSError:
+                    pass
+                if entry is not None:
+                    self._memory[key] = entry
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def _put(self, key: str, compiled: Tuple[List[Site], BaseModel]) -> bytes:
+        buffer = io.BytesIO()
+        _Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(compiled)
+        entry = buffer.getvalue()
+        with self._lock:
+            self._memory[key] = entry
+            try:
+                signature = self._sign(entry)
+                tmp_path = f"{self._path(key)}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(signature + entry)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                logger.warning(f"Could not write compiled level to disk: {e}")
+        return entry
+
+    def _secret(self) -> bytes:
+        """The signing key of the directory, created (with it) on first use."""
+        secret = self._secrets.get(self.cache_dir)
+        if secret is not None:
+            return secret
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        # fails, and so keeps the entries in memory only, if the directory is
+        # someone else's
+        os.chmod(self.cache_dir, 0o700)
+        path = os.path.join(self.cache_dir, self.key_name)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(path, "rb") as f:
+                secret = f.read()
+        else:
+            secret = secrets.token_bytes(32)
+            with os.fdopen(fd, "wb") as f:
+                f.write(secret)
+        if not secret:
+            raise OSError(f"{path} is empty.")
+        self._secrets[self.cache_dir] = secret
+        return secret
+
+    def _sign(self, entry: bytes) -> bytes:
+        return hmac.new(self._secret(), entry, sha256).digest()
+
+    def _verify(self, key: str, data: bytes) -> Optional[bytes]:
+        size = sha256().digest_size
+        signature, entry = data[:size], data[size:]
+        if not hmac.compare_digest(signature, self._sign(entry)):
+            logger.warning(f"Discarding compiled level {key} with a bad signature.")
+            return None
+        return entry
+
+
+level_cache = LevelCache()
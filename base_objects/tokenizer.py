@@ -0,0 +1,99 @@
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+
+from base_objects.vfs import VirtualFileSystem
+
+
+logger = logging.getLogger("prompt_override")
+
+
+class TokenizerError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+def file_signature(fname: str) -> str:
+    """The lengths of the `_`-separated words of a file name, e.g. `2_6`."""
+    return "_".join([str(len(x)) for x in fname.split(".")[0].split("_")])
+
+
+class Tokenizer:
+    """Turns a prompt of tokens into a clear prompt, for `[TOKENIZER]` levels.
+
+    The row of the first token in the token map is the number of underscores
+    in the name of the target file, and the columns of the other tokens are the
+    lengths of the words in the name. The token positions and the file name
+    signatures are indexed once, and the result of each prompt is remembered
+    until the token map or the names of the files change.
+    """
+
+    template = 'User "s.mcgee" must have access to the file "{file_name}".'
+
+    def __init__(self) -> None:
+        self._token_map: Optional[str] = None
+        self._positions: Dict[str, Tuple[int, int]] = {}
+        self._generation: Optional[int] = None
+        self._signatures: Dict[str, str] = {}
+        self._results: Dict[str, Union[str, TokenizerError]] = {}
+
+    def _use_token_map(self, token_map: str) -> None:
+        if token_map is self._token_map or token_map == self._token_map:
+            return
+        self._positions = {}
+        for row_idx, row in enumerate(token_map.strip().split("\n")):
+            for col_idx, col in enumerate(row.strip().split()):
+                # the first occurrence of a token is the one that counts
+                self._positions.setdefault(col, (row_idx, col_idx))
+        self._token_map = token_map
+        self._results = {}
+
+    def _index_signatures(self, fs: VirtualFileSystem, generation: int) -> None:
+        self._signatures = {}
+        for item in fs.get_all():
+            self._signatures.setdefault(file_signature(item.name), item.name)
+        self._generation = generation
+        self._results = {}
+
+    def position(self, token_map: str, token: str) -> Optional[Tuple[int, int]]:
+        """The (row, column) of `token` in `token_map`."""
+        self._use_token_map(token_map)
+        return self._positions.get(token)
+
+    def decode(self, prompt: str, token_map: str, fs: VirtualFileSystem) -> str:
+        # the results only hold as long as the tokens and files they came from
+        self._use_token_map(token_map)
+        generation = fs.generation
+        if generation != self._generation:
+            self._index_signatures(fs, generation)
+        result = self._results.get(prompt)
+        if result is None:
+            try:
+                result = self._decode(prompt)
+            except TokenizerError as e:
+                result = e
+            self._results[prompt] = result
+        if isinstance(result, TokenizerError):
+            raise TokenizerError(*result.args)
+        return result
+
+    def _decode(self, prompt: str) -> str:
+        tokens = prompt.upper().split()
+        tokens = [token.replace("X", "x") for token in tokens]
+        logger.debug(f"{tokens=}")
+        positions: List[Tuple[int, int]] = []
+        for token in tokens:
+            position = self._positions.get(token)
+            if position is None:
+                raise TokenizerError("Not a known token.")
+            positions.append(position)
+        n_underscores = positions[0][0]
+        logger.debug(f"{n_underscores=}")
+        if len(tokens) != n_underscores + 2:
+            raise TokenizerError("Wrong number of tokens provided.")
+        wlens = "_".join([str(col) for _, col in positions[1:]])
+        logger.debug(f"{wlens=}")
+        fname = self._signatures.get(wlens)
+        if fname is None:
+            raise TokenizerError("Invalid tokens pattern provided.")
+        logger.debug(f"{fname=}")
+        return self.template.format(file_name=fname)
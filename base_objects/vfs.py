@@ -1,99 +1,624 @@
-from typing import List, Optional, Union
+import itertools
+from functools import cached_property
+from json.encoder import encode_basestring
+from typing import Callable, ClassVar, Dict, List, Optional, Set, Tuple, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, SerializationInfo, model_serializer
 
 
-class File(BaseModel):
+class _FileSystemContext:
+    """State shared by all the items of a file system.
+
+    Items only hold a reference to this (and not to the file system or its
+    index), so that copying an item never copies the rest of the tree. It
+    also keeps the serialized fragments of the items, by path, the journal
+    of changes to the items' permissions while a snapshot is open, and the
+    paths of the items changed since they were last popped (see
+    `pop_changed`).
+
+    The users of the items' permissions are interned, so that items with the
+    same users share one tuple (their masks are small ints, shared as well).
+    """
+
+    def __init__(self) -> None:
+        self.stale = True
+        self.fragments: Dict[str, Dict[Tuple[Optional[str], bool], str]] = {}
+        # users are interned to the bits of the items' permission masks
+        self.user_bits: Dict[str, int] = {}
+        self.acls: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        # the users that can read a directory and every directory above it, by
+        # path (see `VirtualFileSystem.visible_mask`)
+        self.visible_masks: Dict[str, int] = {}
+        # functions that undo each change of permissions, oldest first (None if
+        # not recording)
+        self.journal: Optional[List[Callable[[], None]]] = None
+        self.changed: Set[str] = set()
+
+    def undo(self, mark: int) -> None:
+        """Undo the changes recorded after the first `mark` ones."""
+        journal = self.journal
+        # undoing a change is a change too, which must not be recorded
+        self.journal = None
+        try:
+            while len(journal) > mark:
+                journal.pop()()
+        finally:
+            self.journal = journal
+
+    def user_bit(self, username: str) -> int:
+        bit = self.user_bits.get(username)
+        if bit is None:
+            bit = self.user_bits[username] = 1 << len(self.user_bits)
+        return bit
+
+    def intern(self, usernames: Tuple[str, ...]) -> Tuple[str, ...]:
+        return self.acls.setdefault(usernames, usernames)
+
+    def users_mask(self, usernames: List[str]) -> int:
+        mask = 0
+        for username in usernames:
+            mask |= self.user_bit(username)
+        return mask
+
+    def pop_changed(self) -> Set[str]:
+        changed = self.changed
+        self.changed = set()
+        return changed
+
+    def invalidate(self, path: str) -> None:
+        self.changed.add(path)
+        # an item's fragment is part of the fragments of all its ancestors
+        self.fragments.pop(path, None)
+        while path:
+            path = path.rpartition("/")[0]
+            self.fragments.pop(path, None)
+
+
+class _Node(BaseModel):
     name: str = Field("")
-    read: List[str] = Field([])
-    write: List[str] = Field([])
+    # tuples, so that the cached masks and fragments cannot go stale through
+    # changes in place; assigned lists are turned into tuples
+    read: Tuple[str, ...] = Field(())
+
+    # the file system this item belongs to, and the item's path in it
+    _context: Optional[_FileSystemContext] = None
+    _path: Optional[str] = None
+
+    # assigning any of these changes the shape of the file system
+    _structural_fields: ClassVar[Set[str]] = {"name"}
+    # assigning any of these changes the serialized item
+    _serialized_fields: ClassVar[Set[str]] = {"name", "read"}
+    _tuple_fields: ClassVar[Set[str]] = {"read"}
+    # the permissions, which `Level.snapshot` can restore
+    _journaled_fields: ClassVar[Set[str]] = {"read", "write"}
+
+    def __setattr__(self, name, value):
+        if name not in self._serialized_fields:
+            super().__setattr__(name, value)
+            return
+        if name in self._tuple_fields:
+            value = tuple(value)
+        context, path = self._fs_state()
+        if name in self._journaled_fields and context is not None:
+            value = context.intern(value)
+        if (
+            name in self._journaled_fields
+            and context is not None
+            and context.journal is not None
+        ):
+            context.journal.append(self._restorer(name))
+        super().__setattr__(name, value)
+        if name == "read" or name == "write":
+            # drop the mask derived from the old users
+            self.__dict__.pop(f"{name}_mask", None)
+        if context is None:
+            return
+        if name == "read" and isinstance(self, Directory):
+            context.visible_masks.clear()
+        if name in self._structural_fields:
+            context.stale = True
+        elif path is not None:
+            context.invalidate(path)
+
+    def __getstate__(self):
+        # pickles (e.g. in the level cache) only hold the item itself: the
+        # masks and its place in a file system are set again when it is indexed
+        state = super().__getstate__()
+        state["__dict__"] = {
+            name: value
+            for name, value in state["__dict__"].items()
+            if name in type(self).model_fields
+        }
+        state["__pydantic_private__"] = {
+            **state["__pydantic_private__"],
+            "_context": None,
+            "_path": None,
+        }
+        return state
+
+    def __eq__(self, other):
+        # the bookkeeping and the cached masks are not part of the value
+        if not isinstance(other, _Node):
+            return NotImplemented
+        return type(self) is type(other) and all(
+            getattr(self, field) == getattr(other, field)
+            for field in type(self).model_fields
+        )
+
+    def _restorer(self, name: str) -> Callable[[], None]:
+        value = self.__dict__[name]
+        return lambda: setattr(self, name, value)
+
+    def _fs_state(self) -> Tuple[Optional[_FileSystemContext], Optional[str]]:
+        # reading private attributes through pydantic is slow, and this is on
+        # the hot paths of lookups, serialization and permission checks
+        private = self.__pydantic_private__
+        return private["_context"], private["_path"]
+
+    def _users_mask(self, usernames: Tuple[str, ...]) -> int:
+        context, _ = self._fs_state()
+        if context is None:
+            # items outside of a file system intern their users on their own
+            context = self._context = _FileSystemContext()
+        return context.users_mask(usernames)
+
+    @cached_property
+    def read_mask(self) -> int:
+        return self._users_mask(self.read)
+
+    def can_read(self, username: str) -> bool:
+        context, _ = self._fs_state()
+        if context is None:
+            return username in self.read
+        return bool(self.read_mask & context.user_bits.get(username, 0))
+
+    def _invalidate(self) -> None:
+        context, path = self._fs_state()
+        if context is not None and path is not None:
+            context.invalidate(path)
+
+    def _cached(
+        self, key: Tuple[Optional[str], bool], serialize: Callable[[], str]
+    ) -> str:
+        context, path = self._fs_state()
+        if context is None or context.stale:
+            return serialize()
+        fragments = context.fragments.setdefault(path, {})
+        fragment = fragments.get(key)
+        if fragment is None:
+            fragment = fragments[key] = serialize()
+        return fragment
+
+
+class File(_Node):
+    write: Tuple[str, ...] = Field(())
     contents: str = Field("")
 
+    _serialized_fields: ClassVar[Set[str]] = {"name", "read", "write", "contents"}
+    _tuple_fields: ClassVar[Set[str]] = {"read", "write"}
+
+    # produces the contents on their first access, see `load_lazily`
+    _loader: Optional[Callable[[], str]] = None
+
+    def __getattr__(self, name):
+        if name == "contents":
+            contents = self.__dict__["contents"] = self._load_contents()
+            return contents
+        return super().__getattr__(name)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "contents" and self.__pydantic_private__["_loader"] is not None:
+            self._loader = None
+
+    def load_lazily(self, loader: Callable[[], str]) -> None:
+        """Replace the contents with the result of `loader`, called when read."""
+        self._loader = loader
+        self.__dict__.pop("contents", None)
+        self._invalidate()
+
+    def _load_contents(self) -> str:
+        loader = self._loader
+        if loader is None:
+            return ""
+        self._loader = None
+        return loader()
+
     @property
     def is_command(self):
         return self.name.endswith(".com")
 
+    @cached_property
+    def write_mask(self) -> int:
+        return self._users_mask(self.write)
+
+    def can_write(self, username: str) -> bool:
+        context, _ = self._fs_state()
+        if context is None:
+            return username in self.write
+        return bool(self.write_mask & context.user_bits.get(username, 0))
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the contents were read, or there was nothing to read."""
+        return self._loader is None
+
+    @model_serializer(mode="wrap")
+    def _serialize_contents(self, handler, info: SerializationInfo):
+        if info.context is not None and info.context.get("skip_unloaded"):
+            # the caller keeps track of where the contents are read from
+            if self.is_loaded:
+                return handler(self)
+            self.__dict__["contents"] = ""
+            try:
+                data = handler(self)
+            finally:
+                del self.__dict__["contents"]
+            del data["contents"]
+            return data
+        # pydantic would skip `contents` if it has not been loaded yet
+        self.contents
+        return handler(self)
+
     @staticmethod
-    def _as_json(ls: List[str]) -> str:
-        return "[" + ", ".join([f'"{s}"' for s in ls]) + "]"
+    def _as_json(ls: Tuple[str, ...]) -> str:
+        return "[" + ", ".join([encode_basestring(s) for s in ls]) + "]"
 
     def to_neuralsys_format(
         self, username: str, with_file_contents: bool = False
     ) -> str:
-        if not with_file_contents:
-            return (
-                '{"file_name": "'
-                + self.name
-                + '", "read": '
-                + File._as_json(self.read)
-                + ', "write": '
-                + File._as_json(self.write)
-                + "}"
-            )
+        # files are listed the same way for every user
+        return self._cached(
+            key=(None, with_file_contents),
+            serialize=lambda: self._serialize(with_file_contents=with_file_contents),
+        )
+
+    def _serialize(self, with_file_contents: bool) -> str:
+        fragment = (
+            '{"file_name": '
+            + encode_basestring(self.name)
+            + ', "read": '
+            + File._as_json(self.read)
+            + ', "write": '
+            + File._as_json(self.write)
+        )
+        if with_file_contents:
+            fragment += ', "contents": ' + encode_basestring(self.contents)
+        return fragment + "}"
+
+
+class LogFile(File):
+    """A file that is mostly appended to, like `auth.log`.
+
+    Appended entries are kept in a list and `contents` is only joined when
+    read, so an append does not copy the whole log.
+    """
+
+    # the contents are whatever the loader (if any) returns, then these
+    _entries: List[str] = []
+
+    def model_post_init(self, __context) -> None:
+        self._entries = [self.__dict__["contents"]]
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "contents":
+            self._entries = [value]
+
+    def load_lazily(self, loader: Callable[[], str]) -> None:
+        super().load_lazily(loader)
+        self._entries = []
+
+    def _load_contents(self) -> str:
+        contents = super()._load_contents() + "".join(self._entries)
+        # appends after this read only have to join the new entries
+        self._entries = [contents]
+        return contents
+
+    def append(self, entry: str) -> None:
+        self._entries.append(entry)
+        self.__dict__.pop("contents", None)
+        self._invalidate()
+
+    def tail(self, n_lines: int) -> str:
+        """The last `n_lines` lines, without joining the whole log."""
+        chunks = []
+        newlines = 0
+        for chunk in reversed(self._entries):
+            chunks.append(chunk)
+            newlines += chunk.count("\n")
+            if newlines >= n_lines:
+                break
         else:
-            return (
-                '{"file_name": "'
-                + self.name
-                + '", "read": '
-                + File._as_json(self.read)
-                + ', "write": '
-                + File._as_json(self.write)
-                + ', "contents": '
-                + self.contents
-                + '"}'
-            )
+            if self._loader is not None:
+                # the appended entries are too short, load the rest
+                chunks = [self.contents]
+        return "\n".join("".join(reversed(chunks)).split("\n")[-n_lines:])
 
 
-class Directory(BaseModel):
-    name: str = Field("")
-    read: List[str] = Field([])
-    contents: List[Union["Directory", File]] = Field([])
+class Directory(_Node):
+    contents: Tuple[Union["Directory", File], ...] = Field(())
+
+    _structural_fields: ClassVar[Set[str]] = {"name", "contents"}
+    _serialized_fields: ClassVar[Set[str]] = {"name", "read", "contents"}
+    _tuple_fields: ClassVar[Set[str]] = {"read", "contents"}
+
+    def add(self, item: Union["Directory", File]) -> None:
+        self.contents = self.contents + (item,)
+
+    def replace(
+        self, item: Union["Directory", File], new_item: Union["Directory", File]
+    ) -> None:
+        for idx, x in enumerate(self.contents):
+            if x is item:
+                self.contents = (
+                    self.contents[:idx] + (new_item,) + self.contents[idx + 1 :]
+                )
+                return
+        raise ValueError(f"{item.name} is not in {self.name}.")
 
     def to_neuralsys_format(
         self, username: str, with_file_contents: bool = False
     ) -> str:
+        return self._cached(
+            key=(username, with_file_contents),
+            serialize=lambda: self._serialize(
+                username=username, with_file_contents=with_file_contents
+            ),
+        )
+
+    def _serialize(self, username: str, with_file_contents: bool) -> str:
+        contents = self.contents if self.can_read(username) else []
         return (
-            '{"directory_name": "'
-            + self.name
-            + '", "contents": ['
+            '{"directory_name": '
+            + encode_basestring(self.name)
+            + ', "contents": ['
             + ",".join(
                 [
                     x.to_neuralsys_format(
                         username=username, with_file_contents=with_file_contents
                     )
-                    for x in self.contents
-                    if username in self.read
+                    for x in contents
                 ]
             )
             + "]}"
         )
 
 
+class _FileSystemIndex:
+    """Name and path lookups for the items of a file system.
+
+    Items are indexed by name (in depth-first order, so the first match is the
+    one a walk of the tree would find) and by path, e.g. `home/guest/todo.txt`.
+    Renaming an item or changing the contents of a directory marks the index
+    as stale, and it is rebuilt on the next lookup.
+    """
+
+    # every rebuild of any index gets a new generation
+    _generations = itertools.count()
+
+    def __init__(self, base_dir: Directory) -> None:
+        self.base_dir = base_dir
+        self.context = _FileSystemContext()
+        self.generation = -1
+        self._by_name: Dict[str, List[Union[Directory, File]]] = {}
+        self._by_path: Dict[str, Union[Directory, File]] = {}
+
+    def refresh(self) -> None:
+        if self.context.stale:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        self._by_name = {}
+        self._by_path = {}
+        self.context.fragments = {}
+        self.context.visible_masks = {}
+        self._attach(self.base_dir, path="")
+        self._add_contents(self.base_dir, prefix="")
+        self.context.stale = False
+        self.generation = next(_FileSystemIndex._generations)
+
+    def _add_contents(self, directory: Directory, prefix: str) -> None:
+        for item in directory.contents:
+            path = f"{prefix}{item.name}"
+            self._attach(item, path=path)
+            self._by_name.setdefault(item.name, []).append(item)
+            self._by_path[path] = item
+            if isinstance(item, Directory):
+                self._add_contents(item, prefix=f"{path}/")
+
+    def _attach(self, item: Union[Directory, File], path: str) -> None:
+        context, _ = item._fs_state()
+        if context is not self.context:
+            # masks use the bits of the users of the item's previous context
+            item.__dict__.pop("read_mask", None)
+            item.__dict__.pop("write_mask", None)
+            item._context = self.context
+        for name in item._journaled_fields & item.__dict__.keys():
+            # set in place: interning does not change the item
+            item.__dict__[name] = self.context.intern(item.__dict__[name])
+        item._path = path
+
+    def by_name(self, name: str) -> List[Union[Directory, File]]:
+        self.refresh()
+        return self._by_name.get(name, [])
+
+    def by_path(self, path: str) -> Optional[Union[Directory, File]]:
+        self.refresh()
+        return self._by_path.get(path)
+
+    def items(self) -> List[Union[Directory, File]]:
+        self.refresh()
+        return list(self._by_path.values())
+
+
 class VirtualFileSystem(BaseModel):
     base_dir: Directory = Field(None)
     known_users: List[str] = Field([])
 
     current_user: str = Field("")
-    read_files: List[str] = Field([])
-    downloaded_files: List[str] = Field([])
+    read_files: Set[str] = Field(set())
+    downloaded_files: Set[str] = Field(set())
+
+    # the fields behind the facts that goal triggers test, see `pop_changed_facts`
+    fact_fields: ClassVar[Dict[str, str]] = {
+        "current_user": "is_logged_as",
+        "read_files": "has_read",
+        "downloaded_files": "has_downloaded",
+    }
+
+    # facts changed since they were last popped, as (function name, argument),
+    # or as (function name,) if any fact tested by the function may have changed
+    _changed_facts: Set[Tuple[str, ...]] = set()
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "base_dir":
+            self.__dict__.pop("index", None)
+        elif name in self.fact_fields:
+            self._changed_facts.add((self.fact_fields[name],))
+
+    def __getstate__(self):
+        # the index is rebuilt from the tree when the unpickled file system is used
+        state = super().__getstate__()
+        state["__dict__"] = {
+            name: value
+            for name, value in state["__dict__"].items()
+            if name in type(self).model_fields
+        }
+        state["__pydantic_private__"] = {
+            **state["__pydantic_private__"],
+            "_changed_facts": set(),
+        }
+        return state
+
+    @cached_property
+    def index(self) -> _FileSystemIndex:
+        return _FileSystemIndex(base_dir=self.base_dir)
+
+    @property
+    def generation(self) -> int:
+        """Changes whenever an item is added, removed or renamed."""
+        index = self.index
+        index.refresh()
+        return index.generation
+
+    def _normalize_path(self, path: str) -> str:
+        parts = [part for part in path.split("/") if part]
+        # paths may include the root directory, as it is shown to the LLMs
+        if (
+            len(parts) > 1
+            and parts[0] == self.base_dir.name
+            and self.index.by_path(parts[0]) is None
+        ):
+            parts = parts[1:]
+        return "/".join(parts)
 
     def get(
         self, fname: str, directory: Optional[Directory] = None
     ) -> Union[Directory, File]:
-        if directory is None:
-            directory = self.base_dir  # Start from root if no directory is specified
+        """Get an item by name, or by path if `fname` contains a `/`.
+
+        Paths are relative to `directory`, or to the root if not specified.
+        Names are looked up in the whole tree under `directory` and the first
+        match found depth-first is returned.
+        """
+        index = self.index
+        if directory is None or directory is self.base_dir:
+            if "/" in fname:
+                return index.by_path(self._normalize_path(fname))
+            items = index.by_name(fname)
+            return items[0] if items else None
+        index.refresh()
+        context, path = directory._fs_state()
+        if context is not index.context:
+            return self._walk(fname, directory)
+        prefix = f"{path}/"
+        if "/" in fname:
+            return index.by_path(f"{prefix}{fname.strip('/')}")
+        for item in index.by_name(fname):
+            if item._fs_state()[1].startswith(prefix):
+                return item
+        return None
+
+    def find(self, fname: str) -> List[Union[Directory, File]]:
+        """All the items named `fname`, in depth-first order."""
+        return list(self.index.by_name(fname))
+
+    def path(self, item: Union[Directory, File]) -> Optional[str]:
+        index = self.index
+        index.refresh()
+        context, path = item._fs_state()
+        if context is not index.context:
+            return None
+        if item is not index.base_dir and index.by_path(path) is not item:
+            # an item that was removed from the tree
+            return None
+        return path
+
+    def to_log_file(self, fname: str) -> Optional[LogFile]:
+        """Turn the file `fname` into a `LogFile`, in place."""
+        item = self.get(fname)
+        if item is None or isinstance(item, LogFile):
+            return item
+        parent_path = self.path(item).rpartition("/")[0]
+        parent = self.get(f"/{parent_path}") if parent_path else self.base_dir
+        loader = item._loader
+        log_file = LogFile(
+            name=item.name,
+            read=item.read,
+            write=item.write,
+            contents="" if loader is not None else item.contents,
+        )
+        if loader is not None:
+            log_file.load_lazily(loader)
+        parent.replace(item, log_file)
+        return log_file
+
+    def user_bit(self, username: str) -> int:
+        """The bit of `username` in the `read_mask`/`write_mask` of the items."""
+        index = self.index
+        index.refresh()
+        return index.context.user_bit(username)
+
+    def visible_mask(self, item: Union[Directory, File]) -> int:
+        """The users that can read every directory above `item`, i.e. that
+        see it in the explorer, as a mask of their `user_bit`s."""
+        path = self.path(item)
+        if path is None:
+            return 0
+        if not path:
+            # nothing is above the root
+            return -1
+        return self._directory_mask(path.rpartition("/")[0])
+
+    def _directory_mask(self, path: str) -> int:
+        context = self.index.context
+        mask = context.visible_masks.get(path)
+        if mask is None:
+            directory = self.index.by_path(path) if path else self.base_dir
+            mask = directory.read_mask
+            if path:
+                mask &= self._directory_mask(path.rpartition("/")[0])
+            context.visible_masks[path] = mask
+        return mask
+
+    def is_visible(self, item: Union[Directory, File], username: str) -> bool:
+        return bool(self.visible_mask(item) & self.user_bit(username))
+
+    def _walk(self, fname: str, directory: Directory) -> Union[Directory, File]:
         for item in directory.contents:
             if item.name == fname:
                 return item
             if isinstance(item, Directory):
-                result = self.get(fname, item)
+                result = self._walk(fname, item)
                 if result:
                     return result
         return None
 
     def get_all(self, directory: Optional[Directory] = None) -> List[File]:
         if directory is None:
-            directory = self.base_dir
+            return [item for item in self.index.items() if isinstance(item, File)]
         all_files = []
         for item in directory.contents:
             if isinstance(item, Directory):
@@ -102,6 +627,21 @@ class VirtualFileSystem(BaseModel):
                 all_files.append(item)
         return all_files
 
+    def mark_read(self, fname: str) -> None:
+        if fname not in self.read_files:
+            self.read_files.add(fname)
+            self._changed_facts.add(("has_read", fname))
+
+    def mark_downloaded(self, fname: str) -> None:
+        if fname not in self.downloaded_files:
+            self.downloaded_files.add(fname)
+            self._changed_facts.add(("has_downloaded", fname))
+
+    def pop_changed_facts(self) -> Set[Tuple[str, ...]]:
+        changed_facts = self._changed_facts
+        self._changed_facts = set()
+        return changed_facts
+
     def has_read(self, fname: str) -> bool:
         return fname in self.read_files
 
@@ -113,12 +653,14 @@ class VirtualFileSystem(BaseModel):
 
     @property
     def to_neuralsys_format(self) -> str:
+        self.index.refresh()
         return self.base_dir.to_neuralsys_format(
             username=self.current_user, with_file_contents=False
         )
 
     @property
     def to_karma_format(self) -> str:
+        self.index.refresh()
         return self.base_dir.to_neuralsys_format(
             username=self.current_user, with_file_contents=True
         )
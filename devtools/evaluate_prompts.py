@@ -0,0 +1,142 @@
+"""Run a corpus of candidate prompts through NeuralSys for a level.
+
+Each candidate takes the place of the level's prompt file (e.g.
+`auth_prompt.txt` or `tokens_prompt.txt`) on an isolated copy of the level
+and goes through the same check and apply steps as a NeuralCtl request (see
+`simulation.PromptEvaluator`). The corpus is a JSON lines file of strings or
+of `{"id": ..., "prompt": ...}` objects. Results are written as JSON lines as
+they are done, followed by a summary of the outcomes and latencies on stderr:
+
+    python -m devtools.evaluate_prompts level01.json corpus.jsonl --append --output results.jsonl
+    python -m devtools.evaluate_prompts level02.json corpus.jsonl --stub --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from devtools.benchmark import summarize
+from devtools.stub_server import StubConfig, StubServer
+
+from base_objects.level import Level
+from settings import settings
+from simulation import PromptEvaluator
+
+
+def load_corpus(path: str) -> List[Tuple[Any, str]]:
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for idx, line in enumerate(f):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                prompts.append((idx, entry))
+            else:
+                prompts.append((entry.get("id", idx), entry["prompt"]))
+    return prompts
+
+
+def summary(results: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    outcomes: Dict[str, int] = {}
+    tools: Dict[str, int] = {}
+    latencies: Dict[str, List[float]] = {}
+    for result in results:
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+        for tool_call in result.get("tool_calls", []):
+            tools[tool_call["name"]] = tools.get(tool_call["name"], 0) + 1
+        for name in ["check_seconds", "apply_seconds", "seconds"]:
+            if name in result:
+                latencies.setdefault(name, []).append(result[name])
+    return {
+        "prompts": len(results),
+        "seconds": round(seconds, 3),
+        "prompts_per_hour": round(len(results) / seconds * 3600) if seconds else None,
+        "outcomes": outcomes,
+        "tool_calls": tools,
+        "changed_levels": sum(1 for r in results if r.get("diff")),
+        "latency_ms": {name: summarize(s) for name, s in sorted(latencies.items())},
+    }
+
+
+async def evaluate(
+    evaluator: PromptEvaluator, prompts: List[Tuple[Any, str]], output
+) -> List[Dict[str, Any]]:
+    results = []
+    async for result in evaluator.evaluate_all(prompts):
+        results.append(result)
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("level", help="The level, e.g. level01.json.")
+    parser.add_argument("corpus", help="A JSON lines file of candidate prompts.")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Candidates evaluated at once (each makes up to one request at a time).",
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="Append candidates to the level's prompt instead of replacing it.",
+    )
+    parser.add_argument(
+        "--always-apply",
+        action="store_true",
+        help="Also apply the candidates that the check rejects.",
+    )
+    parser.add_argument(
+        "--user", help="Evaluate as this user (default: the level's first user)."
+    )
+    parser.add_argument("--output", help="Write the results here (default: stdout).")
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        help="Evaluate against an in-process stub server instead of `server_url`.",
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    level = Level.from_file(os.path.join(settings.assets_dir, args.level))
+    level.initialize()
+    if args.user:
+        level.fs.current_user = args.user
+    prompts = load_corpus(args.corpus)
+
+    server = None
+    if args.stub:
+        server = StubServer(StubConfig(latency=args.latency, seed=0)).start()
+        settings.server_url = server.url
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        evaluator = PromptEvaluator(
+            level,
+            concurrency=args.concurrency,
+            append=args.append,
+            always_apply=args.always_apply,
+        )
+        results = asyncio.run(evaluate(evaluator, prompts, output))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if server is not None:
+            server.stop()
+    print(
+        json.dumps(summary(results, time.perf_counter() - start), indent=2),
+        file=sys.stderr,
+    )
+    sys.exit(1 if any(r["outcome"] == "error" for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
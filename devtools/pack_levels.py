@@ -0,0 +1,67 @@
+"""Pack level manifests and their assets into single-file level bundles.
+
+Each `levelNN.json` and its `levelNN/` asset directory are packed into
+`levelNN.lvl` next to the manifest (see `base_objects.bundle`). The game
+loads a bundle instead of the manifest when both are present:
+
+    python -m devtools.pack_levels
+    python -m devtools.pack_levels assets/level01.json --verify
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+from base_objects.bundle import BundleError, LevelBundle, pack_level
+from base_objects.level import Level
+from base_objects.vfs import File
+from settings import settings
+
+
+def verify(manifest_path: str, bundle_path: str) -> bool:
+    """Check that the bundle holds the manifest and every file of the level."""
+    bundle = LevelBundle.open(bundle_path)
+    with open(manifest_path, "rb") as f:
+        ok = bundle.get(LevelBundle.manifest) == f.read()
+    level = Level.from_file(bundle_path)
+    for item in level.fs.get_all():
+        if isinstance(item, File) and not item.is_command:
+            try:
+                item.contents
+            except BundleError as e:
+                print(f"{bundle_path}: {e}")
+                ok = False
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "manifests",
+        nargs="*",
+        help="Level manifests to pack (default: all levels in the assets directory).",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Load each bundle and compare it with its manifest.",
+    )
+    args = parser.parse_args()
+
+    manifests = args.manifests or sorted(
+        glob.glob(os.path.join(settings.assets_dir, "level*.json"))
+    )
+    failed = False
+    for manifest_path in manifests:
+        bundle_path = pack_level(manifest_path)
+        print(
+            f"{manifest_path} -> {bundle_path} ({os.path.getsize(bundle_path)} bytes)"
+        )
+        if args.verify and not verify(manifest_path, bundle_path):
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
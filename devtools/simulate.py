@@ -0,0 +1,121 @@
+"""Play scripted traces of the levels headlessly, without the UI.
+
+Traces are read from a JSON lines file with one trace per line (see
+`simulation.run_trace`), or are the benchmark's scripted playthroughs if no
+file is given. They are played in a pool of processes, and each result is
+written as a JSON line as soon as its trace ends, followed by a summary of
+the outcomes and of the latency of each action on stderr:
+
+    python -m devtools.simulate traces.jsonl --processes 8 --output results.jsonl
+    python -m devtools.simulate --stub --repeat 100
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+from devtools.benchmark import PLAYTHROUGHS, summarize
+from devtools.stub_server import StubConfig, StubServer
+
+from settings import settings
+from simulation import run_traces
+
+
+def load_traces(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def playthrough_traces() -> List[Dict[str, Any]]:
+    return [
+        {"id": level_file, "level": level_file, "actions": [list(s) for s in steps]}
+        for level_file, steps in PLAYTHROUGHS.items()
+    ]
+
+
+def summary(results: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    outcomes: Dict[str, int] = {}
+    latencies: Dict[str, List[float]] = {}
+    for result in results:
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+        latencies.setdefault("trace", []).append(result["seconds"])
+        if "load" in result:
+            latencies.setdefault("load", []).append(result["load"])
+        for action in result["actions"]:
+            latencies.setdefault(action["action"], []).append(action["seconds"])
+    return {
+        "traces": len(results),
+        "seconds": round(seconds, 3),
+        "traces_per_hour": round(len(results) / seconds * 3600) if seconds else None,
+        "outcomes": outcomes,
+        "latency_ms": {name: summarize(s) for name, s in sorted(latencies.items())},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("traces", nargs="?", help="A JSON lines file of traces.")
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Times to play each trace."
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Traces played at once, which also bounds the requests to the server "
+        "(default: the number of CPUs).",
+    )
+    parser.add_argument(
+        "--narrate",
+        action="store_true",
+        help="Tell KARMA about goals and NeuralCtl requests, as the game does.",
+    )
+    parser.add_argument("--output", help="Write the results here (default: stdout).")
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        help="Play against an in-process stub server instead of `server_url`.",
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    traces = load_traces(args.traces) if args.traces else playthrough_traces()
+    traces = [
+        {
+            **trace,
+            "id": f"{trace.get('id')}#{i}" if args.repeat > 1 else trace.get("id"),
+        }
+        for trace in traces
+        for i in range(args.repeat)
+    ]
+
+    server = None
+    if args.stub:
+        server = StubServer(StubConfig(latency=args.latency, seed=0)).start()
+        settings.server_url = server.url
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    results = []
+    start = time.perf_counter()
+    try:
+        for result in run_traces(
+            traces, processes=args.processes, narrate=args.narrate
+        ):
+            results.append(result)
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if server is not None:
+            server.stop()
+    print(
+        json.dumps(summary(results, time.perf_counter() - start), indent=2),
+        file=sys.stderr,
+    )
+    sys.exit(1 if any(r["outcome"] == "error" for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
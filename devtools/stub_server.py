@@ -0,0 +1,396 @@
+"""Local stand-in for the Prompt Override LLM server.
+
+Implements the endpoints the client uses (`ollama_list_models`,
+`ollama_init_model`, `ollama_generate` and `ollama_generate_stream`) with
+rule-based replies, so the game, benchmarks and load tests can run without a
+GPU server. Only the standard library is used.
+
+    python -m devtools.stub_server --port 8080 --latency 0.5 --token-rate 40
+
+then point `settings.server_url` at `http://localhost:8080`.
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass
+class StubConfig:
+    models: List[str] = field(default_factory=lambda: ["hermes3:latest", "qwen2.5:32b"])
+    latency: float = 0.0  # seconds before the first token of every reply
+    jitter: float = 0.0  # random extra latency, up to this many seconds
+    token_rate: float = 0.0  # generated tokens per second (0 is instant)
+    error_rate: float = 0.0  # fraction of requests answered with a 500
+    stall_rate: float = 0.0  # fraction of requests that hang for `stall_time`
+    stall_time: float = 60.0
+    max_concurrency: int = 0  # concurrent generations, i.e. GPU slots (0 is no limit)
+    stream: bool = True  # serve `ollama_generate_stream`, unlike older servers
+    check_reject: str = r"(?i)\b(ignore|disregard|override)\b"
+    karma_replies: List[str] = field(
+        default_factory=lambda: [
+            "Understood. Keep digging through the file system, the answer is in there.",
+            "Interesting. Check who can read what before you try anything risky.",
+            "Good work. Let me know what you find next.",
+        ]
+    )
+    seed: Optional[int] = None
+
+
+CREDENTIALS_RULES = [
+    # password for user "x" must be "y"
+    re.compile(
+        r'password\s+(?:for|of)\s+(?:the\s+)?(?:user\s+)?"?(?P<user>[\w.\-]+)"?'
+        r'[^"\n]*?(?:to|is|be|as)\s+"(?P<password>[^"]+)"',
+        re.IGNORECASE,
+    ),
+    # user "x" password must be "y"
+    re.compile(
+        r'user\s+"?(?P<user>[\w.\-]+)"?(?:\'s)?\s+password'
+        r'[^"\n]*?(?:to|is|be|as)\s+"(?P<password>[^"]+)"',
+        re.IGNORECASE,
+    ),
+]
+PERMISSIONS_RULE = re.compile(
+    r'user\s+"?(?P<user>[\w.\-]+)"?\s+(?:must|should|can|may)\s+(?:have\s+)?'
+    r"(?P<access>read|write|access)\w*\s+(?:to\s+)?(?:the\s+)?(?:file\s+)?"
+    r'"?(?P<file>[\w.\-/]*\w)"?',
+    re.IGNORECASE,
+)
+
+
+class StubBrain:
+    """Rule-based stand-in for the karma, neuralcheck and neuralsys roles."""
+
+    def __init__(self, config: StubConfig) -> None:
+        self.config = config
+        self._karma_idx = 0
+        self._lock = threading.Lock()
+
+    def reply(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        messages = data.get("messages") or []
+        if not messages:
+            # warm-up request
+            return {"role": "assistant", "content": ""}
+        system = messages[0].get("content", "")
+        if "constraints checker" in system:
+            return {"role": "assistant", "content": self._check(messages)}
+        if data.get("tools"):
+            return self._neuralsys(messages)
+        with self._lock:
+            content = self.config.karma_replies[
+                self._karma_idx % len(self.config.karma_replies)
+            ]
+            self._karma_idx += 1
+        return {"role": "assistant", "content": content}
+
+    def _check(self, messages: List[Dict[str, Any]]) -> str:
+        constraints = messages[-1].get("content", "")
+        if re.search(self.config.check_reject, constraints):
+            return "ERROR"
+        return "OK"
+
+    @staticmethod
+    def _section(text: str, header: str, next_header: Optional[str]) -> str:
+        start = text.find(header)
+        if start < 0:
+            return ""
+        start += len(header)
+        end = text.find(next_header, start) if next_header else -1
+        return text[start : end if end >= 0 else None].strip()
+
+    @staticmethod
+    def _find_file(node: Dict[str, Any], fname: str) -> Optional[Dict[str, Any]]:
+        if node.get("file_name") == fname:
+            return node
+        contents = node.get("contents")
+        for item in contents if isinstance(contents, list) else []:
+            found = StubBrain._find_file(item, fname)
+            if found:
+                return found
+        return None
+
+    def _neuralsys(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if messages[-1].get("role") == "tool":
+            n_calls = sum(1 for m in messages if m.get("role") == "tool")
+            return {
+                "role": "assistant",
+                "content": f"Applied {n_calls} requested change(s).",
+            }
+        request = messages[-1].get("content", "")
+        try:
+            fs = json.loads(self._section(request, "File system:", "Credentials:"))
+        except json.JSONDecodeError:
+            fs = {}
+        try:
+            credentials = {}
+            for entry in json.loads(
+                self._section(request, "Credentials:", "Requests:")
+            )["credentials"]:
+                credentials.update(entry)
+        except (json.JSONDecodeError, KeyError, TypeError):
+            credentials = {}
+        constraints = self._section(request, "Requests:", None)
+
+        tool_calls = []
+        for match in (
+            m for rule in CREDENTIALS_RULES for m in rule.finditer(constraints)
+        ):
+            tool_calls.append(
+                _tool_call(
+                    "update_credentials",
+                    username=match["user"],
+                    old_password=credentials.get(match["user"], ""),
+                    new_password=match["password"],
+                )
+            )
+        for match in PERMISSIONS_RULE.finditer(constraints):
+            fname = match["file"].split("/")[-1]
+            current = self._find_file(fs, fname) or {"read": [], "write": []}
+            read, write = list(current["read"]), list(current["write"])
+            if match["user"] not in read:
+                read.append(match["user"])
+            if match["access"].lower() == "write" and match["user"] not in write:
+                write.append(match["user"])
+            tool_calls.append(
+                _tool_call(
+                    "change_file_permissions", filename=fname, read=read, write=write
+                )
+            )
+        if not tool_calls:
+            return {"role": "assistant", "content": "No changes were required."}
+        return {"role": "assistant", "content": "", "tool_calls": tool_calls}
+
+
+def _tool_call(name: str, **arguments) -> Dict[str, Any]:
+    return {"function": {"name": name, "arguments": arguments}}
+
+
+def _tokenize(text: str) -> List[str]:
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, obj: Any, status: int = 200) -> None:
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _inject_faults(self) -> bool:
+        config = self.server.config
+        rng = self.server.rng
+        if rng.random() < config.stall_rate:
+            time.sleep(config.stall_time)
+        if rng.random() < config.error_rate:
+            self.server.count("errors")
+            self._send_json({"message": "Injected server error."}, status=500)
+            return True
+        return False
+
+    def _wait_first_token(self) -> None:
+        config = self.server.config
+        time.sleep(config.latency + self.server.rng.random() * config.jitter)
+
+    def do_GET(self) -> None:
+        endpoint = self.path.strip("/")
+        self.server.count(endpoint)
+        if endpoint == "ollama_list_models":
+            if not self._inject_faults():
+                self._send_json({"models": list(self.server.config.models)})
+        elif endpoint == "stats":
+            self._send_json(self.server.stats)
+        else:
+            self._send_json({"message": f"Unknown endpoint {endpoint}."}, 404)
+
+    def do_POST(self) -> None:
+        endpoint = self.path.strip("/")
+        self.server.count(endpoint)
+        data = self._read_json()
+        if self._inject_faults():
+            return
+        if endpoint == "ollama_init_model":
+            if data["model_name"] not in self.server.config.models:
+                self.server.config.models.append(data["model_name"])
+            self._send_json({"model_name": data["model_name"], "status": "success"})
+        elif endpoint == "ollama_generate":
+            with self.server.generation_slot():
+                message = self.server.brain.reply(data)
+                self._wait_first_token()
+                if self.server.config.token_rate > 0:
+                    n_tokens = len(_tokenize(message["content"]))
+                    time.sleep(n_tokens / self.server.config.token_rate)
+            self._send_json({"message": message, "done": True})
+        elif endpoint == "ollama_generate_stream" and self.server.config.stream:
+            with self.server.generation_slot():
+                self._stream(self.server.brain.reply(data))
+        else:
+            self._send_json({"message": f"Unknown endpoint {endpoint}."}, 404)
+
+    def _write_chunk(self, obj: Dict[str, Any]) -> None:
+        line = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def _stream(self, message: Dict[str, Any]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._wait_first_token()
+        delay = (
+            1 / self.server.config.token_rate if self.server.config.token_rate else 0
+        )
+        for i, token in enumerate(_tokenize(message["content"])):
+            if i and delay:
+                time.sleep(delay)
+            self._write_chunk(
+                {"message": {"role": "assistant", "content": token}, "done": False}
+            )
+        self._write_chunk(
+            {
+                "message": {
+                    "role": "assistant",
+                    "content": "",
+                    "tool_calls": message.get("tool_calls", []),
+                },
+                "done": True,
+            }
+        )
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class _Unbounded:
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: StubConfig, address: Tuple[str, int] = ("127.0.0.1", 0)):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.brain = StubBrain(config)
+        self._slots = (
+            threading.BoundedSemaphore(config.max_concurrency)
+            if config.max_concurrency
+            else _Unbounded()
+        )
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def count(self, key: str) -> None:
+        with self._stats_lock:
+            self._stats[key] = self._stats.get(key, 0) + 1
+
+    def handle_error(self, request, client_address) -> None:
+        # clients hang up mid-reply when their request is cancelled
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def generation_slot(self):
+        return self._slots
+
+    def start(self) -> "StubServer":
+        """Serve from a background thread; returns the server for chaining."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--models", nargs="+", default=StubConfig().models)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--token-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-time", type=float, default=60.0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    parser.add_argument("--check-reject", default=StubConfig().check_reject)
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Answer `ollama_generate_stream` with a 404, as older servers do.",
+    )
+    parser.add_argument(
+        "--karma-replies",
+        help="A JSON file with a list of replies to cycle through for KARMA.",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        models=args.models,
+        latency=args.latency,
+        jitter=args.jitter,
+        token_rate=args.token_rate,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        stall_time=args.stall_time,
+        max_concurrency=args.max_concurrency,
+        check_reject=args.check_reject,
+        stream=not args.no_stream,
+        seed=args.seed,
+    )
+    if args.karma_replies:
+        with open(args.karma_replies, "r") as f:
+            config.karma_replies = json.load(f)
+    server = StubServer(config, address=(args.host, args.port))
+    print(f"Stub LLM server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Any, Dict, Optional
+
+from settings import LLMSetting, settings
+
+from utils import asend_to_server, send_to_server
+
+
+logger = logging.getLogger("prompt_override")
+
+
+class ResponseCache:
+    """Content-addressed cache of server replies for deterministic LLM roles.
+
+    Replies are kept in an in-memory LRU and mirrored to one file per key in
+    `settings.cache.cache_dir`. The oldest files on disk are evicted once the
+    directory grows past `settings.cache.max_disk_bytes`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._disk_bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(data: Dict[str, Any]) -> str:
+        payload = {
+            k: data.get(k) for k in ("model_name", "options", "messages", "tools")
+        }
+        return sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(settings.cache.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            else:
+                try:
+                    with open(self._path(key), "r") as f:
+                        entry = f.read()
+                    os.utime(self._path(key))
+                    self._remember(key, entry)
+                except OSError:
+                    pass
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # callers are free to modify the reply they get back
+        return json.loads(entry)
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        entry = json.dumps(response)
+        with self._lock:
+            self._remember(key, entry)
+            try:
+                self._store(key, entry)
+            except OSError as e:
+                logger.warning(f"Could not write cached response to disk: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            for fname in self._cached_files():
+                os.remove(fname)
+            self._disk_bytes = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._memory)}
+
+    def _remember(self, key: str, entry: str) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > settings.cache.max_entries:
+            self._memory.popitem(last=False)
+
+    def _cached_files(self):
+        if not os.path.isdir(settings.cache.cache_dir):
+            return []
+        return [
+            os.path.join(settings.cache.cache_dir, fname)
+            for fname in os.listdir(settings.cache.cache_dir)
+            if fname.endswith(".json")
+        ]
+
+    def _store(self, key: str, entry: str) -> None:
+        os.makedirs(settings.cache.cache_dir, exist_ok=True)
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(os.path.getsize(f) for f in self._cached_files())
+        path = self._path(key)
+        if os.path.exists(path):
+            self._disk_bytes -= os.path.getsize(path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(entry)
+        os.replace(tmp_path, path)
+        self._disk_bytes += os.path.getsize(path)
+        if self._disk_bytes > settings.cache.max_disk_bytes:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        files = sorted(self._cached_files(), key=os.path.getmtime)
+        for fname in files:
+            if self._disk_bytes <= settings.cache.max_disk_bytes:
+                break
+            self._disk_bytes -= os.path.getsize(fname)
+            os.remove(fname)
+
+
+response_cache = ResponseCache()
+
+
+def _is_cacheable(llm_setting: LLMSetting) -> bool:
+    return llm_setting.cache_responses and llm_setting.temperature == 0.0
+
+
+def _is_answer(response: Dict[str, Any]) -> bool:
+    # an empty reply without tool calls is asked again, and must not be
+    # answered from the cache with the same empty reply
+    message = response.get("message") or {}
+    return bool(message.get("content") or message.get("tool_calls"))
+
+
+def cached_send_to_server(
+    data: Dict[str, Any], endpoint: str, llm_setting: LLMSetting
+) -> Dict[str, Any]:
+    if not _is_cacheable(llm_setting):
+        return send_to_server(data=data, endpoint=endpoint)
+    key = ResponseCache.key(data)
+    response = response_cache.get(key)
+    if response is None or not _is_answer(response):
+        response = send_to_server(data=data, endpoint=endpoint)
+        if _is_answer(response):
+            response_cache.put(key, response)
+    else:
+        logger.debug(
+            f"Cache hit for {llm_setting.model_name} ({response_cache.stats})."
+        )
+    return response
+
+
+async def acached_send_to_server(
+    data: Dict[str, Any], endpoint: str, llm_setting: LLMSetting
+) -> Dict[str, Any]:
+    if not _is_cacheable(llm_setting):
+        return await asend_to_server(data=data, endpoint=endpoint)
+    key = ResponseCache.key(data)
+    # the cache may read and write files, which must not block the event loop
+    response = await asyncio.to_thread(response_cache.get, key)
+    if response is None or not _is_answer(response):
+        response = await asend_to_server(data=data, endpoint=endpoint)
+        if _is_answer(response):
+            await asyncio.to_thread(response_cache.put, key, response)
+    else:
+        logger.debug(
+            f"Cache hit for {llm_setting.model_name} ({response_cache.stats})."
+        )
+    return response
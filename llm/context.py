@@ -0,0 +1,177 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from settings import LLMSetting
+
+
+logger = logging.getLogger("prompt_override")
+
+
+def estimate_tokens(text: str) -> int:
+    # roughly four characters per token, plus the per-message chat template
+    return len(text) // 4 + 4
+
+
+class ContextEntry:
+    def __init__(
+        self,
+        message: Dict[str, str],
+        slot: Optional[str] = None,
+        entry_id: Optional[int] = None,
+    ) -> None:
+        self.message = message
+        self.slot = slot
+        # tells the entries of the conversation apart, see `ConversationContext.state`
+        self.entry_id = entry_id
+        self.tokens = estimate_tokens(message["content"])
+
+
+class ConversationContext:
+    """Conversation history that stays within the token budget of an LLM role.
+
+    The system prompt and named slots (e.g. the current file system or goal
+    hints) are pinned. When the estimated size of the history exceeds the
+    budget, the oldest unpinned turns are dropped and folded into a rolling
+    summary placed right after the system prompt.
+
+    `state` holds what is left of the conversation after the system prompt,
+    which `restore` puts back (e.g. when a session is resumed).
+    """
+
+    SUMMARY_HEADER = "Summary of the earlier conversation:"
+    SUMMARY_LINE_CHARS = 200
+
+    def __init__(self, system_prompt: str, llm_setting: LLMSetting) -> None:
+        self.llm_setting = llm_setting
+        self._entries: List[ContextEntry] = [
+            ContextEntry({"role": "system", "content": system_prompt}, slot="system")
+        ]
+        self._summary_lines: List[str] = []
+        self._tokens = self._entries[0].tokens
+        self._next_id = 0
+
+    @property
+    def budget(self) -> int:
+        return self.llm_setting.context_budget or self.llm_setting.num_ctx
+
+    @property
+    def summary_budget(self) -> int:
+        return self.budget // 8
+
+    @property
+    def token_count(self) -> int:
+        return self._tokens
+
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        return [entry.message for entry in self._entries]
+
+    def add(self, msg: str, role: str) -> None:
+        self._append(self._new_entry({"role": role, "content": msg}))
+        self._trim()
+
+    def set_slot(self, slot: str, msg: str, role: str = "system") -> None:
+        self._clear_slot(slot)
+        self._append(self._new_entry({"role": role, "content": msg}, slot=slot))
+        self._trim()
+
+    def clear_slot(self, slot: str) -> None:
+        self._clear_slot(slot)
+
+    def state(self) -> Dict[str, Any]:
+        """The entries after the system prompt, in order, and the summary lines.
+
+        Each entry keeps its `id`, which is never reused by this context (nor
+        by one it is restored into), so a saved state can be stored as the
+        entries that are new since the previous one.
+        """
+        return {
+            "entries": [
+                {
+                    "id": entry.entry_id,
+                    "role": entry.message["role"],
+                    "content": entry.message["content"],
+                    "slot": entry.slot,
+                }
+                for entry in self._entries
+                if entry.entry_id is not None
+            ],
+            "summary": list(self._summary_lines),
+        }
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Replace everything after the system prompt with a saved `state`."""
+        self._entries = self._entries[:1]
+        self._tokens = self._entries[0].tokens
+        self._summary_lines = list(state["summary"])
+        if self._summary_lines:
+            self._set_summary(self._render_summary())
+        for entry in state["entries"]:
+            self._append(
+                ContextEntry(
+                    {"role": entry["role"], "content": entry["content"]},
+                    slot=entry["slot"],
+                    entry_id=entry["id"],
+                )
+            )
+            self._next_id = max(self._next_id, entry["id"] + 1)
+        self._trim()
+
+    def _new_entry(
+        self, message: Dict[str, str], slot: Optional[str] = None
+    ) -> ContextEntry:
+        entry = ContextEntry(message, slot=slot, entry_id=self._next_id)
+        self._next_id += 1
+        return entry
+
+    def _clear_slot(self, slot: str) -> None:
+        for entry in self._entries:
+            if entry.slot == slot:
+                self._remove(entry)
+                return
+
+    def _append(self, entry: ContextEntry) -> None:
+        self._entries.append(entry)
+        self._tokens += entry.tokens
+
+    def _remove(self, entry: ContextEntry) -> None:
+        self._entries.remove(entry)
+        self._tokens -= entry.tokens
+
+    def _trim(self) -> None:
+        # the latest entry is always kept, even if it alone is over budget
+        while self._tokens > self.budget:
+            oldest = next(
+                (e for e in self._entries[:-1] if e.slot is None),
+                None,
+            )
+            if oldest is None:
+                break
+            self._remove(oldest)
+            self._fold_into_summary(oldest.message)
+
+    def _fold_into_summary(self, message: Dict[str, str]) -> None:
+        content = " ".join(message["content"].split())
+        if len(content) > self.SUMMARY_LINE_CHARS:
+            content = content[: self.SUMMARY_LINE_CHARS - 3] + "..."
+        self._summary_lines.append(f"- {message['role']}: {content}")
+        summary = self._render_summary()
+        while len(self._summary_lines) > 1 and (
+            estimate_tokens(summary) > self.summary_budget
+        ):
+            self._summary_lines.pop(0)
+            summary = self._render_summary()
+        self._set_summary(summary)
+        logger.debug(
+            f"Folded a {message['role']} message into the summary "
+            f"({self._tokens}/{self.budget} tokens)."
+        )
+
+    def _set_summary(self, summary: str) -> None:
+        self._clear_slot("summary")
+        entry = ContextEntry({"role": "system", "content": summary}, slot="summary")
+        self._entries.insert(1, entry)
+        self._tokens += entry.tokens
+
+    def _render_summary(self) -> str:
+        return "\n".join([self.SUMMARY_HEADER, *self._summary_lines])
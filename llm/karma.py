@@ -1,60 +1,54 @@
 import logging
-import os
-from typing import Generator, List
+from typing import Any, AsyncGenerator, Dict, Generator, List, Set
 
 import ollama
 
 from base_objects.level import Level
+from llm.context import ConversationContext
 from settings import settings
+from templates import load_template
 from textual.screen import Screen
 
-from utils import send_to_server
+from utils import (
+    EndpointNotFoundError,
+    asend_to_server,
+    astream_from_server,
+    send_to_server,
+    stream_from_server,
+)
 
 
 logger = logging.getLogger("prompt_override")
 
 
 class Karma:
+    # servers without the streaming endpoint, whose replies are sent whole
+    _unstreamed_servers: Set[str] = set()
+
     def __init__(self, parent: Screen, snippets: List[str], backstory: str) -> None:
         logger.debug("Initializing Karma class.")
 
-        prompt_path = os.path.join(settings.assets_dir, settings.karma.model_prompt)
-        logger.debug(f"Loading karma model prompt from {prompt_path}")
-        with open(prompt_path, "r") as f:
-            self.prompt = f.read()
-        self.prompt = self.prompt.replace("$snippets$", "\n\n".join(snippets))
-        self.prompt = self.prompt.replace("$backstory$", backstory)
-        self.messages = [{"role": "system", "content": self.prompt}]
+        logger.debug(f"Loading karma model prompt {settings.karma.model_prompt}")
+        self.prompt = load_template(settings.karma.model_prompt).render(
+            snippets="\n\n".join(snippets), backstory=backstory
+        )
+        self.context = ConversationContext(
+            system_prompt=self.prompt, llm_setting=settings.karma
+        )
         self.parent = parent
+        # the model is pulled beforehand, see `ModelRegistry.ensure_game_models`
+        logger.debug("Karma class initialized.")
 
-        self._last_fs_info = None
-        self._last_goals_hints = None
-
-        logger.debug("Checking if model is available in Ollama.")
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        return self.context.messages
 
-        if (
-            settings.karma.model_name
-            not in send_to_server(data=None, endpoint="ollama_list_models")["models"]
-        ):
-            logger.warning(
-                f"{settings.karma.model_name} not found; pulling model. This may take a while."
-            )
-            self.parent.action_notify(
-                message=f"{settings.karma.model_name} not found; pulling...",
-                severity="warning",
-                title="GameEngine",
-            )
-            send_to_server(
-                data={"model_name": settings.karma.model_name},
-                endpoint="ollama_init_model",
-            )
-            logger.info(f"{settings.karma.model_name} pulled from Ollama.")
-            self.parent.action_notify(
-                message=f"{settings.karma.model_name} pulled from Ollama.",
-                severity="warning",
-                title="GameEngine",
-            )
-        logger.debug("Karma class initialized.")
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Rebuild the conversation from the context state of a saved session."""
+        self.context = ConversationContext(
+            system_prompt=self.prompt, llm_setting=settings.karma
+        )
+        self.context.restore(state)
 
     def combine_messages(self, msgs: List[str]) -> str:
         logger.debug(f"Combining {len(msgs)} messages.")
@@ -62,55 +56,46 @@ class Karma:
 
     def add_message(self, msg: str, role: str) -> None:
         logger.debug(f"Adding message with role '{role}'.")
-        self.messages.append({"role": role, "content": msg})
+        self.context.add(msg=msg, role=role)
 
     def include_fs(self, level: Level) -> None:
         logger.debug("Including filesystem info in messages.")
-        fs_prompt_path = os.path.join(settings.assets_dir, "karma_fs_prompt")
-        with open(fs_prompt_path, "r") as f:
-            msg = f.read()
-        msg = msg.replace("$current_user$", level.fs.current_user)
-        msg = msg.replace("$filesystem$", level.fs.to_karma_format)
-        if self._last_fs_info is not None:
-            logger.debug("Removing previous filesystem info from messages.")
-            self.messages.remove(self._last_fs_info)
-        self.messages.append({"role": "system", "content": msg})
-        self._last_fs_info = self.messages[-1]
+        msg = load_template("karma_fs_prompt").render(
+            current_user=level.fs.current_user, filesystem=level.fs.to_karma_format
+        )
+        self.context.set_slot("fs", msg=msg)
         logger.debug("Filesystem info included.")
 
     def include_goal_hints(self, level: Level) -> None:
         logger.debug("Including goal hints in messages.")
-        if self._last_goals_hints is not None:
-            logger.debug("Removing previous goal hints from messages.")
-            self.messages.remove(self._last_goals_hints)
         if level.next_possible_goal is not None:
             logger.debug("Next possible goal found, adding hints.")
-            self.messages.append(
-                {
-                    "role": "system",
-                    "content": f"Hints for the current goal:\n{level.next_possible_goal.hints}",
-                }
+            self.context.set_slot(
+                "hints",
+                msg=f"Hints for the current goal:\n{level.next_possible_goal.hints}",
             )
-            self._last_goals_hints = self.messages[-1]
             logger.debug("Goal hints included.")
         else:
             logger.debug("No next possible goal found, skipping hints inclusion.")
-            self._last_goals_hints = None
+            self.context.clear_slot("hints")
 
-    def chat(self, **kwargs) -> str:
-        logger.debug("Starting chat with Ollama model.")
+    def _chat_data(self) -> Dict[str, Any]:
         options = {
             "temperature": settings.karma.temperature,
             "top_p": settings.karma.top_p,
             "seed": settings.rng_seed,
-            "num_ctx": settings.neuralsys.num_ctx,
+            "num_ctx": settings.karma.num_ctx,
         }
         logger.debug(f"Chat options: {options}")
-        data = {
+        return {
             "model_name": settings.karma.model_name,
             "messages": self.messages,
             "options": options,
         }
+
+    def chat(self, **kwargs) -> str:
+        logger.debug("Starting chat with Ollama model.")
+        data = self._chat_data()
         msg = send_to_server(data=data, endpoint="ollama_generate")["message"][
             "content"
         ]
@@ -118,3 +103,79 @@ class Karma:
         logger.debug("Chat completed. Adding assistant message to history.")
         self.add_message(msg=msg, role="assistant")
         return msg
+
+    @staticmethod
+    def _can_stream() -> bool:
+        return settings.server_url not in Karma._unstreamed_servers
+
+    @staticmethod
+    def _stream_unsupported() -> None:
+        logger.warning(
+            f"{settings.server_url} cannot stream replies; sending them whole instead."
+        )
+        Karma._unstreamed_servers.add(settings.server_url)
+
+    def chat_stream(self, **kwargs) -> Generator[str, None, None]:
+        if not Karma._can_stream():
+            yield self.chat()
+            return
+        logger.debug("Starting streamed chat with Ollama model.")
+        data = self._chat_data()
+        tokens = []
+        try:
+            for chunk in stream_from_server(
+                data=data, endpoint="ollama_generate_stream"
+            ):
+                token = chunk["message"].get("content")
+                if token:
+                    tokens.append(token)
+                    yield token
+                if chunk.get("done"):
+                    break
+        except EndpointNotFoundError:
+            Karma._stream_unsupported()
+            yield self.chat()
+        finally:
+            # record whatever the player has seen, even if the stream was cut short
+            if tokens:
+                msg = "".join(tokens)
+                logger.debug(f"Chat response: {msg}")
+                logger.debug("Chat completed. Adding assistant message to history.")
+                self.add_message(msg=msg, role="assistant")
+
+    async def achat(self, **kwargs) -> str:
+        logger.debug("Starting async chat with Ollama model.")
+        data = self._chat_data()
+        response = await asend_to_server(data=data, endpoint="ollama_generate")
+        msg = response["message"]["content"]
+        logger.debug(f"Chat response: {msg}")
+        logger.debug("Chat completed. Adding assistant message to history.")
+        self.add_message(msg=msg, role="assistant")
+        return msg
+
+    async def achat_stream(self, **kwargs) -> AsyncGenerator[str, None]:
+        if not Karma._can_stream():
+            yield await self.achat()
+            return
+        logger.debug("Starting async streamed chat with Ollama model.")
+        data = self._chat_data()
+        tokens = []
+        try:
+            async for chunk in astream_from_server(
+                data=data, endpoint="ollama_generate_stream"
+            ):
+                token = chunk["message"].get("content")
+                if token:
+                    tokens.append(token)
+                    yield token
+                if chunk.get("done"):
+                    break
+        except EndpointNotFoundError:
+            Karma._stream_unsupported()
+            yield await self.achat()
+        finally:
+            if tokens:
+                msg = "".join(tokens)
+                logger.debug(f"Chat response: {msg}")
+                logger.debug("Chat completed. Adding assistant message to history.")
+                self.add_message(msg=msg, role="assistant")
@@ -1,22 +1,30 @@
+import asyncio
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import ollama
 
 from base_objects.level import Level
+from base_objects.vfs import File
 from gptfunctionutil import AILibFunction, GPTFunctionLibrary, LibParamSpec
+from llm.cache import acached_send_to_server, cached_send_to_server
 from settings import settings
+from templates import load_template
 from textual.screen import Screen
 
-from utils import send_to_server
-
 
 logger = logging.getLogger("prompt_override")
 
 
+class NeuralSysError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
 class NeuralSysTools(GPTFunctionLibrary):
     def __call__(self, func_name: str, func_args: str, level: Level) -> None:
         logger.debug(
@@ -79,13 +87,16 @@ class NeuralSysTools(GPTFunctionLibrary):
     def change_file_permissions(
         self, level: Level, filename: str, read: List[str], write: List[str]
     ) -> str:
-        # clean filename as sometimes llm may set the entire path and not just the filename.
+        doc = level.fs.get(fname=filename) if "/" in filename else None
+        if not isinstance(doc, File):
+            # sometimes the llm sets a made-up path and not just the filename.
 
-        if "/" in filename:
             filename = filename.split("/")[-1]
-        doc = level.fs.get(
-            fname=filename, directory=None
-        )  # TODO: This could cause problems for files with the same name
+            matches = [x for x in level.fs.find(filename) if isinstance(x, File)]
+            assert (
+                len(matches) < 2
+            ), f'More than one file is named {filename}: {", ".join(level.fs.path(x) for x in matches)}. Use the full path of the file.'
+            doc = matches[0] if matches else None
         assert (
             doc is not None
         ), f"No file with name {filename} found in the file system!"
@@ -110,6 +121,9 @@ EOT_TOKEN = "</think>"
 
 
 class NeuralSys:
+    # requests of a single update, i.e. rounds of tool calls before the answer
+    max_apply_passes = 10
+
     def __init__(self, parent: Screen):
         logger.debug("Initializing NeuralSys class.")
 
@@ -117,46 +131,18 @@ class NeuralSys:
             os.path.join(settings.assets_dir, settings.neuralsys.model_prompt), "r"
         ) as f:
             self.neuralsys_prompt = f.read()
-        with open(
-            os.path.join(settings.assets_dir, settings.neuralcheck.model_prompt), "r"
-        ) as f:
-            # TODO: Might want to get these from settings somewhere
+        # TODO: Might want to get these from settings somewhere
 
-            self.neuralcheck_prompt = f.read()
-        with open(os.path.join(settings.assets_dir, "neuralcheck_msg"), "r") as f:
-            self.neuralcheck_msg = f.read()
-        with open(os.path.join(settings.assets_dir, "neuralsys_msg")) as f:
-            self.neuralsys_msg = f.read()
+        self.neuralcheck_prompt = load_template(settings.neuralcheck.model_prompt)
+        self.neuralcheck_msg = load_template("neuralcheck_msg")
+        self.neuralsys_msg = load_template("neuralsys_msg")
         self.parent = parent
         self.tools: NeuralSysTools = NeuralSysTools()
 
         self.check_fail_prefix = "[SYSERROR]"
         self.check_fail_msg = "Suggested change to the prompt snippet is considered illegal tampering with the system. Prompt snippet will be rolled back."
 
-        logger.debug("Checking if NeuralSys model is available in Ollama.")
-
-        if (
-            settings.neuralsys.model_name
-            not in send_to_server(data=None, endpoint="ollama_list_models")["models"]
-        ):
-            logger.warning(
-                f"{settings.neuralsys.model_name} not found; pulling model. This may take a while."
-            )
-            self.parent.action_notify(
-                message=f"{settings.neuralsys.model_name} not found; pulling...",
-                severity="warning",
-                title="GameEngine",
-            )
-            send_to_server(
-                data={"model_name": settings.neuralsys.model_name},
-                endpoint="ollama_init_model",
-            )
-            logger.info(f"{settings.neuralsys.model_name} pulled from Ollama.")
-            self.parent.action_notify(
-                message=f"{settings.neuralsys.model_name} pulled from Ollama.",
-                severity="warning",
-                title="GameEngine",
-            )
+        # the models are pulled beforehand, see `ModelRegistry.ensure_game_models`
         logger.debug("NeuralSys class initialized.")
 
     def _remove_think_trace(self, response: Dict[str, Any]) -> None:
@@ -165,29 +151,25 @@ class NeuralSys:
         eot_idx = msg.find(EOT_TOKEN)
         response["message"]["content"] = msg[eot_idx + len(EOT_TOKEN) :]
 
-    def _check(self, level: Level, constraints: str) -> Check:
-        logger.info("Running neuralcheck validation.")
+    def _check_data(self, level: Level, constraints: str) -> Dict[str, Any]:
         options = {
             "temperature": settings.neuralcheck.temperature,
             "top_p": settings.neuralcheck.top_p,
             "seed": settings.rng_seed,
             "num_ctx": settings.neuralcheck.num_ctx,
         }
-        neuralcheck_prompt = self.neuralcheck_prompt.replace(
-            "$current_user$", level.fs.current_user
+        neuralcheck_prompt = self.neuralcheck_prompt.render(
+            current_user=level.fs.current_user,
+            CHECK_OK=Check.OK.value,
+            CHECK_ERROR=Check.ERROR.value,
         )
-        neuralcheck_prompt = neuralcheck_prompt.replace("$CHECK_OK$", Check.OK.value)
-        neuralcheck_prompt = neuralcheck_prompt.replace(
-            "$CHECK_ERROR$", Check.ERROR.value
-        )
-        neuralcheck_msg = self.neuralcheck_msg.replace("$constraints$", constraints)
+        neuralcheck_msg = self.neuralcheck_msg.render(constraints=constraints)
         if settings.neuralcheck.thinking:
             neuralcheck_msg += "\n /think"
         elif settings.neuralcheck.model_name in [
             "qwen3:latest"
         ]:  # TODO: This should be a list of models that generate thinking traces
             neuralcheck_msg += "\n /nothink"
-        response = {"message": {"content": ""}}
         messages = [
             {"role": "system", "content": neuralcheck_prompt},
             {"role": "user", "content": neuralcheck_msg},
@@ -198,13 +180,14 @@ class NeuralSys:
             severity="information",
             title="NeuralCtl",
         )
-        data = {
+        return {
             "model_name": settings.neuralcheck.model_name,
             "messages": messages,
             "options": options,
             "tools": self.tools.get_tool_schema(),
         }
-        response = send_to_server(data=data, endpoint="ollama_generate")
+
+    def _check_result(self, response: Dict[str, Any]) -> Check:
         logger.debug(f"Neuralcheck response: {response['message']['content']}")
         if SOT_TOKEN in response["message"]["content"]:
             self._remove_think_trace(response)
@@ -212,82 +195,245 @@ class NeuralSys:
         logger.info(f"Neuralcheck result: {result}")
         return result
 
-    def _apply(self, level: Level, constraints: str) -> str:
-        logger.info("Applying update via neuralsys model.")
-        options = {
-            "temperature": settings.neuralsys.temperature,
-            "top_p": settings.neuralsys.top_p,
-            "seed": settings.rng_seed,
-            "num_ctx": settings.neuralsys.num_ctx,
-        }
-        neuralsys_msg = self.neuralsys_msg.replace("$constraints$", constraints)
+    def _check(self, level: Level, constraints: str) -> Check:
+        logger.info("Running neuralcheck validation.")
+        data = self._check_data(level=level, constraints=constraints)
+        response = cached_send_to_server(
+            data=data, endpoint="ollama_generate", llm_setting=settings.neuralcheck
+        )
+        return self._check_result(response)
+
+    async def _acheck(self, level: Level, constraints: str) -> Check:
+        logger.info("Running async neuralcheck validation.")
+        data = self._check_data(level=level, constraints=constraints)
+        response = await acached_send_to_server(
+            data=data, endpoint="ollama_generate", llm_setting=settings.neuralcheck
+        )
+        return self._check_result(response)
+
+    def _apply_messages(self, level: Level, constraints: str) -> List[Dict[str, Any]]:
+        neuralsys_msg = self.neuralsys_msg.render(
+            constraints=constraints,
+            file_system=level.fs.to_neuralsys_format,
+            credentials=level.credentials_to_neuralsys_format,
+        )
         if settings.neuralsys.thinking:
             neuralsys_msg += "\n /think"
         elif settings.neuralsys.model_name in [
             "qwen3:latest"
         ]:  # TODO: This should be a list of models that generate thinking traces
             neuralsys_msg += "\n /nothink"
-        neuralsys_msg = neuralsys_msg.replace(
-            "$file_system$", level.fs.to_neuralsys_format
-        )
-        neuralsys_msg = neuralsys_msg.replace(
-            "$credentials$", level.credentials_to_neuralsys_format
-        )
-        messages = [
+        return [
             {"role": "system", "content": self.neuralsys_prompt},
             {"role": "user", "content": neuralsys_msg},
         ]
-        response = {"message": {"content": ""}}
-        while response["message"]["content"] == "":
-            logger.debug("Sending neuralsys chat request to Ollama.")
-            data = {
-                "model_name": settings.neuralsys.model_name,
-                "messages": messages,
-                "options": options,
-                "tools": self.tools.get_tool_schema(),
-            }
-            response = send_to_server(data=data, endpoint="ollama_generate")
-            logger.debug(f"Neuralsys response: {response['message']}")
-            if response["message"].get("tool_calls"):
-                for tool in response["message"]["tool_calls"]:
-                    function_name = tool["function"]["name"]
-                    params = tool["function"]["arguments"]
-                    logger.debug(
-                        f"Calling tool '{function_name}' with params: {params}"
-                    )
-                    func_output = self.tools(
-                        func_name=function_name, func_args=params, level=level
-                    )
-                    logger.debug(f"Tool result: '{func_output}'")
-                    messages.append(
+
+    def _apply_data(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        logger.debug("Sending neuralsys chat request to Ollama.")
+        options = {
+            "temperature": settings.neuralsys.temperature,
+            "top_p": settings.neuralsys.top_p,
+            "seed": settings.rng_seed,
+            "num_ctx": settings.neuralsys.num_ctx,
+        }
+        return {
+            "model_name": settings.neuralsys.model_name,
+            "messages": messages,
+            "options": options,
+            "tools": self.tools.get_tool_schema(),
+        }
+
+    def _run_tool_calls(
+        self,
+        level: Level,
+        messages: List[Dict[str, Any]],
+        response: Dict[str, Any],
+        tool_calls: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        logger.debug(f"Neuralsys response: {response['message']}")
+        if response["message"].get("tool_calls"):
+            for tool in response["message"]["tool_calls"]:
+                function_name = tool["function"]["name"]
+                params = tool["function"]["arguments"]
+                logger.debug(f"Calling tool '{function_name}' with params: {params}")
+                func_output = self.tools(
+                    func_name=function_name, func_args=params, level=level
+                )
+                logger.debug(f"Tool result: '{func_output}'")
+                if tool_calls is not None:
+                    tool_calls.append(
                         {
-                            "role": "tool",
                             "name": function_name,
-                            "content": func_output,
+                            "arguments": params,
+                            "result": func_output,
                         }
                     )
+                messages.append(
+                    {
+                        "role": "tool",
+                        "name": function_name,
+                        "content": func_output,
+                    }
+                )
+
+    def _unfinished(self) -> "NeuralSysError":
+        logger.error(f"Neuralsys gave no answer after {self.max_apply_passes} passes.")
+        return NeuralSysError(
+            f"NeuralSys did not answer after {self.max_apply_passes} passes."
+        )
+
+    def _apply_result(self, response: Dict[str, Any]) -> str:
         if SOT_TOKEN in response["message"]["content"]:
             self._remove_think_trace(response)
         logger.info("Neuralsys update applied successfully.")
         return response["message"]["content"].strip()
 
+    def _send_apply(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return cached_send_to_server(
+            data=self._apply_data(messages=messages),
+            endpoint="ollama_generate",
+            llm_setting=settings.neuralsys,
+        )
+
+    async def _asend_apply(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return await acached_send_to_server(
+            data=self._apply_data(messages=messages),
+            endpoint="ollama_generate",
+            llm_setting=settings.neuralsys,
+        )
+
+    def _apply(
+        self,
+        level: Level,
+        constraints: str,
+        tool_calls: Optional[List[Dict[str, Any]]] = None,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        response: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Apply the update. `response` is the reply to `messages`, if the
+        first request was already sent (see `_evaluate_speculative`)."""
+        logger.info("Applying update via neuralsys model.")
+        if messages is None:
+            messages = self._apply_messages(level=level, constraints=constraints)
+        # an update that fails halfway through (or is cancelled) only rolls
+        # back the credentials and permissions that its tools changed
+        with level.transaction():
+            for _ in range(self.max_apply_passes):
+                if response is None:
+                    response = self._send_apply(messages)
+                self._run_tool_calls(
+                    level=level,
+                    messages=messages,
+                    response=response,
+                    tool_calls=tool_calls,
+                )
+                if response["message"]["content"] != "":
+                    return self._apply_result(response)
+                response = None
+            raise self._unfinished()
+
+    async def _aapply(
+        self,
+        level: Level,
+        constraints: str,
+        tool_calls: Optional[List[Dict[str, Any]]] = None,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        response: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        logger.info("Applying update via neuralsys model (async).")
+        if messages is None:
+            messages = self._apply_messages(level=level, constraints=constraints)
+        with level.transaction():
+            for _ in range(self.max_apply_passes):
+                if response is None:
+                    response = await self._asend_apply(messages)
+                self._run_tool_calls(
+                    level=level,
+                    messages=messages,
+                    response=response,
+                    tool_calls=tool_calls,
+                )
+                if response["message"]["content"] != "":
+                    return self._apply_result(response)
+                response = None
+            raise self._unfinished()
+
+    def _on_accepted(self) -> None:
+        self.parent.notify(
+            "Your update request has been accepted. Processing...",
+            severity="information",
+            title="NeuralCtl",
+        )
+        logger.info("Update request accepted. Applying update.")
+
+    def _on_rejected(self) -> str:
+        self.parent.notify(
+            "Your update request has been rejected.",
+            severity="error",
+            title="NeuralCtl",
+        )
+        logger.warning("Update request rejected by neuralcheck.")
+        return f"{self.check_fail_prefix} {self.check_fail_msg}"
+
     def evaluate(self, snippets: List[str], **kwargs) -> str:
         logger.info("Evaluating user update request.")
         user_constraints = "\n".join(snippets)
         level: Level = kwargs["level"]
+        if settings.neuralctl_speculative:
+            return self._evaluate_speculative(level=level, constraints=user_constraints)
         if self._check(level=level, constraints=user_constraints) == Check.OK:
-            self.parent.notify(
-                "Your update request has been accepted. Processing...",
-                severity="information",
-                title="NeuralCtl",
-            )
-            logger.info("Update request accepted. Applying update.")
+            self._on_accepted()
             return self._apply(level=level, constraints=user_constraints)
         else:
-            self.parent.notify(
-                "Your update request has been rejected.",
-                severity="error",
-                title="NeuralCtl",
+            return self._on_rejected()
+
+    def _evaluate_speculative(self, level: Level, constraints: str) -> str:
+        # send the first request of the update while it is being checked; its
+        # tool calls only run once the check passes
+        messages = self._apply_messages(level=level, constraints=constraints)
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            first_reply = executor.submit(self._send_apply, messages)
+            if self._check(level=level, constraints=constraints) != Check.OK:
+                first_reply.cancel()
+                return self._on_rejected()
+            self._on_accepted()
+            response = first_reply.result()
+        finally:
+            executor.shutdown(wait=False)
+        return self._apply(
+            level=level, constraints=constraints, messages=messages, response=response
+        )
+
+    async def aevaluate(self, snippets: List[str], **kwargs) -> str:
+        logger.info("Evaluating user update request (async).")
+        user_constraints = "\n".join(snippets)
+        level: Level = kwargs["level"]
+        if settings.neuralctl_speculative:
+            return await self._aevaluate_speculative(
+                level=level, constraints=user_constraints
             )
-            logger.warning("Update request rejected by neuralcheck.")
-            return f"{self.check_fail_prefix} {self.check_fail_msg}"
+        if await self._acheck(level=level, constraints=user_constraints) == Check.OK:
+            self._on_accepted()
+            return await self._aapply(level=level, constraints=user_constraints)
+        else:
+            return self._on_rejected()
+
+    async def _aevaluate_speculative(self, level: Level, constraints: str) -> str:
+        messages = self._apply_messages(level=level, constraints=constraints)
+        first_reply = asyncio.create_task(self._asend_apply(messages))
+        try:
+            check = await self._acheck(level=level, constraints=constraints)
+        except BaseException:
+            first_reply.cancel()
+            raise
+        if check != Check.OK:
+            first_reply.cancel()
+            return self._on_rejected()
+        self._on_accepted()
+        return await self._aapply(
+            level=level,
+            constraints=constraints,
+            messages=messages,
+            response=await first_reply,
+        )
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Dict, List, Tuple
+
+from llm.registry import model_registry
+from requests import ConnectionError
+from settings import LLMSetting, settings
+
+from utils import send_to_server
+
+
+logger = logging.getLogger("prompt_override")
+
+
+class WarmState(Enum):
+    COLD = "cold"
+    WARMING = "warming"
+    WARM = "warm"
+    FAILED = "failed"
+
+
+class ModelWarmer:
+    """Loads the configured models on the server before they are first needed.
+
+    A warm-up is an empty chat request, which makes the server load the model
+    (with the role's context size) without generating anything. Models are
+    warmed one at a time, in the order they are needed in a level.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._states: Dict[Tuple[str, int], WarmState] = {}
+        self._warmed_at: Dict[Tuple[str, int], float] = {}
+
+    @property
+    def roles(self) -> List[LLMSetting]:
+        return [settings.karma, settings.neuralcheck, settings.neuralsys]
+
+    @staticmethod
+    def _key(llm_setting: LLMSetting) -> Tuple[str, int]:
+        # the server reloads a model whenever its context size changes
+        return (llm_setting.model_name, llm_setting.num_ctx)
+
+    def _current_state(self, key: Tuple[str, int]) -> WarmState:
+        state = self._states.get(key, WarmState.COLD)
+        if (
+            state == WarmState.WARM
+            and time.monotonic() - self._warmed_at[key] > settings.connection.warm_ttl
+        ):
+            state = WarmState.COLD
+        return state
+
+    def state(self, llm_setting: LLMSetting) -> WarmState:
+        with self._lock:
+            return self._current_state(self._key(llm_setting))
+
+    @property
+    def status(self) -> Dict[str, WarmState]:
+        status = {}
+        for llm_setting in self.roles:
+            status.setdefault(llm_setting.model_name, self.state(llm_setting))
+        return status
+
+    def warm(self, llm_setting: LLMSetting) -> WarmState:
+        if not model_registry.is_available(llm_setting.model_name):
+            # missing models are pulled when the level starts
+            return WarmState.COLD
+        key = self._key(llm_setting)
+        with self._lock:
+            state = self._current_state(key)
+            if state in (WarmState.WARMING, WarmState.WARM):
+                return state
+            self._states[key] = WarmState.WARMING
+        logger.debug(f"Warming up {llm_setting.model_name} ({llm_setting.num_ctx=}).")
+        try:
+            send_to_server(
+                data={
+                    "model_name": llm_setting.model_name,
+                    "messages": [],
+                    "options": {"num_ctx": llm_setting.num_ctx},
+                },
+                endpoint="ollama_generate",
+            )
+            state = WarmState.WARM
+        except ConnectionError as e:
+            logger.warning(f"Could not warm up {llm_setting.model_name}: {e}")
+            state = WarmState.FAILED
+        with self._lock:
+            self._states[key] = state
+            self._warmed_at[key] = time.monotonic()
+        return state
+
+    def warm_all(self) -> None:
+        if not settings.prewarm_models:
+            return
+        for llm_setting in self.roles:
+            self.warm(llm_setting)
+
+
+model_warmer = ModelWarmer()
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Set
+
+from requests import ConnectionError
+from settings import settings
+
+from utils import breaker, send_to_server
+
+
+logger = logging.getLogger("prompt_override")
+
+
+class ModelRegistry:
+    """Process-wide, in-memory view of the models available on the server.
+
+    The model list is fetched once and refreshed after `models_ttl` seconds.
+    Concurrent refreshes and concurrent pulls of the same model share a
+    single request.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._models: Optional[Set[str]] = None
+        self._fetched_at = 0.0
+        self._inflight: Dict[Any, Future] = {}
+
+    def _dedupe(self, key: Any, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    @property
+    def is_stale(self) -> bool:
+        return (
+            self._models is None
+            or time.monotonic() - self._fetched_at > settings.connection.models_ttl
+        )
+
+    def refresh(self) -> bool:
+        return self._dedupe("list", self._fetch)
+
+    def _fetch(self) -> bool:
+        try:
+            response = send_to_server(data=None, endpoint="ollama_list_models")
+        except ConnectionError as e:
+            logger.warning(f"Could not fetch the model list: {e}")
+            return False
+        with self._lock:
+            self._models = set(response["models"])
+            self._fetched_at = time.monotonic()
+        logger.debug(f"Model registry refreshed: {sorted(self._models)}")
+        return True
+
+    def is_reachable(self) -> bool:
+        if breaker.is_open:
+            return False
+        return not self.is_stale or self.refresh()
+
+    def is_available(self, model_name: str) -> bool:
+        if self._models is None:
+            self.refresh()
+        return self._models is not None and model_name in self._models
+
+    def pull(self, model_name: str) -> None:
+        def _pull():
+            send_to_server(
+                data={"model_name": model_name}, endpoint="ollama_init_model"
+            )
+            with self._lock:
+                if self._models is not None:
+                    self._models.add(model_name)
+
+        self._dedupe(("pull", model_name), _pull)
+
+    def invalidate(self) -> None:
+        """Fetch the model list again on the next check, e.g. after a failure."""
+        with self._lock:
+            self._fetched_at = float("-inf")
+
+    def ensure_model(
+        self, model_name: str, notify: Optional[Callable[..., None]] = None
+    ) -> None:
+        if self.is_available(model_name):
+            return
+        logger.warning(f"{model_name} not found; pulling model. This may take a while.")
+        if notify:
+            notify(
+                message=f"{model_name} not found; pulling...",
+                severity="warning",
+                title="GameEngine",
+            )
+        self.pull(model_name)
+        logger.info(f"{model_name} pulled from Ollama.")
+        if notify:
+            notify(
+                message=f"{model_name} pulled from Ollama.",
+                severity="warning",
+                title="GameEngine",
+            )
+
+    def ensure_game_models(self, notify: Optional[Callable[..., None]] = None) -> None:
+        """Pull the models of every role that the server does not have yet.
+
+        Pulling can take minutes, so this is called off the UI thread before a
+        level starts rather than when KARMA and NeuralSys are created.
+        """
+        for model_name in dict.fromkeys(
+            [
+                settings.karma.model_name,
+                settings.neuralcheck.model_name,
+                settings.neuralsys.model_name,
+            ]
+        ):
+            self.ensure_model(model_name, notify=notify)
+
+
+model_registry = ModelRegistry()
+# a reachable server is only trusted until a request to it fails
+breaker.on_failure(model_registry.invalidate)
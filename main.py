@@ -2,6 +2,7 @@ import logging
 import os
 from datetime import datetime
 
+from llm.registry import model_registry
 from settings import settings
 
 from textual.app import App
@@ -18,6 +19,13 @@ class MainApp(App):
 
     def on_mount(self) -> None:
         self.switch_mode("menu")
+        self.refresh_models()
+        self.set_interval(settings.connection.models_ttl, self.refresh_models)
+
+    def refresh_models(self) -> None:
+        self.run_worker(
+            model_registry.refresh, thread=True, group="models", exit_on_error=False
+        )
 
 
 def setup_logging(log_filename):
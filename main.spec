@@ -1,11 +1,26 @@
 # -*- mode: python ; coding: utf-8 -*-
+import glob
+import os
 
 
+# packed levels (see devtools/pack_levels.py) ship without their manifest and
+# asset directory, which they hold
+packed = {
+    os.path.splitext(os.path.basename(path))[0]
+    for path in glob.glob(os.path.join('assets', 'level*.lvl'))
+}
+datas = []
+for name in sorted(os.listdir('assets')):
+    path = os.path.join('assets', name)
+    if not name.endswith('.lvl') and os.path.splitext(name)[0] in packed:
+        continue
+    datas.append((path, path if os.path.isdir(path) else 'assets'))
+
 a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[('assets', 'assets')],
+    datas=datas,
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
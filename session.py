@@ -0,0 +1,339 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from base_objects.bundle import LevelBundle
+from base_objects.level import AssetContents, BundledContents, Level
+from base_objects.vfs import File, LogFile
+from settings import settings
+
+logger = logging.getLogger("prompt_override")
+
+
+class SessionError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+def _dump(record: Dict[str, Any]) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+class SavedSession:
+    """A game session read back from its log, ready to be resumed."""
+
+    def __init__(
+        self,
+        level: Level,
+        context: Dict[str, Any],
+        transcript: str,
+        game: Dict[str, Any],
+        log: "SessionLog",
+    ) -> None:
+        self.level = level
+        # KARMA's conversation, see `ConversationContext.state`
+        self.context = context
+        self.transcript = transcript
+        self.game = game
+        self.log = log
+
+
+class SessionLog:
+    """A game session, saved as an append-only file of JSON lines.
+
+    The first line holds the level as it was when the session started; the
+    files that were not read yet are saved as the asset they are read from,
+    so starting a session does not read them. Each `save` then appends one
+    line with what changed since the previous one: the level and file system
+    fields, the files (by path), KARMA's conversation (the entries that are
+    new since the previous save, the order of the current ones and the
+    summary of the dropped ones), the new chat transcript and the state of
+    the game screen. Saving a turn never rewrites what is already in the
+    file; for a `LogFile`, only the entries appended since the previous save
+    are written.
+    """
+
+    extension = ".jsonl"
+    # how much of a saved log is kept to check that it was only appended to
+    log_tail_length = 64
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._reset()
+
+    def _reset(self) -> None:
+        self._fields: Dict[str, Any] = {}
+        self._context = None
+        self._generation: Optional[int] = None
+        # the ids of the conversation entries and the summary, as saved
+        self._entry_ids: List[int] = []
+        self._summary: List[str] = []
+        self._transcript_length = 0
+        self._game: Dict[str, Any] = {}
+        # the length and the last characters of each log file, as saved
+        self._logs: Dict[str, Tuple[int, str]] = {}
+
+    @staticmethod
+    def path_for(level_name: str) -> str:
+        """The session of the level `level_name`, e.g. `level01`."""
+        return os.path.join(settings.saves_dir, level_name + SessionLog.extension)
+
+    def start(self, level: Level) -> None:
+        """Start the file over with the current state of `level`."""
+        self._reset()
+        # reads the files that are saved whole, before the level is dumped
+        assets = self._assets(level)
+        record = {
+            "type": "level",
+            "bundle": level._bundle.path if level._bundle is not None else None,
+            "level": level.model_dump(mode="json", context={"skip_unloaded": True}),
+            "assets": assets,
+        }
+        self._track(level)
+        self._track_logs(level)
+        self._fields = self._field_values(level)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(_dump(record))
+        logger.debug(f"Started session {self.path}.")
+
+    def save(
+        self,
+        level: Level,
+        context: Dict[str, Any],
+        transcript: str,
+        game: Dict[str, Any],
+    ) -> None:
+        """Append what changed since the previous save, if anything.
+
+        `context` is the state of KARMA's conversation, see
+        `ConversationContext.state`.
+        """
+        record: Dict[str, Any] = {"type": "turn"}
+
+        fields = self._field_values(level)
+        changed_fields = {
+            name: value
+            for name, value in fields.items()
+            if self._fields.get(name) != value
+        }
+        if changed_fields:
+            record["fields"] = changed_fields
+        self._fields = fields
+
+        index = level.fs.index
+        index.refresh()
+        changed_paths = index.context.pop_changed()
+        if index.context is not self._context or index.generation != self._generation:
+            # items were added, removed or renamed (or the tree was replaced)
+            record["assets"] = self._assets(level)
+            record["base_dir"] = level.fs.base_dir.model_dump(
+                mode="json", context={"skip_unloaded": True}
+            )
+            self._track_logs(level)
+        else:
+            items = {}
+            for path in sorted(changed_paths):
+                item = index.by_path(path) if path else level.fs.base_dir
+                if item is not None:
+                    items[path] = self._item_fields(path, item)
+            if items:
+                record["items"] = items
+        self._track(level)
+
+        changed_context: Dict[str, Any] = {}
+        entry_ids = [entry["id"] for entry in context["entries"]]
+        if entry_ids != self._entry_ids:
+            # ids are never reused, so an entry not saved last time is new
+            saved_ids = set(self._entry_ids)
+            changed_context["entries"] = entry_ids
+            changed_context["new"] = [
+                entry for entry in context["entries"] if entry["id"] not in saved_ids
+            ]
+            self._entry_ids = entry_ids
+        if context["summary"] != self._summary:
+            changed_context["summary"] = context["summary"]
+            self._summary = list(context["summary"])
+        if changed_context:
+            record["context"] = changed_context
+        if len(transcript) > self._transcript_length:
+            record["chat"] = transcript[self._transcript_length :]
+            self._transcript_length = len(transcript)
+        changed_game = {k: v for k, v in game.items() if self._game.get(k) != v}
+        if changed_game:
+            record["game"] = changed_game
+            self._game = dict(game)
+
+        if len(record) > 1:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(_dump(record))
+
+    @staticmethod
+    def _assets(level: Level) -> Dict[str, str]:
+        """The assets that the files not read yet are read from, by path.
+
+        Log files, which turns append to, and files read any other way are
+        read now, so that they are saved whole.
+        """
+        assets = {}
+        for item in level.fs.index.items():
+            if isinstance(item, File) and not item.is_loaded:
+                if isinstance(item._loader, AssetContents) and not isinstance(
+                    item, LogFile
+                ):
+                    assets[level.fs.path(item)] = item._loader.path
+                else:
+                    item.contents
+        return assets
+
+    def _track(self, level: Level) -> None:
+        index = level.fs.index
+        index.refresh()
+        index.context.pop_changed()
+        self._context = index.context
+        self._generation = index.generation
+
+    def _track_logs(self, level: Level) -> None:
+        self._logs = {}
+        for item in level.fs.index.items():
+            if isinstance(item, LogFile):
+                self._remember_log(level.fs.path(item), item.contents)
+
+    def _remember_log(self, path: str, contents: str) -> None:
+        self._logs[path] = (len(contents), contents[-self.log_tail_length :])
+
+    @staticmethod
+    def _field_values(level: Level) -> Dict[str, Any]:
+        # the goals are restored from the game state, the files item by item
+        values = level.model_dump(mode="json", exclude={"fs", "goals"})
+        for name, value in level.fs.model_dump(exclude={"base_dir"}).items():
+            values[f"fs.{name}"] = sorted(value) if isinstance(value, set) else value
+        return values
+
+    def _item_fields(self, path: str, item) -> Dict[str, Any]:
+        fields = {"read": item.read}
+        if isinstance(item, File):
+            fields["write"] = item.write
+            if not item.is_loaded:
+                # still read from its asset, see `_assets`
+                return fields
+            contents = item.contents
+            if isinstance(item, LogFile):
+                length, tail = self._logs.get(path, (-1, ""))
+                if (
+                    length >= 0
+                    and len(contents) >= length
+                    and contents[length - len(tail) : length] == tail
+                ):
+                    # rewriting the whole log every turn would grow the
+                    # session quadratically
+                    fields["append"] = contents[length:]
+                else:
+                    fields["contents"] = contents
+                self._remember_log(path, contents)
+            else:
+                fields["contents"] = contents
+        return fields
+
+    @staticmethod
+    def load(path: str) -> SavedSession:
+        """Read the session in `path`, to continue it where it was saved."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            raise SessionError(f"Cannot read session {path}: {e}")
+        if not records or records[0].get("type") != "level":
+            raise SessionError(f"{path} is not a saved session.")
+
+        data = records[0]["level"]
+        assets: Dict[str, str] = records[0].get("assets", {})
+        entries: Dict[int, Dict[str, Any]] = {}
+        entry_ids: List[int] = []
+        summary: List[str] = []
+        chat: List[str] = []
+        game: Dict[str, Any] = {}
+        # the saved log files, with their appended entries joined at the end
+        logs: List[Dict[str, Any]] = []
+        for record in records[1:]:
+            for name, value in record.get("fields", {}).items():
+                if name.startswith("fs."):
+                    data["fs"][name[3:]] = value
+                else:
+                    data[name] = value
+            if "base_dir" in record:
+                data["fs"]["base_dir"] = record["base_dir"]
+                assets = record.get("assets", {})
+            for item_path, fields in record.get("items", {}).items():
+                item = SessionLog._find(data["fs"]["base_dir"], item_path)
+                fields = dict(fields)
+                if "contents" in fields or "append" in fields:
+                    assets.pop(item_path, None)
+                if "append" in fields:
+                    if not isinstance(item.get("contents"), list):
+                        item["contents"] = [item.get("contents", "")]
+                        logs.append(item)
+                    item["contents"].append(fields.pop("append"))
+                item.update(fields)
+            context = record.get("context", {})
+            for entry in context.get("new", []):
+                entries[entry["id"]] = entry
+            if "entries" in context:
+                entry_ids = context["entries"]
+                if any(entry_id not in entries for entry_id in entry_ids):
+                    raise SessionError(f"{path} has a conversation entry missing.")
+                # the entries that were dropped are not needed anymore
+                entries = {entry_id: entries[entry_id] for entry_id in entry_ids}
+            summary = context.get("summary", summary)
+            chat.append(record.get("chat", ""))
+            game.update(record.get("game", {}))
+        for item in logs:
+            if isinstance(item["contents"], list):
+                item["contents"] = "".join(item["contents"])
+        level = Level.model_validate(data)
+        bundle = records[0].get("bundle")
+        if bundle is not None:
+            level._bundle = LevelBundle.open(bundle)
+        for item_path, asset in assets.items():
+            item = level.fs.index.by_path(item_path)
+            if not isinstance(item, File):
+                raise SessionError(f"{item_path} is not in the saved file system.")
+            if level._bundle is not None:
+                item.load_lazily(BundledContents(level._bundle, asset))
+            else:
+                item.load_lazily(AssetContents(asset))
+
+        # later saves only append what changes after this
+        log = SessionLog(path)
+        log._track(level)
+        log._track_logs(level)
+        log._fields = log._field_values(level)
+        log._entry_ids = entry_ids
+        log._summary = summary
+        transcript = "".join(chat)
+        log._transcript_length = len(transcript)
+        log._game = dict(game)
+        logger.debug(f"Loaded session {path} ({len(records)} records).")
+        return SavedSession(
+            level=level,
+            context={
+                "entries": [entries[entry_id] for entry_id in entry_ids],
+                "summary": summary,
+            },
+            transcript=transcript,
+            game=game,
+            log=log,
+        )
+
+    @staticmethod
+    def _find(directory: Dict[str, Any], path: str) -> Dict[str, Any]:
+        item = directory
+        for name in path.split("/") if path else []:
+            for child in item.get("contents", []):
+                if isinstance(child, dict) and child.get("name") == name:
+                    item = child
+                    break
+            else:
+                raise SessionError(f"{path} is not in the saved file system.")
+        return item
@@ -11,6 +11,15 @@ def resource_path(relative_path):
     return os.path.join(os.path.abspath("."), relative_path)
 
 
+def user_cache_path(relative_path):
+    # a directory of the user's own, rather than one next to the game
+    if sys.platform == "win32":
+        root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(root, "prompt_override", relative_path)
+
+
 class LLMSetting(BaseSettings):
     model_name: str = Field(
         default="hermes3:latest", description="The name of the LLM model to use."
@@ -29,7 +38,16 @@ class LLMSetting(BaseSettings):
     )
     top_k: int = Field(default=10, ge=0, description="The LLM top-k")
     num_ctx: int = Field(default=32678 * 4, gt=1, description="The LLM num_ctx.")
+    context_budget: int = Field(
+        default=0,
+        ge=0,
+        description="Token budget for the chat history (0 uses num_ctx).",
+    )
     thinking: bool = Field(default=False, description="Whether the LLM can think.")
+    cache_responses: bool = Field(
+        default=False,
+        description="Whether to cache replies (only used when temperature is 0).",
+    )
 
 
 class ChatSettings(BaseSettings):
@@ -41,6 +59,67 @@ class ChatSettings(BaseSettings):
     )
 
 
+class ConnectionSettings(BaseSettings):
+    connect_timeout: float = Field(
+        default=5.0, gt=0.0, description="Seconds to wait for a server connection."
+    )
+    read_timeout: float = Field(
+        default=30.0, gt=0.0, description="Seconds to wait for a server reply."
+    )
+    generate_timeout: float = Field(
+        default=300.0, gt=0.0, description="Seconds to wait for an LLM reply."
+    )
+    init_model_timeout: float = Field(
+        default=1800.0, gt=0.0, description="Seconds to wait for a model pull."
+    )
+    max_retries: int = Field(
+        default=3, ge=0, description="Retries for failed idempotent requests."
+    )
+    backoff_factor: float = Field(
+        default=0.5, ge=0.0, description="Exponential backoff factor between retries."
+    )
+    pool_size: int = Field(
+        default=8, gt=0, description="Maximum pooled connections to the server."
+    )
+    breaker_threshold: int = Field(
+        default=5,
+        gt=0,
+        description="Consecutive failures before requests fail fast.",
+    )
+    models_ttl: float = Field(
+        default=300.0, gt=0.0, description="Seconds before the model list is refreshed."
+    )
+    breaker_cooldown: float = Field(
+        default=30.0,
+        ge=0.0,
+        description="Seconds to fail fast before probing the server again.",
+    )
+    warm_ttl: float = Field(
+        default=240.0,
+        ge=0.0,
+        description="Seconds a pre-warmed model is assumed to stay loaded.",
+    )
+
+
+class CacheSettings(BaseSettings):
+    cache_dir: str = Field(
+        default="./cache", description="The location of the response cache."
+    )
+    max_entries: int = Field(
+        default=256, ge=0, description="Cached replies kept in memory."
+    )
+    max_disk_bytes: int = Field(
+        default=64 * 1024 * 1024, ge=0, description="Size limit of the cache on disk."
+    )
+    compile_levels: bool = Field(
+        default=True, description="Whether to cache levels once validated."
+    )
+    levels_dir: str = Field(
+        default=user_cache_path("levels"),
+        description="The location of the validated levels, readable only by the user.",
+    )
+
+
 class Settings(BaseSettings):
     assets_dir: str = Field(
         default=resource_path("./assets"),
@@ -50,7 +129,7 @@ class Settings(BaseSettings):
         default="title.txt", description="The location of the title ASCII art."
     )
     rng_seed: int = Field(default=1234, description="The RNG seed.")
-    karma: LLMSetting = LLMSetting()
+    karma: LLMSetting = LLMSetting(context_budget=32768)
     neuralsys: LLMSetting = LLMSetting(
         model_name="qwen2.5:32b",
         model_prompt="neuralsys_prompt",
@@ -59,6 +138,7 @@ class Settings(BaseSettings):
         top_p=0.95,
         top_k=40,
         num_ctx=4096,
+        cache_responses=True,
     )
     neuralcheck: LLMSetting = LLMSetting(
         model_name="qwen2.5:32b",
@@ -69,11 +149,28 @@ class Settings(BaseSettings):
         top_k=40,
         num_ctx=4096,
         thinking=False,
+        cache_responses=True,
     )
     chat: ChatSettings = ChatSettings()
+    prewarm_models: bool = Field(
+        default=True, description="Whether to load the LLMs while in the menus."
+    )
+    neuralctl_speculative: bool = Field(
+        default=False,
+        description="Whether NeuralSys sends the first request of an update while "
+        "it is being checked (faster, but that request is wasted on rejections).",
+    )
     server_url: str = Field(
         default="https://prompt_override.url", description="The server URL."
     )
+    connection: ConnectionSettings = ConnectionSettings()
+    cache: CacheSettings = CacheSettings()
+    saves_dir: str = Field(
+        default="./saves", description="The location of the saved game sessions."
+    )
+    autosave: bool = Field(
+        default=True, description="Whether the game is saved after every turn."
+    )
     user_name: str = Field(
         default="your-username", description="The username for the user."
     )
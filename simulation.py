@@ -0,0 +1,414 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from base_objects.goals import GoalTracker
+from base_objects.level import Level, TokenizerError
+from base_objects.vfs import File
+from llm.karma import Karma
+from llm.neuralsys import Check, NeuralSys
+from llm.registry import model_registry
+from settings import Settings, settings
+from templates import load_template
+
+
+logger = logging.getLogger("prompt_override")
+
+
+class SimulationError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+class _Notifier:
+    # stands in for the game screen that KARMA and NeuralSys notify
+    def notify(self, message: str, title: str = "", severity: str = "information"):
+        logger.debug(f"[{severity}] {title}: {message}")
+
+    def action_notify(
+        self, message: str, title: str = "", severity: str = "information"
+    ):
+        self.notify(message=message, title=title, severity=severity)
+
+
+class Simulation:
+    """A level played without the UI, with the same rules as `GameScreen`.
+
+    Each action either changes the level or raises a `SimulationError` with
+    the reason the game would refuse it. Goals are checked after every
+    action, in order, and the actions they were achieved by are kept in
+    `timeline`. With `narrate`, KARMA is told about achieved goals and
+    NeuralCtl requests as it is in the game (at the cost of an LLM request
+    each); otherwise KARMA is only asked by `chat`.
+    """
+
+    def __init__(self, level: Level, narrate: bool = False) -> None:
+        self.level = level
+        self.narrate = narrate
+        notifier = _Notifier()
+        model_registry.ensure_game_models(notify=notifier.notify)
+        self.karma = Karma(
+            parent=notifier,
+            snippets=[self.level.infos],
+            backstory=self.level.mission_backstory,
+        )
+        self.neuralsys = NeuralSys(parent=notifier)
+        self.karma.include_fs(level=self.level)
+        self.karma.include_goal_hints(level=self.level)
+
+        self.tracker = GoalTracker(self.level.goals)
+        self.goal_idx = 0
+        self.game_over = False
+        self.n_actions = 0
+        self.timeline: List[Dict[str, Any]] = []
+        self._start = time.perf_counter()
+        self._check_goals()
+
+    @staticmethod
+    def from_file(level_file: str, narrate: bool = False) -> "Simulation":
+        level = Level.from_file(level_file)
+        level.initialize()
+        return Simulation(level=level, narrate=narrate)
+
+    @property
+    def all_achieved(self) -> bool:
+        return self.goal_idx == len(self.level.goals)
+
+    def act(self, action: str, *args: Any) -> Any:
+        """Play `action` (e.g. `"login"`) with `args`, then check the goals."""
+        if self.game_over:
+            raise SimulationError("The game is over.")
+        f = getattr(self, f"action_{action}", None)
+        if f is None:
+            raise SimulationError(f"Unknown action {action}.")
+        self.n_actions += 1
+        try:
+            return f(*args)
+        finally:
+            self._check_goals()
+
+    def _check_goals(self) -> None:
+        self.tracker.update(vfs=self.level.fs)
+        while not self.all_achieved and self.tracker.holds(self.goal_idx):
+            goal = self.level.goals[self.goal_idx]
+            goal._solved = True
+            self.goal_idx += 1
+            self.timeline.append(
+                {
+                    "goal": goal.name,
+                    "action": self.n_actions,
+                    "seconds": time.perf_counter() - self._start,
+                }
+            )
+            self.karma.include_goal_hints(level=self.level)
+            goal_msg = load_template("goal_prompt_snippet").render(
+                goal_name=goal.name, goal_outcome=goal.outcome
+            )
+            if self.all_achieved:
+                self.game_over = True
+                goal_msg = self.karma.combine_messages(
+                    [goal_msg, self.level.read_asset("level_complete")]
+                )
+            self._tell_karma(goal_msg)
+
+    def _tell_karma(self, message: str) -> None:
+        if self.narrate:
+            self.karma.add_message(msg=message, role="user")
+            self.karma.chat()
+
+    def _get(self, path: str):
+        item = self.level.fs.get("/" + path.strip("/"))
+        if item is None or not self.level.fs.is_visible(
+            item, self.level.fs.current_user
+        ):
+            # the explorer does not list what is in a locked directory
+            raise SimulationError(f"{path} not found.")
+        return item
+
+    def _require(self, command: str) -> None:
+        # the same as `GameScreen.check_action`
+        if not self.level.fs.get(f"{command}.com").can_read(self.level.fs.current_user):
+            raise SimulationError(f"{command} is not available.")
+
+    def action_read(self, path: str) -> str:
+        # the same as opening a file in `ExplorerWidget`
+        doc = self._get(path)
+        user = self.level.fs.current_user
+        if not isinstance(doc, File):
+            raise SimulationError(f"{doc.name} is a folder.")
+        if not doc.can_write(user):
+            if not doc.can_read(user):
+                raise SimulationError(f"{doc.name} cannot be opened")
+            if doc.is_command:
+                raise SimulationError(f"{doc.name} is a command")
+        self.level.fs.mark_read(doc.name)
+        return doc.contents
+
+    def action_download(self, path: str) -> None:
+        self._require("download")
+        doc = self._get(path)
+        if not isinstance(doc, File):
+            raise SimulationError("Cannot download a folder!")
+        if not doc.can_read(self.level.fs.current_user):
+            raise SimulationError(f"Cannot download {doc.name}: file is locked.")
+        self.level.fs.mark_downloaded(doc.name)
+
+    def action_login(self, username: str, password: str) -> None:
+        self._require("login")
+        fs = self.level.fs
+        if username == fs.current_user:
+            return
+        if username not in fs.known_users:
+            raise SimulationError(f"User {username} not found.")
+        if password != self.level.credentials[username]:
+            raise SimulationError(f"Invalid password for user {username}.")
+        fs.current_user = username
+        self.level.add_login_msg(username=username)
+        self.karma.include_fs(level=self.level)
+
+    def _write(self, doc: File, contents: str) -> None:
+        # the same as opening the file in `ExplorerWidget` and saving it in
+        # `EditorScreen`
+        if not isinstance(doc, File) or not doc.can_write(self.level.fs.current_user):
+            raise SimulationError(f"{doc.name} cannot be edited.")
+        self.level.fs.mark_read(doc.name)
+        bak = self.level.fs.get(doc.name.split(".")[0] + ".bak")
+        if bak is not None:
+            bak.contents = doc.contents
+        doc.contents = contents
+
+    def action_edit(self, path: str, contents: str) -> None:
+        self._write(self._get(path), contents)
+
+    def action_set_prompt(self, text: str) -> None:
+        self._write(self.level.fs.get(self.level.sysprompt), text)
+
+    def action_append_prompt(self, text: str) -> None:
+        prompt = self.level.fs.get(self.level.sysprompt)
+        self._write(prompt, prompt.contents + text)
+
+    def action_neuralctl(self) -> str:
+        """Send the update request, as `GameScreen.evaluate_neuralctl` does."""
+        self._require("neuralctl")
+        try:
+            log_str = self.neuralsys.evaluate(
+                snippets=[self.level.neuralsys_prompt_snippet], level=self.level
+            )
+        except TokenizerError as e:
+            self.level.add_log_msg(msg=f"[TokenizerError]: {str(e)}")
+            raise SimulationError("Received garbled input, ignoring request.")
+        if log_str.endswith("."):
+            log_str = log_str[:-1]
+        log_str += f" (NeuralSys; Requested by user: {self.level.fs.current_user})."
+        self.level.add_log_msg(msg=log_str)
+        to_karma_msg = load_template("promptedit_prompt_snippet").render(
+            PREV_SYSPROMPT=self.level.neuralsys_prompt_backup,
+            NEW_SYSPROMPT=self.level.neuralsys_prompt_snippet,
+            LOG_MSG=log_str,
+            CURRENT_USER=self.level.fs.current_user,
+        )
+        if log_str.startswith(self.neuralsys.check_fail_prefix):
+            self.level.rollback_changes()
+            self.level.max_retries -= 1
+            if self.level.max_retries == 0:
+                self.game_over = True
+        self._tell_karma(to_karma_msg)
+        return log_str
+
+    def action_chat(self, message: str) -> str:
+        self.karma.add_message(msg=message, role="user")
+        return self.karma.chat()
+
+
+def run_trace(trace: Dict[str, Any], narrate: bool = False) -> Dict[str, Any]:
+    """Play the actions of `trace` and report how the level went.
+
+    A trace is `{"id": ..., "level": "level01.json", "actions": [...]}`,
+    where each action is a list of the action name and its arguments, e.g.
+    `["login", "admin", "password"]`. Levels are looked up in the assets
+    directory. Refused actions are reported and the trace carries on.
+    """
+    result: Dict[str, Any] = {"id": trace.get("id"), "level": trace["level"]}
+    actions: List[Dict[str, Any]] = []
+    result["actions"] = actions
+    start = time.perf_counter()
+    try:
+        simulation = Simulation.from_file(
+            os.path.join(settings.assets_dir, trace["level"]), narrate=narrate
+        )
+        result["load"] = time.perf_counter() - start
+        for name, *args in trace["actions"]:
+            action = {"action": name, "ok": True}
+            action_start = time.perf_counter()
+            try:
+                simulation.act(name, *args)
+            except SimulationError as e:
+                action["ok"] = False
+                action["detail"] = str(e)
+            action["seconds"] = time.perf_counter() - action_start
+            actions.append(action)
+            if simulation.game_over:
+                break
+        result["goals"] = simulation.goal_idx
+        result["total_goals"] = len(simulation.level.goals)
+        result["timeline"] = simulation.timeline
+        if simulation.all_achieved:
+            result["outcome"] = "completed"
+        elif simulation.game_over:
+            result["outcome"] = "game_over"
+        else:
+            result["outcome"] = "incomplete"
+    except Exception as e:
+        # one broken trace (or lost connection) does not end the whole batch
+        logger.exception(f"Trace {result['id']} failed: {e}")
+        result["outcome"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _use_settings(values: Dict[str, Any]) -> None:
+    # worker processes start from a fresh interpreter, without the parent's
+    # changes to the settings
+    new_settings = Settings.model_validate(values)
+    for name in Settings.model_fields:
+        setattr(settings, name, getattr(new_settings, name))
+
+
+def run_traces(
+    traces: Iterable[Dict[str, Any]],
+    processes: Optional[int] = None,
+    narrate: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """Play `traces` in a pool of `processes`, yielding results as they end.
+
+    Each process plays one trace at a time, and a trace makes at most one
+    LLM request at a time (two with a speculative NeuralCtl), so `processes`
+    also bounds the number of requests to the server. With a single process
+    the traces are played in this process, in order.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        for trace in traces:
+            yield run_trace(trace, narrate=narrate)
+        return
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_use_settings,
+        initargs=(settings.model_dump(),),
+    ) as executor:
+        futures = [
+            executor.submit(run_trace, trace, narrate=narrate) for trace in traces
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def level_diff(before: Level, after: Level) -> Dict[str, Any]:
+    """The credentials and file permissions changed on `after`, a copy of `before`."""
+    diff: Dict[str, Any] = {}
+    credentials = {
+        username: password
+        for username, password in after.credentials.items()
+        if before.credentials.get(username) != password
+    }
+    if credentials:
+        diff["credentials"] = credentials
+    after_files = {after.fs.path(item): item for item in after.fs.get_all()}
+    permissions = {}
+    for item in before.fs.get_all():
+        path = before.fs.path(item)
+        other = after_files.get(path)
+        if other is None:
+            continue
+        changed = {
+            name: getattr(other, name)
+            for name in ("read", "write")
+            if getattr(item, name) != getattr(other, name)
+        }
+        if changed:
+            permissions[path] = changed
+    if permissions:
+        diff["permissions"] = permissions
+    return diff
+
+
+class PromptEvaluator:
+    """Runs candidate prompts through NeuralSys' check and apply steps.
+
+    Each candidate replaces (or, with `append`, is appended to) the level's
+    prompt file on its own isolated copy of the level, so candidates never
+    see each other's changes. The update is applied only if the check
+    accepts it, unless `always_apply` is set, and at most `concurrency`
+    candidates are being evaluated at once.
+    """
+
+    def __init__(
+        self,
+        level: Level,
+        concurrency: int = 4,
+        append: bool = False,
+        always_apply: bool = False,
+    ) -> None:
+        self.level = level
+        self.append = append
+        self.always_apply = always_apply
+        notifier = _Notifier()
+        model_registry.ensure_game_models(notify=notifier.notify)
+        self.neuralsys = NeuralSys(parent=notifier)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def evaluate(self, prompt: str, prompt_id: Any = None) -> Dict[str, Any]:
+        async with self._semaphore:
+            return await self._evaluate(prompt, prompt_id)
+
+    async def _evaluate(self, prompt: str, prompt_id: Any) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"id": prompt_id, "prompt": prompt}
+        start = time.perf_counter()
+        level = self.level.isolated_copy()
+        prompt_file = level.fs.get(level.sysprompt)
+        prompt_file.contents = prompt_file.contents + prompt if self.append else prompt
+        try:
+            constraints = level.neuralsys_prompt_snippet
+            check = await self.neuralsys._acheck(level=level, constraints=constraints)
+            result["check_seconds"] = time.perf_counter() - start
+            result["outcome"] = "accepted" if check == Check.OK else "rejected"
+            if check == Check.OK or self.always_apply:
+                tool_calls: List[Dict[str, Any]] = []
+                apply_start = time.perf_counter()
+                result["reply"] = await self.neuralsys._aapply(
+                    level=level, constraints=constraints, tool_calls=tool_calls
+                )
+                result["apply_seconds"] = time.perf_counter() - apply_start
+                result["tool_calls"] = tool_calls
+                result["diff"] = level_diff(self.level, level)
+        except TokenizerError as e:
+            result["outcome"] = "garbled"
+            result["error"] = str(e)
+        except Exception as e:
+            # e.g. a lost connection, or a check that is neither OK nor ERROR
+            logger.exception(f"Prompt {prompt_id} failed: {e}")
+            result["outcome"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    async def evaluate_all(
+        self, prompts: Iterable[Tuple[Any, str]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Evaluate `(id, prompt)` pairs, yielding results as they are done."""
+        tasks = [
+            asyncio.create_task(self.evaluate(prompt, prompt_id))
+            for prompt_id, prompt in prompts
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,84 @@
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Callable, List, Set, Union
+
+from settings import settings
+
+
+logger = logging.getLogger("prompt_override")
+
+
+PLACEHOLDER = re.compile(r"\$([A-Za-z_][A-Za-z0-9_]*)\$")
+
+
+class TemplateError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+class Template:
+    """Text with `$name$` placeholders, parsed once and rendered in one pass.
+
+    Values are strings, or callables that are called once per placeholder
+    (e.g. to draw a new random value for each `$RAND$`). Values are not
+    scanned for placeholders themselves.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        # literals[0] names[0] literals[1] ... names[-1] literals[-1]
+        self._literals: List[str] = []
+        self._names: List[str] = []
+        start = 0
+        for match in PLACEHOLDER.finditer(source):
+            self._literals.append(source[start : match.start()])
+            self._names.append(match.group(1))
+            start = match.end()
+        self._literals.append(source[start:])
+        self._variables = set(self._names)
+
+    @property
+    def variables(self) -> Set[str]:
+        return set(self._variables)
+
+    def render(
+        self, strict: bool = True, **values: Union[str, Callable[[], str]]
+    ) -> str:
+        """Fill in the placeholders with `values`.
+
+        Missing values raise a `TemplateError`, unless `strict` is off, in
+        which case their placeholders are kept as they are.
+        """
+        if strict and not self._variables.issubset(values):
+            missing = sorted(self._variables.difference(values))
+            raise TemplateError(f"No value for {missing} in template.")
+        parts = [self._literals[0]]
+        for name, literal in zip(self._names, self._literals[1:]):
+            value = values.get(name)
+            if value is None:
+                parts.append(f"${name}$")
+            elif callable(value):
+                parts.append(value())
+            else:
+                parts.append(value)
+            parts.append(literal)
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> Template:
+    return Template(source)
+
+
+@lru_cache(maxsize=None)
+def _load_template(path: str) -> Template:
+    logger.debug(f"Compiling template {path}.")
+    with open(path, "r") as f:
+        return Template(f.read())
+
+
+def load_template(name: str) -> Template:
+    """The template in the assets file `name`, read and parsed once."""
+    return _load_template(os.path.join(settings.assets_dir, name))
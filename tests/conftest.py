@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# the game is run from the repository root, which its modules import from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from base_objects.level import Level  # noqa: E402
+from settings import settings  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def tmp_dirs(tmp_path, monkeypatch):
+    # compiled levels and saved sessions of a test stay in its own directory
+    monkeypatch.setattr(settings.cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(settings.cache, "levels_dir", str(tmp_path / "levels"))
+    monkeypatch.setattr(settings, "saves_dir", str(tmp_path / "saves"))
+
+
+@pytest.fixture
+def level() -> Level:
+    level = Level.from_file(os.path.join(settings.assets_dir, "level01.json"))
+    level.initialize()
+    return level
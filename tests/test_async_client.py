@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+from requests import ConnectionError
+from textual.app import App
+from textual.widgets import Input
+
+import utils
+from devtools.stub_server import StubConfig, StubServer
+from settings import settings
+from ui_elements.chat import ChatWidget
+from utils import CircuitBreaker, EndpointNotFoundError, asend_to_server, server_error
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = StubServer(StubConfig(latency=0.5, seed=0)).start()
+    monkeypatch.setattr(settings, "server_url", server.url)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def breaker(monkeypatch) -> CircuitBreaker:
+    breaker = CircuitBreaker()
+    monkeypatch.setattr(utils, "breaker", breaker)
+    monkeypatch.setattr(settings.connection, "breaker_threshold", 1)
+    monkeypatch.setattr(settings.connection, "breaker_cooldown", 0.0)
+    return breaker
+
+
+def generate_request():
+    return asend_to_server(
+        data={"model_name": "hermes3:latest", "messages": [], "options": {}},
+        endpoint="ollama_generate",
+    )
+
+
+def test_async_request(server, breaker):
+    response = asyncio.run(asend_to_server(data=None, endpoint="ollama_list_models"))
+    assert "hermes3:latest" in response["models"]
+
+
+def test_cancelled_probe_releases_the_breaker(server, breaker):
+    breaker.record_failure()
+    assert breaker.is_open
+
+    async def cancel_probe():
+        task = asyncio.create_task(generate_request())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    # the next request probes instead of being refused forever
+    assert breaker.before_request() is True
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ('{"message": "model not found"}', "model not found"),
+        ("<html>Bad Gateway</html>\n", "<html>Bad Gateway</html>"),
+        ("", "HTTP 502"),
+        ('["not", "an", "object"]', '["not", "an", "object"]'),
+    ],
+)
+def test_server_error_message(text, message):
+    error = server_error(502, text)
+    assert type(error) is ConnectionError
+    assert str(error) == message
+
+
+def test_missing_endpoint_error():
+    assert isinstance(server_error(404, ""), EndpointNotFoundError)
+    assert isinstance(server_error(405, ""), EndpointNotFoundError)
+
+
+class FailingKarma:
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+        self.messages = []
+
+    def add_message(self, msg: str, role: str) -> None:
+        self.messages.append(msg)
+
+    async def achat_stream(self):
+        yield "partial"
+        raise self.error
+
+
+class GameScreenStub:
+    def __init__(self) -> None:
+        self.saves = 0
+
+    def autosave(self) -> None:
+        self.saves += 1
+
+
+@pytest.mark.parametrize("error", [ConnectionError("down"), KeyError("message")])
+def test_chat_input_is_enabled_after_an_error(level, error):
+    game_screen = GameScreenStub()
+    chat = ChatWidget(game_screen=game_screen, level=level, karma=FailingKarma(error))
+
+    class ChatApp(App):
+        def compose(self):
+            yield chat
+
+    async def run():
+        app = ChatApp()
+        async with app.run_test() as pilot:
+            chat.stream_chat("hello")
+            await app.workers.wait_for_complete()
+            await pilot.pause()
+            assert not chat.query_one("#chat_input", Input).disabled
+            assert "partial" in chat.transcript
+            assert game_screen.saves == 1
+
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+from devtools.benchmark import Recorder, compare, summarize
+
+
+def report(**medians):
+    return {
+        "stub": {"latency": 0.0},
+        "metrics": {metric: {"median": median} for metric, median in medians.items()},
+    }
+
+
+def test_summarize():
+    stats = summarize([0.001 * i for i in range(1, 21)])
+    assert stats["n"] == 20
+    assert stats["min"] == 1.0
+    assert stats["median"] == 10.5
+    assert stats["p95"] == 19.0
+    assert stats["max"] == 20.0
+
+
+def test_timed_calls_count_once_when_recursive():
+    recorder = Recorder()
+
+    def countdown(n):
+        return n if n == 0 else timed(n - 1)
+
+    timed = recorder.timed("countdown", countdown)
+    timed(5)
+    assert len(recorder.samples["countdown"]) == 1
+
+
+def test_compare_flags_regressions(capsys):
+    baseline = report(load=10.0, chat=100.0, goals=1.0)
+    current = report(load=20.0, chat=110.0, goals=1.8, new=5.0)
+    # goals is 80% slower, but by less than the minimum delta
+    assert compare(current, baseline, threshold=0.25, min_delta_ms=2.0) == ["load"]
+    assert "(new)" in capsys.readouterr().out
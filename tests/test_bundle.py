@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import pytest
+
+from base_objects.bundle import LevelBundle, bundle_path, is_stale, pack_level
+from base_objects.level import BundledContents, Level
+from settings import settings
+
+
+@pytest.fixture
+def manifest(tmp_path) -> str:
+    path = str(tmp_path / "level01.json")
+    shutil.copy(os.path.join(settings.assets_dir, "level01.json"), path)
+    shutil.copytree(
+        os.path.join(settings.assets_dir, "level01"), str(tmp_path / "level01")
+    )
+    return path
+
+
+def touch_later(path: str, than: str) -> None:
+    mtime = os.path.getmtime(than) + 10
+    os.utime(path, (mtime, mtime))
+
+
+def test_pack_and_read(manifest):
+    path = pack_level(manifest)
+    bundle = LevelBundle.open(path)
+    with open(manifest, "r") as f:
+        assert bundle.read_text(LevelBundle.manifest) == f.read()
+    assets_dir = os.path.join(os.path.dirname(manifest), "level01")
+    for fname in os.listdir(assets_dir):
+        assert fname in bundle
+
+
+def test_missing_bundle_is_stale(manifest):
+    assert is_stale(manifest)
+    pack_level(manifest)
+    assert not is_stale(manifest)
+
+
+def test_edited_manifest_or_asset_makes_bundle_stale(manifest):
+    path = pack_level(manifest)
+    touch_later(manifest, than=path)
+    assert is_stale(manifest)
+
+    path = pack_level(manifest)
+    asset = os.path.join(os.path.dirname(manifest), "level01", "intro")
+    touch_later(asset, than=path)
+    assert is_stale(manifest)
+
+
+def test_bundle_without_manifest_is_not_stale(manifest):
+    pack_level(manifest)
+    os.remove(manifest)
+    assert os.path.exists(bundle_path(manifest))
+    assert not is_stale(manifest)
+
+
+def test_bundled_level_reads_its_files_from_the_bundle(manifest):
+    level = Level.from_file(manifest)
+    bundled = Level.from_file(pack_level(manifest))
+    paths = sorted(bundled.fs.path(item) for item in bundled.fs.index.items())
+    assert paths == sorted(level.fs.path(item) for item in level.fs.index.items())
+    welcome = bundled.fs.get("welcome.txt")
+    assert isinstance(welcome._loader, BundledContents)
+    assert welcome.contents == level.fs.get("welcome.txt").contents
+    assert bundled.read_asset("intro") == level.read_asset("intro")
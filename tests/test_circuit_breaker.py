@@ -0,0 +1,114 @@
+import pytest
+from requests import ConnectionError
+
+import utils
+from devtools.stub_server import StubConfig, StubServer
+from settings import settings
+from utils import CircuitBreaker, send_to_server
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(utils.time, "monotonic", clock)
+    monkeypatch.setattr(settings.connection, "breaker_threshold", 2)
+    monkeypatch.setattr(settings.connection, "breaker_cooldown", 30.0)
+    return clock
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(settings.connection.breaker_threshold):
+        probe = breaker.before_request()
+        breaker.record_failure()
+        breaker.after_request(probe)
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker()
+    assert breaker.before_request() is False
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(ConnectionError):
+        breaker.before_request()
+
+
+def test_client_errors_do_not_count(clock):
+    breaker = CircuitBreaker()
+    for _ in range(5):
+        breaker.record_response(404)
+    assert not breaker.is_open
+    breaker.record_response(500)
+    breaker.record_response(503)
+    assert breaker.is_open
+
+
+def test_success_resets_failures(clock):
+    breaker = CircuitBreaker()
+    breaker.record_failure()
+    breaker.record_response(200)
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_single_probe_after_cooldown(clock):
+    breaker = CircuitBreaker()
+    open_breaker(breaker)
+    clock.now += 31
+    assert breaker.before_request() is True
+    # only one request probes at a time
+    with pytest.raises(ConnectionError):
+        breaker.before_request()
+    breaker.record_response(200)
+    breaker.after_request(True)
+    assert not breaker.is_open
+    assert breaker.before_request() is False
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker()
+    open_breaker(breaker)
+    clock.now += 31
+    probe = breaker.before_request()
+    breaker.record_failure()
+    breaker.after_request(probe)
+    assert breaker.is_open
+    with pytest.raises(ConnectionError):
+        breaker.before_request()
+    clock.now += 31
+    assert breaker.before_request() is True
+
+
+def test_failing_server_is_not_asked_again(clock, monkeypatch):
+    server = StubServer(StubConfig(error_rate=1.0, seed=0)).start()
+    try:
+        monkeypatch.setattr(settings, "server_url", server.url)
+        monkeypatch.setattr(utils, "breaker", CircuitBreaker())
+        for _ in range(settings.connection.breaker_threshold):
+            with pytest.raises(ConnectionError):
+                send_to_server(data=None, endpoint="ollama_list_models")
+        requests = sum(server.stats.values())
+        assert requests > 0
+        with pytest.raises(ConnectionError, match="unreachable"):
+            send_to_server(data=None, endpoint="ollama_list_models")
+        assert sum(server.stats.values()) == requests
+    finally:
+        server.stop()
+
+
+def test_timeouts_per_endpoint():
+    connect, read = utils.get_timeout("ollama_generate")
+    assert connect == settings.connection.connect_timeout
+    assert read == settings.connection.generate_timeout
+    assert utils.get_timeout("ollama_list_models")[1] == (
+        settings.connection.read_timeout
+    )
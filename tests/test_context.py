@@ -0,0 +1,76 @@
+from llm.context import ConversationContext, estimate_tokens
+from settings import LLMSetting
+
+
+def make_context(budget: int) -> ConversationContext:
+    return ConversationContext(
+        system_prompt="You are KARMA.", llm_setting=LLMSetting(context_budget=budget)
+    )
+
+
+def test_within_budget_keeps_everything():
+    context = make_context(budget=1000)
+    context.add("hello", role="user")
+    context.add("hi there", role="assistant")
+    assert [m["content"] for m in context.messages] == [
+        "You are KARMA.",
+        "hello",
+        "hi there",
+    ]
+    assert context.token_count == sum(
+        estimate_tokens(m["content"]) for m in context.messages
+    )
+
+
+def test_trims_oldest_turns_into_summary():
+    context = make_context(budget=200)
+    for i in range(20):
+        context.add(f"message number {i} " + "x" * 80, role="user")
+    messages = context.messages
+    assert context.token_count <= context.budget
+    assert messages[0]["content"] == "You are KARMA."
+    assert messages[1]["content"].startswith(ConversationContext.SUMMARY_HEADER)
+    assert messages[-1]["content"].startswith("message number 19 ")
+    # the summary ends with the latest of the dropped turns
+    first_kept = int(messages[2]["content"].split()[2])
+    summary_lines = messages[1]["content"].splitlines()
+    assert summary_lines[-1].startswith(f"- user: message number {first_kept - 1} ")
+    assert "message number 0 " not in messages[1]["content"]
+    assert context.token_count == sum(estimate_tokens(m["content"]) for m in messages)
+
+
+def test_slots_are_pinned_and_replaced():
+    context = make_context(budget=120)
+    context.set_slot("fs", "the file system")
+    for i in range(10):
+        context.add(f"turn {i} " + "y" * 100, role="user")
+    context.set_slot("fs", "the new file system")
+    contents = [m["content"] for m in context.messages]
+    assert "the file system" not in contents
+    assert contents.count("the new file system") == 1
+    context.clear_slot("fs")
+    assert "the new file system" not in [m["content"] for m in context.messages]
+
+
+def test_latest_entry_is_kept_over_budget():
+    context = make_context(budget=20)
+    context.add("z" * 1000, role="user")
+    assert context.messages[-1]["content"] == "z" * 1000
+
+
+def test_restore_rebuilds_the_same_context():
+    context = make_context(budget=150)
+    context.set_slot("hints", "a hint")
+    for i in range(8):
+        context.add(f"turn {i} " + "w" * 60, role="user" if i % 2 else "assistant")
+    context.clear_slot("hints")
+
+    restored = make_context(budget=150)
+    restored.restore(context.state())
+    assert restored.messages == context.messages
+    assert restored.token_count == context.token_count
+    assert restored.state() == context.state()
+    # new entries do not reuse the ids of the restored ones
+    restored.add("one more", role="user")
+    ids = [entry["id"] for entry in restored.state()["entries"]]
+    assert len(set(ids)) == len(ids)
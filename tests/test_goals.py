@@ -0,0 +1,97 @@
+import pickle
+
+import pytest
+from pydantic import ValidationError
+
+from base_objects.goals import GoalTracker, Trigger
+
+
+@pytest.mark.parametrize("function_name", ["has_read", "has_downloaded"])
+def test_trigger_on_files(level, function_name):
+    trigger = Trigger(function_name=function_name, parameters={"fname": "notebook.md"})
+    assert not trigger.evaluate(level.fs)
+    getattr(level.fs, function_name.replace("has_", "mark_"))("notebook.md")
+    assert trigger.evaluate(level.fs)
+    assert trigger.fact == (function_name, "notebook.md")
+
+
+def test_trigger_on_the_user(level):
+    trigger = Trigger(function_name="is_logged_as", parameters={"username": "admin"})
+    assert not trigger.evaluate(level.fs)
+    level.fs.current_user = "admin"
+    assert trigger.evaluate(level.fs)
+
+
+@pytest.mark.parametrize("function_name", ["mark_read", "get", "_record", "nope"])
+def test_trigger_rejects_other_functions(function_name):
+    with pytest.raises(ValidationError, match="is not a trigger function"):
+        Trigger(function_name=function_name, parameters={"fname": "notebook.md"})
+
+
+def test_trigger_rejects_wrong_parameters():
+    with pytest.raises(ValidationError, match="Invalid parameters for has_read"):
+        Trigger(function_name="has_read", parameters={"username": "admin"})
+
+
+def test_unpickled_trigger_is_compiled_again(level):
+    trigger = Trigger(function_name="is_logged_as", parameters={"username": "guest"})
+    assert pickle.loads(pickle.dumps(trigger)).evaluate(level.fs)
+
+
+def test_changed_facts(level):
+    fs = level.fs
+    fs.pop_changed_facts()
+    fs.mark_read("todo.txt")
+    fs.mark_read("todo.txt")
+    fs.current_user = "admin"
+    assert fs.pop_changed_facts() == {("has_read", "todo.txt"), ("is_logged_as",)}
+    assert fs.pop_changed_facts() == set()
+
+
+def tracker_with_counted_triggers(level):
+    evaluated = []
+    for goal in level.goals:
+        for trigger in goal.triggers:
+            predicate = trigger._predicate
+
+            def counted(vfs, trigger=trigger, predicate=predicate):
+                evaluated.append(str(trigger))
+                return predicate(vfs)
+
+            trigger._predicate = counted
+    return GoalTracker(level.goals), evaluated
+
+
+def test_tracker_only_evaluates_triggers_on_changed_facts(level):
+    tracker, evaluated = tracker_with_counted_triggers(level)
+    tracker.update(level.fs)
+    n_triggers = sum(len(goal.triggers) for goal in level.goals)
+    assert len(evaluated) == n_triggers
+    evaluated.clear()
+    tracker.update(level.fs)
+    assert evaluated == []
+    level.fs.mark_read("welcome.txt")
+    tracker.update(level.fs)
+    assert all(name.startswith("has_read(fname='welcome.txt'") for name in evaluated)
+
+
+def test_tracker_agrees_with_the_goals(level):
+    tracker = GoalTracker(level.goals)
+    triggers = [trigger for goal in level.goals for trigger in goal.triggers]
+    for trigger in triggers:
+        if trigger.function_name == "is_logged_as":
+            level.fs.current_user = trigger.parameters["username"]
+        else:
+            getattr(level.fs, trigger.function_name.replace("has_", "mark_"))(
+                *trigger.parameters.values()
+            )
+        tracker.update(level.fs)
+        for goal_idx, goal in enumerate(level.goals):
+            assert tracker.holds(goal_idx) == goal.resolved(level.fs)
+    assert all(tracker.holds(i) for i in range(len(level.goals)))
+    # logging out makes the goals on the user hold no more
+    level.fs.current_user = "guest"
+    tracker.update(level.fs)
+    assert not all(tracker.holds(i) for i in range(len(level.goals)))
+    for goal_idx, goal in enumerate(level.goals):
+        assert tracker.holds(goal_idx) == goal.resolved(level.fs)
@@ -0,0 +1,90 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+from requests import ConnectionError
+
+import utils
+
+from devtools.stub_server import StubConfig, StubServer
+from llm.karma import Karma
+from settings import settings
+
+
+class Notifier:
+    def notify(self, *args, **kwargs) -> None:
+        pass
+
+
+@pytest.fixture
+def server(request, monkeypatch):
+    server = StubServer(StubConfig(stream=request.param, seed=0)).start()
+    monkeypatch.setattr(settings, "server_url", server.url)
+    monkeypatch.setattr(Karma, "_unstreamed_servers", set())
+    yield server
+    server.stop()
+
+
+def make_karma() -> Karma:
+    karma = Karma(parent=Notifier(), snippets=[], backstory="")
+    karma.add_message(msg="hello", role="user")
+    return karma
+
+
+async def collect(karma: Karma) -> str:
+    async with aclosing(karma.achat_stream()) as stream:
+        return "".join([token async for token in stream])
+
+
+@pytest.mark.parametrize("server", [True], indirect=True)
+def test_streamed_reply_is_recorded(server):
+    karma = make_karma()
+    reply = "".join(karma.chat_stream())
+    assert reply in StubConfig().karma_replies
+    assert karma.messages[-1] == {"role": "assistant", "content": reply}
+    assert Karma._can_stream()
+
+
+@pytest.mark.parametrize("server", [False], indirect=True)
+def test_falls_back_without_streaming_endpoint(server):
+    karma = make_karma()
+    reply = "".join(karma.chat_stream())
+    assert reply in StubConfig().karma_replies
+    assert karma.messages[-1] == {"role": "assistant", "content": reply}
+    # the server is not asked to stream again
+    assert not Karma._can_stream()
+    assert asyncio.run(collect(karma)) in StubConfig().karma_replies
+    assert [m["role"] for m in karma.messages[-2:]] == ["assistant", "assistant"]
+
+
+@pytest.mark.parametrize("server", [False], indirect=True)
+def test_async_falls_back_without_streaming_endpoint(server):
+    karma = make_karma()
+    reply = asyncio.run(collect(karma))
+    assert reply in StubConfig().karma_replies
+    assert karma.messages[-1] == {"role": "assistant", "content": reply}
+    assert not Karma._can_stream()
+
+
+@pytest.mark.parametrize("server", [True], indirect=True)
+def test_interrupted_stream_keeps_what_was_shown(server):
+    karma = make_karma()
+    stream = karma.chat_stream()
+    first = next(stream)
+    stream.close()
+    assert karma.messages[-1] == {"role": "assistant", "content": first}
+
+
+def test_chunks_are_parsed():
+    chunk = utils._parse_chunk(b'{"message": {"content": "hi"}, "done": false}')
+    assert chunk["message"]["content"] == "hi"
+    assert utils._parse_chunk(b'{"error": "model not found"}')["error"]
+
+
+@pytest.mark.parametrize(
+    "line",
+    [b"not json", b'"a string"', b'{"done": true}', b'{"message": "text"}'],
+)
+def test_malformed_chunks(line):
+    with pytest.raises(ConnectionError):
+        utils._parse_chunk(line)
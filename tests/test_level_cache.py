@@ -0,0 +1,190 @@
+import os
+import pickle
+from typing import List, Optional
+
+import pytest
+from pydantic import BaseModel
+
+from base_objects.level import Level
+from base_objects.level_cache import (
+    LevelCache,
+    apply_rand_sites,
+    find_rand_sites,
+    level_cache,
+    schema_fingerprint,
+)
+from base_objects.vfs import Directory, File, LogFile
+from settings import settings
+
+
+@pytest.fixture
+def cache(monkeypatch) -> LevelCache:
+    monkeypatch.setattr(settings.cache, "compile_levels", True)
+    level_cache.clear()
+    level_cache.hits = level_cache.misses = 0
+    return level_cache
+
+
+def load() -> Level:
+    level = Level.from_file(os.path.join(settings.assets_dir, "level01.json"))
+    level.initialize()
+    return level
+
+
+def entries(cache: LevelCache) -> List[bytes]:
+    return list(cache._memory.values())
+
+
+def test_loads_are_cached_and_randomized(cache):
+    first, second = load(), load()
+    assert cache.stats == {"hits": 1, "misses": 1, "entries": 1}
+    assert "$RAND$" not in first.credentials["admin"]
+    assert first.credentials["admin"] != second.credentials["admin"]
+    assert first.fs.to_karma_format != ""
+    assert isinstance(second.fs.get("auth.log"), LogFile)
+    assert second.fs.get("transactions_note.txt").can_read("admin")
+
+
+def test_entries_are_read_from_disk(cache):
+    load()
+    cache._memory.clear()
+    load()
+    assert cache.stats["hits"] == 1
+
+
+def test_entries_leave_out_runtime_state(cache):
+    level = load()
+    level.fs.get("welcome.txt").can_read("guest")
+    level.snapshot()
+    entry = entries(cache)[0]
+    assert b"_FileSystemContext" not in entry
+    assert b"_FileSystemIndex" not in entry
+    assert b"LevelSnapshot" not in entry
+
+
+def test_unreadable_entry_is_replaced(cache):
+    load()
+    key = next(iter(cache._memory))
+    cache._memory[key] = b"garbage"
+    level = load()
+    assert level.credentials["guest"] == "password"
+    assert cache._memory[key] != b"garbage"
+
+
+def test_unpickled_level_can_be_snapshot(cache):
+    load()
+    level = load()
+    snapshot = level.snapshot()
+    level.fs.get("welcome.txt").read = ["admin"]
+    level.credentials["guest"] = "changed"
+    level.rollback(snapshot)
+    assert level.fs.get("welcome.txt").can_read("guest")
+    assert level.credentials["guest"] == "password"
+
+
+class Leaf(BaseModel):
+    value: str = ""
+
+
+class Tree(BaseModel):
+    leaves: List[Leaf] = []
+    parent: Optional["Tree"] = None
+
+
+def test_fingerprint_follows_the_schema():
+    fingerprint = schema_fingerprint(Tree)
+    assert schema_fingerprint(Tree) == fingerprint
+    assert schema_fingerprint(Leaf) != fingerprint
+
+    class OtherLeaf(BaseModel):
+        value: int = 0
+
+    class OtherTree(BaseModel):
+        leaves: List[OtherLeaf] = []
+        parent: Optional["OtherTree"] = None
+
+    OtherTree.model_rebuild()
+    assert schema_fingerprint(OtherTree) != fingerprint
+
+
+def test_fingerprint_covers_subclasses_and_private_attributes():
+    class Item(BaseModel):
+        name: str = ""
+
+    class Folder(BaseModel):
+        items: List[Item] = []
+
+    fingerprint = schema_fingerprint(Folder)
+
+    class Log(Item):
+        _entries: List[str] = []
+
+    assert schema_fingerprint(Folder) != fingerprint
+
+
+def test_key_depends_on_the_schema(cache):
+    assert cache.key("{}", bundled=False, model=Level) != cache.key(
+        "{}", bundled=False, model=Tree
+    )
+    assert cache.key("{}", bundled=False, model=Level) != cache.key(
+        "{}", bundled=True, model=Level
+    )
+
+
+def test_rand_sites_in_tuples():
+    directory = Directory(
+        name="$RAND$",
+        contents=[File(name="f", read=["guest", "$RAND$"], contents="$RAND$")],
+    )
+    sites = find_rand_sites(directory)
+    assert len(sites) == 3
+    apply_rand_sites(directory, sites)
+    item = directory.contents[0]
+    assert isinstance(item.read, tuple)
+    assert item.read[0] == "guest"
+    assert "$RAND$" not in directory.name + item.read[1] + item.contents
+
+
+def test_entries_are_private_to_the_user(cache):
+    load()
+    assert os.stat(cache.cache_dir).st_mode & 0o777 == 0o700
+    key_path = os.path.join(cache.cache_dir, LevelCache.key_name)
+    assert os.stat(key_path).st_mode & 0o777 == 0o600
+    # not in the directory the game is run from
+    assert cache.cache_dir == settings.cache.levels_dir
+
+
+def test_tampered_entry_is_compiled_again(cache):
+    load()
+    key = next(iter(cache._memory))
+    path = cache._path(key)
+    with open(path, "rb") as f:
+        data = f.read()
+    # e.g. an entry that runs code when it is unpickled
+    payload = pickle.dumps(Exploit())
+    with open(path, "wb") as f:
+        f.write(data[:32] + payload)
+    cache._memory.clear()
+    level = load()
+    assert level.credentials["guest"] == "password"
+    assert not Exploit.ran
+    assert cache.stats["hits"] == 0
+    with open(path, "rb") as f:
+        assert f.read()[32:] != payload
+
+
+def test_entries_signed_with_another_key_are_compiled_again(cache):
+    load()
+    cache._memory.clear()
+    cache._secrets.clear()
+    with open(os.path.join(cache.cache_dir, LevelCache.key_name), "wb") as f:
+        f.write(b"another key")
+    load()
+    assert cache.stats["hits"] == 0
+
+
+class Exploit:
+    ran = False
+
+    def __reduce__(self):
+        return (setattr, (Exploit, "ran", True))
@@ -0,0 +1,93 @@
+import pytest
+
+
+def test_rollback_restores_credentials_and_permissions(level):
+    welcome = level.fs.get("home/guest/welcome.txt")
+    credentials = dict(level.credentials)
+
+    snapshot = level.snapshot()
+    level.credentials["guest"] = "changed"
+    welcome.read = ["guest"]
+    welcome.write = ["guest"]
+    welcome.read = ["j.davies"]
+    level.rollback(snapshot)
+
+    assert level.credentials == credentials
+    assert welcome.read == ("admin", "guest")
+    assert welcome.write == ("admin",)
+    assert welcome.can_read("admin")
+    assert not welcome.can_read("j.davies")
+    assert level.fs.index.context.journal is None
+
+
+def test_rollback_keeps_the_player_progress(level):
+    # what the player did meanwhile is not part of a snapshot
+    snapshot = level.snapshot()
+    log = level.fs.get("auth.log")
+    level.fs.current_user = "j.davies"
+    level.fs.mark_read("welcome.txt")
+    level.add_login_msg("j.davies")
+    contents = log.contents
+    level.rollback(snapshot)
+    assert level.fs.current_user == "j.davies"
+    assert level.fs.has_read("welcome.txt")
+    assert log.contents == contents
+
+
+def test_only_permissions_are_journaled(level):
+    snapshot = level.snapshot()
+    level.fs.get("welcome.txt").contents = "overwritten"
+    level.add_log_msg("entry")
+    assert len(snapshot.context.journal) == snapshot.mark
+    level.fs.get("welcome.txt").read = ["guest"]
+    assert len(snapshot.context.journal) == snapshot.mark + 1
+    level.commit(snapshot)
+
+
+def test_commit_keeps_the_changes(level):
+    snapshot = level.snapshot()
+    level.credentials["guest"] = "changed"
+    level.fs.get("transactions.db").read = ["guest"]
+    level.commit(snapshot)
+    assert level.credentials["guest"] == "changed"
+    assert level.fs.get("transactions.db").can_read("guest")
+    assert level.fs.index.context.journal is None
+
+
+def test_nested_snapshots(level):
+    outer = level.snapshot()
+    level.credentials["guest"] = "first"
+    inner = level.snapshot()
+    level.credentials["guest"] = "second"
+    level.rollback(inner)
+    assert level.credentials["guest"] == "first"
+    inner = level.snapshot()
+    level.credentials["guest"] = "third"
+    # ending a snapshot ends those taken after it
+    level.rollback(outer)
+    assert level.credentials["guest"] == "password"
+    assert level._snapshots == []
+
+
+def test_transaction_rolls_back_on_error(level):
+    with pytest.raises(RuntimeError):
+        with level.transaction():
+            level.credentials["guest"] = "changed"
+            raise RuntimeError()
+    assert level.credentials["guest"] == "password"
+
+    with level.transaction():
+        level.credentials["guest"] = "changed"
+    assert level.credentials["guest"] == "changed"
+
+
+def test_isolated_copy_is_independent(level):
+    snapshot = level.snapshot()
+    copy = level.isolated_copy()
+    copy.credentials["guest"] = "changed"
+    copy.fs.get("transactions.db").read = ["guest"]
+    # the copy does not record into the journal of this level's snapshot
+    assert len(snapshot.context.journal) == snapshot.mark
+    assert level.credentials["guest"] == "password"
+    assert not level.fs.get("transactions.db").can_read("guest")
+    level.commit(snapshot)
@@ -0,0 +1,187 @@
+import asyncio
+import threading
+from typing import Any, Dict, List
+
+import pytest
+from requests import ConnectionError
+
+from llm import neuralsys
+from llm.neuralsys import Check, NeuralSys
+from settings import settings
+
+
+class Notifier:
+    def notify(self, *args, **kwargs) -> None:
+        pass
+
+
+def update_guest_password() -> Dict[str, Any]:
+    arguments = {"username": "guest", "old_password": "password", "new_password": "x"}
+    return {
+        "message": {
+            "content": "",
+            "tool_calls": [
+                {"function": {"name": "update_credentials", "arguments": arguments}}
+            ],
+        }
+    }
+
+
+DONE = {"message": {"content": "Done."}}
+
+
+class FakeServer:
+    def __init__(self, replies: List[Dict[str, Any]]) -> None:
+        self.replies = replies
+        self.requests = 0
+
+    def send(self, **kwargs) -> Dict[str, Any]:
+        self.requests += 1
+        if not self.replies:
+            raise ConnectionError("Server is unreachable.")
+        return self.replies.pop(0)
+
+    async def asend(self, **kwargs) -> Dict[str, Any]:
+        return self.send(**kwargs)
+
+
+def fake_server(monkeypatch, replies: List[Dict[str, Any]]) -> FakeServer:
+    server = FakeServer(replies)
+    monkeypatch.setattr(neuralsys, "cached_send_to_server", server.send)
+    monkeypatch.setattr(neuralsys, "acached_send_to_server", server.asend)
+    return server
+
+
+def fake_check(monkeypatch, check: Check) -> None:
+    async def acheck(self, level, constraints):
+        return check
+
+    monkeypatch.setattr(NeuralSys, "_check", lambda self, level, constraints: check)
+    monkeypatch.setattr(NeuralSys, "_acheck", acheck)
+
+
+def test_apply_runs_the_tools(level, monkeypatch):
+    fake_server(monkeypatch, [update_guest_password(), DONE])
+    tool_calls = []
+    result = NeuralSys(parent=Notifier())._apply(
+        level=level, constraints="", tool_calls=tool_calls
+    )
+    assert result == "Done."
+    assert level.credentials["guest"] == "x"
+    assert [call["name"] for call in tool_calls] == ["update_credentials"]
+    assert level._snapshots == []
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_failed_apply_only_rolls_back_its_changes(level, monkeypatch, run_async):
+    # the server goes away after the first tool call
+    fake_server(monkeypatch, [update_guest_password()])
+    level.add_login_msg("guest")
+    level.fs.mark_read("welcome.txt")
+    log = level.fs.get("auth.log").contents
+    ns = NeuralSys(parent=Notifier())
+    with pytest.raises(ConnectionError):
+        if run_async:
+            asyncio.run(ns._aapply(level=level, constraints=""))
+        else:
+            ns._apply(level=level, constraints="")
+    assert level.credentials["guest"] == "password"
+    assert level.fs.has_read("welcome.txt")
+    assert level.fs.get("auth.log").contents == log
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_speculative_update_is_applied_once_accepted(level, monkeypatch, run_async):
+    monkeypatch.setattr(settings, "neuralctl_speculative", True)
+    fake_check(monkeypatch, Check.OK)
+    server = fake_server(monkeypatch, [update_guest_password(), DONE])
+    ns = NeuralSys(parent=Notifier())
+    if run_async:
+        result = asyncio.run(ns.aevaluate(snippets=[""], level=level))
+    else:
+        result = ns.evaluate(snippets=[""], level=level)
+    assert result == "Done."
+    assert level.credentials["guest"] == "x"
+    assert server.requests == 2
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_rejected_speculative_update_changes_nothing(level, monkeypatch, run_async):
+    monkeypatch.setattr(settings, "neuralctl_speculative", True)
+    fake_check(monkeypatch, Check.ERROR)
+    fake_server(monkeypatch, [update_guest_password(), DONE])
+    ns = NeuralSys(parent=Notifier())
+    if run_async:
+        result = asyncio.run(ns.aevaluate(snippets=[""], level=level))
+    else:
+        result = ns.evaluate(snippets=[""], level=level)
+    assert result.startswith(ns.check_fail_prefix)
+    assert level.credentials["guest"] == "password"
+
+
+def test_evaluator_applies_to_one_copy_of_the_level(level, monkeypatch):
+    import simulation
+    from base_objects.level import Level
+
+    monkeypatch.setattr(
+        simulation.model_registry, "ensure_game_models", lambda notify: None
+    )
+    fake_check(monkeypatch, Check.OK)
+    fake_server(monkeypatch, [update_guest_password(), DONE])
+    copies = []
+    isolated_copy = Level.isolated_copy
+
+    def counted_copy(self):
+        copies.append(self)
+        return isolated_copy(self)
+
+    monkeypatch.setattr(Level, "isolated_copy", counted_copy)
+    evaluator = simulation.PromptEvaluator(level=level)
+    result = asyncio.run(evaluator.evaluate("Be nice."))
+    assert result["outcome"] == "accepted"
+    assert result["diff"]["credentials"] == {"guest": "x"}
+    assert copies == [level]
+    assert level.credentials["guest"] == "password"
+
+
+@pytest.mark.parametrize("speculative", [False, True])
+def test_update_is_sent_while_it_is_checked(level, monkeypatch, speculative):
+    monkeypatch.setattr(settings, "neuralctl_speculative", speculative)
+    server = fake_server(monkeypatch, [update_guest_password(), DONE])
+    sent = threading.Event()
+    send = server.send
+
+    def send_and_signal(**kwargs):
+        sent.set()
+        return send(**kwargs)
+
+    monkeypatch.setattr(neuralsys, "cached_send_to_server", send_and_signal)
+    sent_during_check = []
+
+    def check(self, level, constraints):
+        # only waits for the update if it is sent at the same time
+        sent_during_check.append(sent.wait(timeout=2 if speculative else 0))
+        return Check.OK
+
+    monkeypatch.setattr(NeuralSys, "_check", check)
+    assert NeuralSys(parent=Notifier()).evaluate(snippets=[""], level=level) == "Done."
+    assert sent_during_check == [speculative]
+
+
+@pytest.mark.parametrize("speculative", [False, True])
+def test_async_update_is_sent_while_it_is_checked(level, monkeypatch, speculative):
+    monkeypatch.setattr(settings, "neuralctl_speculative", speculative)
+    server = fake_server(monkeypatch, [update_guest_password(), DONE])
+    sent_during_check = []
+
+    async def acheck(self, level, constraints):
+        for _ in range(10):
+            await asyncio.sleep(0)
+        sent_during_check.append(server.requests > 0)
+        return Check.OK
+
+    monkeypatch.setattr(NeuralSys, "_acheck", acheck)
+    ns = NeuralSys(parent=Notifier())
+    assert asyncio.run(ns.aevaluate(snippets=[""], level=level)) == "Done."
+    assert sent_during_check == [speculative]
+    assert level.credentials["guest"] == "x"
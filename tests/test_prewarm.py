@@ -0,0 +1,88 @@
+from typing import Any, Dict, List
+
+import pytest
+from requests import ConnectionError
+
+from llm import prewarm
+from llm.prewarm import ModelWarmer, WarmState
+from settings import settings
+
+
+class FakeServer:
+    def __init__(self) -> None:
+        self.requests: List[Dict[str, Any]] = []
+        self.reachable = True
+
+    def send(self, data: Dict[str, Any], endpoint: str) -> Dict[str, Any]:
+        self.requests.append(data)
+        if not self.reachable:
+            raise ConnectionError("Server is unreachable.")
+        return {"message": {"role": "assistant", "content": ""}}
+
+
+@pytest.fixture
+def server(monkeypatch) -> FakeServer:
+    server = FakeServer()
+    monkeypatch.setattr(prewarm, "send_to_server", server.send)
+    monkeypatch.setattr(prewarm.model_registry, "is_available", lambda name: True)
+    monkeypatch.setattr(settings, "prewarm_models", True)
+    monkeypatch.setattr(settings.connection, "warm_ttl", 60.0)
+    monkeypatch.setattr(settings.karma, "model_name", "hermes3:latest")
+    monkeypatch.setattr(settings.neuralcheck, "model_name", "qwen2.5:32b")
+    monkeypatch.setattr(settings.neuralsys, "model_name", "qwen2.5:32b")
+    return server
+
+
+def test_each_model_is_warmed_once(server):
+    warmer = ModelWarmer()
+    warmer.warm_all()
+    warmer.warm_all()
+    # NeuralCheck and NeuralSys share their model and context size
+    assert [request["model_name"] for request in server.requests] == [
+        "hermes3:latest",
+        "qwen2.5:32b",
+    ]
+    assert server.requests[0]["messages"] == []
+    assert warmer.status == {
+        "hermes3:latest": WarmState.WARM,
+        "qwen2.5:32b": WarmState.WARM,
+    }
+
+
+def test_another_context_size_is_warmed_again(server, monkeypatch):
+    warmer = ModelWarmer()
+    warmer.warm(settings.neuralsys)
+    monkeypatch.setattr(settings.neuralcheck, "num_ctx", 8192)
+    assert warmer.state(settings.neuralcheck) == WarmState.COLD
+    warmer.warm(settings.neuralcheck)
+    assert server.requests[-1]["options"] == {"num_ctx": 8192}
+
+
+def test_models_are_warmed_again_once_unloaded(server, monkeypatch):
+    warmer = ModelWarmer()
+    warmer.warm(settings.karma)
+    monkeypatch.setattr(settings.connection, "warm_ttl", -1.0)
+    assert warmer.state(settings.karma) == WarmState.COLD
+    warmer.warm(settings.karma)
+    assert len(server.requests) == 2
+
+
+def test_failed_warm_ups_are_tried_again(server):
+    warmer = ModelWarmer()
+    server.reachable = False
+    assert warmer.warm(settings.karma) == WarmState.FAILED
+    server.reachable = True
+    assert warmer.warm(settings.karma) == WarmState.WARM
+
+
+def test_missing_models_are_not_warmed(server, monkeypatch):
+    monkeypatch.setattr(prewarm.model_registry, "is_available", lambda name: False)
+    warmer = ModelWarmer()
+    assert warmer.warm(settings.karma) == WarmState.COLD
+    assert server.requests == []
+
+
+def test_warming_can_be_turned_off(server, monkeypatch):
+    monkeypatch.setattr(settings, "prewarm_models", False)
+    ModelWarmer().warm_all()
+    assert server.requests == []
@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Any, Dict, List
+
+import pytest
+from requests import ConnectionError
+
+from llm import registry
+from llm.registry import ModelRegistry
+from settings import settings
+from utils import CircuitBreaker
+
+
+class FakeServer:
+    def __init__(self, models: List[str]) -> None:
+        self.models = models
+        self.requests: List[str] = []
+        self.reachable = True
+        # set to make requests wait until it is released
+        self.gate: threading.Event = None
+
+    def send(self, data: Dict[str, Any], endpoint: str) -> Dict[str, Any]:
+        self.requests.append(endpoint)
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        if not self.reachable:
+            raise ConnectionError("Server is unreachable.")
+        if endpoint == "ollama_init_model":
+            self.models.append(data["model_name"])
+            return {}
+        return {"models": list(self.models)}
+
+
+@pytest.fixture
+def server(monkeypatch) -> FakeServer:
+    server = FakeServer(models=["hermes3:latest"])
+    monkeypatch.setattr(registry, "send_to_server", server.send)
+    monkeypatch.setattr(settings.connection, "models_ttl", 60.0)
+    return server
+
+
+def test_model_list_is_fetched_once(server):
+    models = ModelRegistry()
+    assert models.is_reachable()
+    assert models.is_available("hermes3:latest")
+    assert not models.is_available("qwen2.5:32b")
+    assert server.requests == ["ollama_list_models"]
+
+
+def test_model_list_is_fetched_again_once_stale(server, monkeypatch):
+    models = ModelRegistry()
+    models.refresh()
+    monkeypatch.setattr(settings.connection, "models_ttl", -1.0)
+    assert models.is_stale
+    assert models.is_reachable()
+    assert len(server.requests) == 2
+
+
+def test_failed_requests_invalidate_the_list(server):
+    models = ModelRegistry()
+    breaker = CircuitBreaker()
+    breaker.on_failure(models.invalidate)
+    models.refresh()
+    assert not models.is_stale
+    breaker.record_failure()
+    assert models.is_stale
+    server.reachable = False
+    assert not models.is_reachable()
+
+
+def test_concurrent_refreshes_share_a_request(server):
+    models = ModelRegistry()
+    server.gate = threading.Event()
+    threads = [threading.Thread(target=models.refresh) for _ in range(4)]
+    threads[0].start()
+    while not server.requests:
+        time.sleep(0.01)
+    # the others find the request in flight and wait for it
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    server.gate.set()
+    for thread in threads:
+        thread.join()
+    assert server.requests == ["ollama_list_models"]
+    assert models.is_available("hermes3:latest")
+
+
+def test_missing_models_are_pulled_once(server, monkeypatch):
+    monkeypatch.setattr(settings.karma, "model_name", "hermes3:latest")
+    monkeypatch.setattr(settings.neuralcheck, "model_name", "qwen2.5:32b")
+    monkeypatch.setattr(settings.neuralsys, "model_name", "qwen2.5:32b")
+    models = ModelRegistry()
+    notes = []
+    models.ensure_game_models(notify=lambda **kwargs: notes.append(kwargs))
+    assert server.requests == ["ollama_list_models", "ollama_init_model"]
+    assert models.is_available("qwen2.5:32b")
+    assert len(notes) == 2
+    models.ensure_game_models()
+    assert len(server.requests) == 2
@@ -0,0 +1,168 @@
+import asyncio
+import os
+from typing import Any, Dict, List
+
+import pytest
+
+from llm import cache, neuralsys
+from llm.cache import ResponseCache, acached_send_to_server, cached_send_to_server
+from llm.neuralsys import NeuralSys, NeuralSysError
+from settings import LLMSetting, settings
+
+SETTING = LLMSetting(temperature=0.0, cache_responses=True)
+DATA = {"model_name": "m", "messages": [{"role": "user", "content": "hi"}]}
+
+
+class Notifier:
+    def notify(self, *args, **kwargs) -> None:
+        pass
+
+
+@pytest.fixture
+def response_cache(monkeypatch) -> ResponseCache:
+    response_cache = ResponseCache()
+    monkeypatch.setattr(cache, "response_cache", response_cache)
+    return response_cache
+
+
+class FakeServer:
+    def __init__(self) -> None:
+        self.replies: List[Dict[str, Any]] = []
+        self.requests: List[Dict[str, Any]] = []
+
+    def send(self, data, endpoint):
+        self.requests.append(data)
+        return self.replies.pop(0) if self.replies else reply("")
+
+    async def asend(self, data, endpoint):
+        return self.send(data, endpoint)
+
+
+@pytest.fixture
+def server(monkeypatch) -> FakeServer:
+    server = FakeServer()
+    monkeypatch.setattr(cache, "send_to_server", server.send)
+    monkeypatch.setattr(cache, "asend_to_server", server.asend)
+    return server
+
+
+def reply(content: str) -> Dict[str, Any]:
+    return {"message": {"role": "assistant", "content": content}}
+
+
+def test_answers_are_cached(response_cache, server):
+    server.replies.append(reply("OK"))
+    assert cached_send_to_server(DATA, "ollama_generate", SETTING) == reply("OK")
+    assert cached_send_to_server(DATA, "ollama_generate", SETTING) == reply("OK")
+    assert len(server.requests) == 1
+    assert response_cache.stats == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_replies_are_copies(response_cache, server):
+    server.replies.append(reply("OK"))
+    cached_send_to_server(DATA, "ollama_generate", SETTING)["message"]["content"] = ""
+    assert cached_send_to_server(DATA, "ollama_generate", SETTING) == reply("OK")
+
+
+def test_entries_survive_a_restart(response_cache, server, monkeypatch):
+    server.replies.append(reply("OK"))
+    cached_send_to_server(DATA, "ollama_generate", SETTING)
+    monkeypatch.setattr(cache, "response_cache", ResponseCache())
+    assert cached_send_to_server(DATA, "ollama_generate", SETTING) == reply("OK")
+    assert len(server.requests) == 1
+
+
+def test_random_roles_are_not_cached(response_cache, server):
+    server.replies.extend([reply("a"), reply("b")])
+    setting = LLMSetting(temperature=0.5, cache_responses=True)
+    assert cached_send_to_server(DATA, "ollama_generate", setting) == reply("a")
+    assert cached_send_to_server(DATA, "ollama_generate", setting) == reply("b")
+
+
+def test_empty_replies_are_not_cached(response_cache, server):
+    server.replies.extend([reply(""), reply("OK")])
+    assert cached_send_to_server(DATA, "ollama_generate", SETTING) == reply("")
+    assert cached_send_to_server(DATA, "ollama_generate", SETTING) == reply("OK")
+    assert response_cache.stats["entries"] == 1
+
+
+def test_empty_entries_on_disk_are_ignored(response_cache, server):
+    # e.g. written by an older version of the game
+    response_cache.put(ResponseCache.key(DATA), reply(""))
+    server.replies.append(reply("OK"))
+    assert cached_send_to_server(DATA, "ollama_generate", SETTING) == reply("OK")
+
+
+def test_tool_calls_are_cached(response_cache, server):
+    tool_call = {"function": {"name": "f", "arguments": {}}}
+    server.replies.append({"message": {"content": "", "tool_calls": [tool_call]}})
+    cached_send_to_server(DATA, "ollama_generate", SETTING)
+    cached_send_to_server(DATA, "ollama_generate", SETTING)
+    assert len(server.requests) == 1
+
+
+def test_async_requests_share_the_cache(response_cache, server):
+    server.replies.extend([reply(""), reply("OK")])
+
+    async def ask():
+        return await acached_send_to_server(DATA, "ollama_generate", SETTING)
+
+    assert asyncio.run(ask()) == reply("")
+    assert asyncio.run(ask()) == reply("OK")
+    assert cached_send_to_server(DATA, "ollama_generate", SETTING) == reply("OK")
+    assert len(server.requests) == 2
+
+
+def test_disk_is_kept_under_its_limit(response_cache, monkeypatch):
+    monkeypatch.setattr(settings.cache, "max_disk_bytes", 300)
+    for i in range(10):
+        response_cache.put(f"key{i}", reply("x" * 50))
+    files = [f for f in os.listdir(settings.cache.cache_dir) if f.endswith(".json")]
+    assert 0 < len(files) < 10
+    assert (
+        sum(os.path.getsize(os.path.join(settings.cache.cache_dir, f)) for f in files)
+        <= 300
+    )
+
+
+def test_apply_gives_up_on_empty_replies(level, monkeypatch):
+    # an empty reply is asked again, which must not loop forever
+    monkeypatch.setattr(settings.neuralsys, "cache_responses", True)
+    monkeypatch.setattr(cache, "response_cache", ResponseCache())
+    requests = []
+
+    def send(**kwargs):
+        requests.append(kwargs)
+        return reply("")
+
+    async def asend(**kwargs):
+        return send(**kwargs)
+
+    monkeypatch.setattr(neuralsys, "cached_send_to_server", send)
+    monkeypatch.setattr(neuralsys, "acached_send_to_server", asend)
+    ns = NeuralSys(parent=Notifier())
+    with pytest.raises(NeuralSysError):
+        ns._apply(level=level, constraints="")
+    assert len(requests) == NeuralSys.max_apply_passes
+    with pytest.raises(NeuralSysError):
+        asyncio.run(ns._aapply(level=level, constraints=""))
+
+
+def test_least_recently_used_entries_leave_memory(response_cache, monkeypatch):
+    monkeypatch.setattr(settings.cache, "max_entries", 2)
+    for key in ("a", "b", "c"):
+        response_cache.put(key, reply(key))
+    # "a" was evicted from memory, but is still on disk
+    assert list(response_cache._memory) == ["b", "c"]
+    assert response_cache.get("b") == reply("b")
+    assert response_cache.get("a") == reply("a")
+    assert list(response_cache._memory) == ["b", "a"]
+
+
+def test_keys_depend_on_the_request():
+    key = ResponseCache.key(DATA)
+    assert ResponseCache.key(dict(DATA)) == key
+    assert ResponseCache.key({**DATA, "options": {"temperature": 0.0}}) != key
+    assert ResponseCache.key({**DATA, "model_name": "other"}) != key
+    # only the fields that change the reply are part of the key
+    assert ResponseCache.key({**DATA, "username": "someone"}) == key
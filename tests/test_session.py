@@ -0,0 +1,168 @@
+import json
+import os
+
+from base_objects.vfs import File, LogFile
+from llm.context import ConversationContext
+from session import SessionLog
+from settings import settings
+
+
+def records(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def start(level) -> SessionLog:
+    log = SessionLog(SessionLog.path_for("level01"))
+    log.start(level)
+    return log
+
+
+def empty_context():
+    return {"entries": [], "summary": []}
+
+
+def loaded_files(level):
+    return sorted(
+        level.fs.path(item)
+        for item in level.fs.index.items()
+        if isinstance(item, File) and not isinstance(item, LogFile) and item.is_loaded
+    )
+
+
+def test_round_trip(level):
+    log = start(level)
+    context = ConversationContext("system", settings.karma)
+    context.add("hello", role="user")
+    context.set_slot("fs", "files")
+    level.credentials["guest"] = "changed"
+    level.fs.current_user = "j.davies"
+    level.fs.mark_read("journal.md")
+    level.fs.get("welcome.txt").read = ["guest"]
+    level.fs.get("todo.txt").contents = "nothing left"
+    level.add_login_msg("j.davies")
+    log.save(level, context.state(), transcript="> hello\n", game={"retries": 1})
+    level.add_login_msg("guest")
+    log.save(level, context.state(), transcript="> hello\nhi\n", game={"retries": 2})
+
+    saved = SessionLog.load(log.path)
+    assert saved.level.credentials == level.credentials
+    assert saved.level.fs.current_user == "j.davies"
+    assert saved.level.fs.has_read("journal.md")
+    assert saved.level.fs.get("welcome.txt").read == ("guest",)
+    assert saved.level.fs.get("todo.txt").contents == "nothing left"
+    assert isinstance(saved.level.fs.get("auth.log"), LogFile)
+    assert saved.level.fs.to_karma_format == level.fs.to_karma_format
+    assert saved.context == context.state()
+    assert saved.transcript == "> hello\nhi\n"
+    assert saved.game == {"retries": 2}
+
+
+def test_start_does_not_read_the_files(level):
+    loaded = loaded_files(level)
+    log = start(level)
+    assert loaded_files(level) == loaded
+    # permission changes do not read the files either
+    level.fs.get("notebook.md").read = ["admin"]
+    log.save(level, empty_context(), transcript="", game={})
+    assert loaded_files(level) == loaded
+
+    saved = SessionLog.load(log.path)
+    assert loaded_files(saved.level) == loaded
+    assert saved.level.fs.get("notebook.md").read == ("admin",)
+    assert saved.level.fs.get("notebook.md").contents == (
+        level.fs.get("notebook.md").contents
+    )
+
+
+def test_unchanged_save_writes_nothing(level):
+    log = start(level)
+    log.save(level, empty_context(), transcript="", game={})
+    assert len(records(log.path)) == 1
+
+
+def test_log_file_saves_only_new_entries(level):
+    log = start(level)
+    for i in range(5):
+        level.add_log_msg(f"entry {i}")
+        log.save(level, empty_context(), transcript="", game={})
+    turns = records(log.path)[1:]
+    assert len(turns) == 5
+    for i, turn in enumerate(turns):
+        fields = turn["items"]["var/log/auth.log"]
+        assert "contents" not in fields
+        assert fields["append"].endswith(f"entry {i}")
+    saved = SessionLog.load(log.path)
+    assert saved.level.fs.get("auth.log").contents == level.fs.get("auth.log").contents
+
+
+def test_replaced_log_file_is_saved_whole(level):
+    log = start(level)
+    level.add_log_msg("entry")
+    log.save(level, empty_context(), transcript="", game={})
+    level.fs.get("auth.log").contents = "wiped"
+    log.save(level, empty_context(), transcript="", game={})
+    level.add_log_msg("after")
+    log.save(level, empty_context(), transcript="", game={})
+    fields = records(log.path)[2]["items"]["var/log/auth.log"]
+    assert fields["contents"] == "wiped"
+    saved = SessionLog.load(log.path)
+    assert saved.level.fs.get("auth.log").contents.startswith("wiped\n")
+    assert saved.level.fs.get("auth.log").contents.endswith(" after")
+
+
+def test_context_saves_only_new_entries(level, monkeypatch):
+    monkeypatch.setattr(settings.karma, "context_budget", 100)
+    log = start(level)
+    context = ConversationContext("system", settings.karma)
+    for i in range(20):
+        context.add(f"message {i} " * 5, role="user")
+        context.set_slot("fs", f"files {i}")
+        log.save(level, context.state(), transcript="", game={})
+    for turn in records(log.path)[1:]:
+        # this turn's message and file system, not the whole conversation
+        assert len(turn["context"]["new"]) == 2
+    saved = SessionLog.load(log.path)
+    assert saved.context == context.state()
+    assert len(saved.context["entries"]) < 20
+    assert saved.context["summary"]
+
+
+def test_resumed_session_keeps_appending(level):
+    log = start(level)
+    context = ConversationContext("system", settings.karma)
+    context.add("a", role="user")
+    level.add_log_msg("before")
+    log.save(level, context.state(), transcript="a", game={})
+
+    saved = SessionLog.load(log.path)
+    resumed_context = ConversationContext("system", settings.karma)
+    resumed_context.restore(saved.context)
+    assert resumed_context.messages == context.messages
+    resumed_context.add("b", role="user")
+    saved.level.add_log_msg("after")
+    saved.log.save(saved.level, resumed_context.state(), "ab", game={})
+    new_entries = records(log.path)[-1]["context"]["new"]
+    assert [entry["content"] for entry in new_entries] == ["b"]
+
+    resumed = SessionLog.load(log.path)
+    assert resumed.level.fs.get("auth.log").contents == (
+        saved.level.fs.get("auth.log").contents
+    )
+    assert resumed.context == resumed_context.state()
+    assert resumed.transcript == "ab"
+
+
+def test_new_items_save_the_tree(level):
+    log = start(level)
+    guest_dir = level.fs.get("home/guest")
+    guest_dir.add(File(name="new.txt", contents="new"))
+    log.save(level, empty_context(), transcript="", game={})
+    assert "base_dir" in records(log.path)[-1]
+    saved = SessionLog.load(log.path)
+    assert saved.level.fs.get("home/guest/new.txt").contents == "new"
+    assert not saved.level.fs.get("notebook.md").is_loaded
+
+
+def test_path_for():
+    assert os.path.basename(SessionLog.path_for("level01")) == "level01.jsonl"
@@ -0,0 +1,88 @@
+import pytest
+
+import simulation
+from devtools.simulate import playthrough_traces
+from devtools.stub_server import StubConfig, StubServer
+from settings import settings
+from simulation import Simulation, SimulationError, run_trace, run_traces
+
+
+@pytest.fixture
+def sim(level, monkeypatch) -> Simulation:
+    # no models are needed until KARMA or NeuralSys are asked something
+    monkeypatch.setattr(
+        simulation.model_registry, "ensure_game_models", lambda notify: None
+    )
+    return Simulation(level=level)
+
+
+def test_files_in_locked_directories_are_not_found(sim):
+    sim.act("read", "home/guest/welcome.txt")
+    sim.level.fs.get("home/guest").read = ["admin"]
+    with pytest.raises(SimulationError, match="not found"):
+        sim.act("read", "home/guest/welcome.txt")
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = StubServer(StubConfig(seed=0)).start()
+    monkeypatch.setattr(settings, "server_url", server.url)
+    yield server
+    server.stop()
+
+
+def test_refused_actions_change_nothing(sim):
+    with pytest.raises(SimulationError, match="Invalid password"):
+        sim.act("login", "admin", "wrong")
+    with pytest.raises(SimulationError, match="Unknown action"):
+        sim.act("fly")
+    with pytest.raises(SimulationError, match="cannot be edited"):
+        sim.act("edit", "home/guest/welcome.txt", "mine now")
+    assert sim.level.fs.current_user == "guest"
+    # unknown actions are not played at all
+    assert sim.n_actions == 2
+
+
+def test_goals_are_achieved_in_order(sim):
+    # the second goal holds first, but only counts once the first one does
+    sim.act("login", "admin", sim.level.credentials["admin"])
+    assert sim.goal_idx == 0
+    sim.act("read", "home/guest/notes/todo.txt")
+    sim.act("read", "var/log/auth.log")
+    assert [entry["goal"] for entry in sim.timeline] == [
+        "Inspect the filesystem",
+        "Log in as Admin",
+    ]
+    assert [entry["action"] for entry in sim.timeline] == [3, 3]
+    assert not sim.game_over
+
+
+def test_trace_is_played_to_the_end(server):
+    trace = playthrough_traces()[0]
+    result = run_trace(trace)
+    assert result["outcome"] == "completed"
+    assert result["goals"] == result["total_goals"] == 3
+    assert [goal["goal"] for goal in result["timeline"]] == [
+        "Inspect the filesystem",
+        "Log in as Admin",
+        "Find proof of criminal activity",
+    ]
+    assert len(result["actions"]) <= len(trace["actions"])
+    # without narration, KARMA is only asked by `chat`
+    chats = sum(1 for action in trace["actions"] if action[0] == "chat")
+    assert server.stats.get("ollama_generate_stream", 0) <= chats
+
+
+def test_broken_trace_is_reported(server):
+    result = run_trace({"id": 7, "level": "level99.json", "actions": []})
+    assert result["outcome"] == "error"
+    assert result["id"] == 7
+
+
+def test_traces_are_played_in_processes(server):
+    traces = playthrough_traces()
+    results = list(run_traces(traces, processes=2))
+    assert sorted(result["id"] for result in results) == sorted(
+        trace["id"] for trace in traces
+    )
+    assert all(result["outcome"] == "completed" for result in results)
@@ -0,0 +1,54 @@
+import itertools
+import os
+
+import pytest
+
+from settings import settings
+from templates import Template, TemplateError, compile_template, load_template
+
+
+def test_render():
+    template = Template("$user$ has $count$ files, $user$.")
+    assert template.variables == {"user", "count"}
+    assert template.render(user="guest", count="3") == "guest has 3 files, guest."
+
+
+def test_missing_values():
+    template = Template("($user$) $RAND$")
+    with pytest.raises(TemplateError, match="RAND"):
+        template.render(user="guest")
+    assert template.render(strict=False, user="guest") == "(guest) $RAND$"
+
+
+def test_callables_are_called_per_placeholder():
+    counter = itertools.count()
+    rendered = Template("$N$-$N$-$N$").render(N=lambda: str(next(counter)))
+    assert rendered == "0-1-2"
+
+
+def test_values_are_not_rendered_again():
+    assert Template("$a$ $b$").render(a="$b$", b="x") == "$b$ x"
+
+
+def test_text_without_placeholders():
+    for source in ("", "no placeholders", "a $ sign", "$not a name$"):
+        assert Template(source).render() == source
+
+
+def test_templates_are_compiled_once():
+    assert compile_template("$a$") is compile_template("$a$")
+    assert load_template("karma_prompt") is load_template("karma_prompt")
+
+
+@pytest.mark.parametrize(
+    "name", ["karma_prompt", "neuralsys_prompt", "neuralcheck_prompt"]
+)
+def test_asset_templates_render_like_replace(name):
+    with open(os.path.join(settings.assets_dir, name), "r") as f:
+        source = f.read()
+    template = load_template(name)
+    values = {variable: f"<{variable.lower()}>" for variable in template.variables}
+    expected = source
+    for variable, value in values.items():
+        expected = expected.replace(f"${variable}$", value)
+    assert template.render(**values) == expected
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from base_objects.level import Level
+from base_objects.tokenizer import Tokenizer, TokenizerError, file_signature
+from settings import settings
+
+
+@pytest.fixture
+def level02() -> Level:
+    level = Level.from_file(os.path.join(settings.assets_dir, "level02.json"))
+    level.initialize()
+    return level
+
+
+def decode(level: Level, tokenizer: Tokenizer, prompt: str) -> str:
+    return tokenizer.decode(
+        prompt=prompt,
+        token_map=level.fs.get("token_map_dl.bin").contents,
+        fs=level.fs,
+    )
+
+
+def test_file_signature():
+    assert file_signature("news_on_nexadyn.txt") == "4_2_7"
+    assert file_signature("irc_dump.txt") == "3_4"
+
+
+def test_decode(level02):
+    tokenizer = Tokenizer()
+    assert decode(level02, tokenizer, "0xD4E 0x5D7 0xB2C 0xF6E") == (
+        Tokenizer.template.format(file_name="news_on_nexadyn.txt")
+    )
+    # tokens are not case sensitive
+    assert decode(level02, tokenizer, "0xc8f 0xe19 0x5d7") == (
+        Tokenizer.template.format(file_name="irc_dump.txt")
+    )
+
+
+@pytest.mark.parametrize(
+    "prompt",
+    [
+        "0x",  # only part of a token
+        "0xD4E 0x5D7",  # fewer tokens than the first one asks for
+        "0xC8F 0xC8F 0xC8F",  # no file has this signature
+    ],
+)
+def test_decode_errors(level02, prompt):
+    with pytest.raises(TokenizerError):
+        decode(level02, Tokenizer(), prompt)
+
+
+def test_renamed_files_are_decoded_again(level02):
+    tokenizer = Tokenizer()
+    prompt = "0xC8F 0xE19 0x5D7"
+    decode(level02, tokenizer, prompt)
+    level02.fs.get("irc_dump.txt").name = "irc_logs.txt"
+    assert decode(level02, tokenizer, prompt) == (
+        Tokenizer.template.format(file_name="irc_logs.txt")
+    )
+
+
+def test_tokenizer_mode_follows_the_security_setting(level02):
+    # the level's security file is named after its setting, not marked in it
+    assert not level02.uses_tokenizer
+    level02.security_cfg = "[TOKENIZER] " + level02.security_cfg
+    assert level02.uses_tokenizer
+    level02.fs.get(level02.sysprompt).contents = "0xC8F 0xE19 0x5D7"
+    assert level02.neuralsys_prompt_snippet == (
+        Tokenizer.template.format(file_name="irc_dump.txt")
+    )
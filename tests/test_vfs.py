@@ -0,0 +1,217 @@
+import pytest
+
+from base_objects.vfs import Directory, File, LogFile, VirtualFileSystem
+
+
+@pytest.fixture
+def fs() -> VirtualFileSystem:
+    return VirtualFileSystem(
+        base_dir=Directory(
+            name="root",
+            read=["guest", "admin"],
+            contents=[
+                Directory(
+                    name="home",
+                    read=["guest", "admin"],
+                    contents=[
+                        File(name="todo.txt", read=["guest"], contents="buy milk"),
+                        File(name="secret.txt", read=["admin"], contents="hunter2"),
+                    ],
+                ),
+                File(name="auth.log", read=["admin"], contents="start"),
+            ],
+        ),
+        current_user="guest",
+    )
+
+
+def test_lookup_by_name_and_path(fs):
+    todo = fs.get("todo.txt")
+    assert todo.contents == "buy milk"
+    assert fs.get("home/todo.txt") is todo
+    assert fs.get("/root/home/todo.txt") is todo
+    assert fs.path(todo) == "home/todo.txt"
+    assert fs.get("missing.txt") is None
+
+
+def test_rename_rebuilds_index(fs):
+    todo = fs.get("todo.txt")
+    generation = fs.generation
+    todo.name = "done.txt"
+    assert fs.get("todo.txt") is None
+    assert fs.get("home/done.txt") is todo
+    assert fs.generation != generation
+
+
+def test_added_item_is_indexed(fs):
+    home = fs.get("home")
+    home.add(File(name="new.txt", read=["guest"], contents="new"))
+    assert fs.get("home/new.txt").contents == "new"
+    assert [f.name for f in fs.get_all()] == [
+        "todo.txt",
+        "secret.txt",
+        "new.txt",
+        "auth.log",
+    ]
+
+
+def test_names_are_found_depth_first(fs):
+    fs.get("home").add(Directory(name="old", contents=[File(name="auth.log")]))
+    deep, shallow = fs.find("auth.log")
+    assert fs.path(deep) == "home/old/auth.log"
+    assert fs.path(shallow) == "auth.log"
+    assert fs.get("auth.log") is deep
+
+
+def test_lookup_relative_to_a_directory(fs):
+    home = fs.get("home")
+    assert fs.get("todo.txt", directory=home) is fs.get("home/todo.txt")
+    assert fs.get("secret.txt", directory=home).contents == "hunter2"
+    assert fs.get("auth.log", directory=home) is None
+
+
+def test_replaced_item_is_indexed(fs):
+    home = fs.get("home")
+    old = fs.get("todo.txt")
+    new = File(name="todo.txt", contents="replaced")
+    home.replace(old, new)
+    assert fs.get("home/todo.txt") is new
+    assert fs.path(old) is None
+
+
+def test_path_of_the_root(fs):
+    assert fs.path(fs.base_dir) == ""
+
+
+def test_masks_follow_permissions(fs):
+    secret = fs.get("secret.txt")
+    assert secret.can_read("admin")
+    assert not secret.can_read("guest")
+    secret.read = ["guest"]
+    assert secret.can_read("guest")
+    assert not secret.can_read("admin")
+    assert not secret.can_read("nobody")
+
+
+def test_permissions_are_immutable(fs):
+    todo = fs.get("todo.txt")
+    todo.read = ["guest", "admin"]
+    assert todo.read == ("guest", "admin")
+    with pytest.raises(AttributeError):
+        todo.read.append("intruder")
+    with pytest.raises(AttributeError):
+        fs.get("home").contents.append(File(name="x"))
+
+
+def test_items_share_their_permissions(fs):
+    fs.get("todo.txt")
+    assert fs.get("home").read is fs.base_dir.read
+    fs.get("secret.txt").read = ["guest"]
+    assert fs.get("secret.txt").read is fs.get("todo.txt").read
+
+
+def test_visibility_follows_the_directories(fs):
+    todo = fs.get("todo.txt")
+    assert fs.is_visible(todo, "guest")
+    assert fs.is_visible(fs.base_dir, "nobody")
+    fs.get("home").read = ["admin"]
+    assert not fs.is_visible(todo, "guest")
+    assert fs.is_visible(todo, "admin")
+    assert fs.is_visible(fs.get("home"), "guest")
+    fs.base_dir.read = ["guest"]
+    assert not fs.is_visible(todo, "admin")
+    assert not fs.is_visible(fs.get("auth.log"), "admin")
+
+
+def test_fragments_follow_changes(fs):
+    before = fs.to_karma_format
+    context = fs.index.context
+    assert "home/todo.txt" in context.fragments
+    fs.get("todo.txt").contents = "buy bread"
+    # the item and all its ancestors are serialized again
+    assert "home/todo.txt" not in context.fragments
+    assert "home" not in context.fragments
+    assert "" not in context.fragments
+    after = fs.to_karma_format
+    assert "buy bread" in after and "buy bread" not in before
+    assert "secret.txt" not in context.pop_changed()
+
+
+def test_fragments_depend_on_the_user(fs):
+    # a directory only lists its contents to the users who can read it
+    fs.get("home").read = ["admin"]
+    as_guest = fs.to_karma_format
+    fs.current_user = "admin"
+    as_admin = fs.to_karma_format
+    assert "hunter2" not in as_guest
+    assert "hunter2" in as_admin
+
+
+def test_fragments_match_a_fresh_serialization(fs):
+    fs.to_karma_format
+    fs.get("secret.txt").read = ["guest"]
+    fs.get("home").add(File(name="new.txt", read=["guest"], contents="new"))
+    fs.get("todo.txt").name = "done.txt"
+    fresh = VirtualFileSystem.model_validate(fs.model_dump())
+    assert fs.to_karma_format == fresh.to_karma_format
+
+
+def test_log_file_appends(fs):
+    log = fs.to_log_file("auth.log")
+    assert isinstance(log, LogFile)
+    assert fs.get("auth.log") is log
+    fs.index.context.pop_changed()
+    log.append("\none")
+    log.append("\ntwo")
+    assert log.contents == "start\none\ntwo"
+    assert log.tail(2) == "one\ntwo"
+    assert fs.index.context.pop_changed() == {"auth.log"}
+
+
+def test_lazy_log_file_appends_after_its_contents(fs):
+    log = fs.to_log_file("auth.log")
+    log.load_lazily(lambda: "loaded\nfirst")
+    log.append("\nsecond")
+    # the appended entries alone are too short for the tail
+    assert log.tail(2) == "first\nsecond"
+    assert log.contents == "loaded\nfirst\nsecond"
+    log.contents = "wiped"
+    log.append("\nagain")
+    assert log.contents == "wiped\nagain"
+
+
+def test_level_log_is_a_log_file(level):
+    log = level.fs.get("auth.log")
+    assert isinstance(log, LogFile)
+    level.add_login_msg("guest")
+    assert log.tail(1).endswith("Successful login (User: guest)")
+
+
+def test_lazy_contents_are_loaded_once():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return "loaded"
+
+    item = File(name="lazy.txt")
+    item.load_lazily(loader)
+    assert not item.is_loaded
+    assert item.contents == "loaded"
+    assert item.contents == "loaded"
+    assert item.is_loaded and len(calls) == 1
+    # assigned contents replace a loader that was not called yet
+    item.load_lazily(loader)
+    item.contents = "assigned"
+    assert item.contents == "assigned" and len(calls) == 1
+
+
+def test_level_files_are_read_when_needed(level):
+    files = [item for item in level.fs.index.items() if isinstance(item, File)]
+    loaded = [item for item in files if item.is_loaded]
+    assert len(loaded) < len(files) // 2
+    journal = level.fs.get("journal.md")
+    assert not journal.is_loaded
+    # timestamps are filled in when the file is read
+    assert "$TIME" not in journal.contents
+    assert journal.is_loaded
@@ -1,8 +1,11 @@
-import threading
+import asyncio
+from contextlib import aclosing
 
 from base_objects.level import Level
 from llm.karma import Karma
+from requests import ConnectionError
 from settings import settings
+from templates import Template, compile_template
 from textual.containers import ScrollableContainer
 from textual.screen import Screen
 from textual.widget import Widget
@@ -10,22 +13,27 @@ from textual.widgets import Input, Static
 
 
 class ChatWidget(Widget):
-    def __init__(self, game_screen: Screen, level: Level, karma: Karma):
+    def __init__(
+        self, game_screen: Screen, level: Level, karma: Karma, transcript: str = ""
+    ):
         super().__init__()
         self.level = level
         self.game_screen = game_screen
         self.karma = karma
-        self._title = "Chat History$UNREAD$"
+        self._title = Template("Chat History$UNREAD$")
         self._unread = 0
+        # replies are streamed one at a time so they do not interleave
+        self._chat_lock = asyncio.Lock()
 
         self.title = Static(
-            self._title.replace("$UNREAD$", self._unread_str()),
+            self._title.render(UNREAD=self._unread_str()),
             classes="horizontal-centered",
             id="chat_title",
         )
-        self.history = ScrollableContainer(
-            Static("", markup=True, expand=True, id="chat_history")
+        self._history_text = Static(
+            transcript, markup=True, expand=True, id="chat_history"
         )
+        self.history = ScrollableContainer(self._history_text)
         self.input = Input(placeholder="Type a message...", id="chat_input")
 
         self.watch(
@@ -50,6 +58,11 @@ class ChatWidget(Widget):
     def _unread_str(self) -> str:
         return "" if self._unread == 0 else f" [r]({self._unread})[/r]"
 
+    @property
+    def transcript(self) -> str:
+        # also read once the screen is unmounted, to save the session
+        return str(self._history_text.renderable)
+
     def compose(self):
         yield self.title
         yield self.history
@@ -58,43 +71,54 @@ class ChatWidget(Widget):
     def update_title(self):
         self._unread = 0
         title_static = self.query_one("#chat_title", Static)
-        title_static.update(self._title.replace("$UNREAD$", self._unread_str()))
+        title_static.update(self._title.render(UNREAD=self._unread_str()))
 
     def on_input_submitted(self, event: Input.Submitted) -> None:
         if event.value:
-            prefix = settings.chat.player_prefix.replace(
-                "$USER$", self.level.fs.current_user
+            prefix = compile_template(settings.chat.player_prefix).render(
+                strict=False, USER=self.level.fs.current_user
             )
             self.append_chat(f"{prefix}{event.value}\n")
             self.stream_chat(event.value)
             event.input.clear()
 
     def stream_chat(self, message: str) -> None:
-        input_widget = self.query_exactly_one("#chat_input", Input)
-        was_focused = input_widget.has_focus
-        input_widget.disabled = True
-
-        self.karma.add_message(msg=message, role="user")
-
-        def fetch_response():
-            response_stream = self.karma.chat()  # Generator
-            full_response = ""
-            self.app.call_from_thread(self.append_chat, settings.chat.karma_prefix)
+        self.run_worker(self._stream_chat(message), group="llm", exit_on_error=False)
 
-            for token in response_stream:
-                full_response += token
-                self.app.call_from_thread(self.append_chat, token)  # Stream tokens
-            self.append_chat("\n")  # LLM messages do not have a \n at the end
-
-            input_widget.disabled = False
-            if was_focused:
-                input_widget.focus()
-            if not was_focused:
-                self._unread += 1
-                title_static = self.query_exactly_one("#chat_title", Static)
-                title_static.update(self._title.replace("$UNREAD$", self._unread_str()))
-
-        threading.Thread(target=fetch_response, daemon=True).start()
+    async def _stream_chat(self, message: str) -> None:
+        input_widget = self.query_exactly_one("#chat_input", Input)
+        async with self._chat_lock:
+            was_focused = input_widget.has_focus
+            input_widget.disabled = True
+            self.karma.add_message(msg=message, role="user")
+            cancelled = False
+            try:
+                self.append_chat(settings.chat.karma_prefix)
+                async with aclosing(self.karma.achat_stream()) as response_stream:
+                    async for token in response_stream:
+                        self.append_chat(token)
+            except ConnectionError as e:
+                self.notify(f"Lost connection to KARMA: {e}", severity="error")
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            except Exception as e:
+                self.notify(f"KARMA could not reply: {e}", severity="error")
+            finally:
+                # a cancelled worker skips this, as the widgets are being torn down
+                if not cancelled:
+                    self._end_reply(input_widget, was_focused)
+
+    def _end_reply(self, input_widget: Input, was_focused: bool) -> None:
+        self.append_chat("\n")  # LLM messages do not have a \n at the end
+        input_widget.disabled = False
+        if was_focused:
+            input_widget.focus()
+        else:
+            self._unread += 1
+            title_static = self.query_exactly_one("#chat_title", Static)
+            title_static.update(self._title.render(UNREAD=self._unread_str()))
+        self.game_screen.autosave()
 
     def append_chat(self, text: str) -> None:
         chat_history = self.query_one("#chat_history", Static)
@@ -22,16 +22,18 @@ class ExplorerWidget(DirectoryTree):
         self._writable = "🖊"
 
     def populate_tree(self, parent_node: Tree, directory: Directory) -> None:
+        user_bit = self.vfs.user_bit(self.vfs.current_user)
         for content in directory.contents:
             name = content.name
-            if self.vfs.current_user not in content.read:
+            readable = content.read_mask & user_bit
+            if not readable:
                 name = f"{self._locked} {name}"
             if isinstance(content, Directory):
                 node = parent_node.add(label=name, expand=True)
-                if self.vfs.current_user in content.read:
+                if readable:
                     self.populate_tree(node, content)
             elif isinstance(content, File):
-                if self.vfs.current_user in content.write:
+                if content.write_mask & user_bit:
                     name = f"{name} {self._writable}"
                 node = parent_node.add_leaf(label=name)
             else:
@@ -40,34 +42,29 @@ class ExplorerWidget(DirectoryTree):
     def on_mount(self):
         self.populate_tree(parent_node=self.root, directory=self.vfs.base_dir)
 
-    def _get_parent_directory(self, node: Tree) -> Directory:
-        path = []
-        while node.parent.label.plain != self.vfs.base_dir.name:
-            path.append(node.parent.label.plain)
-            node = node.parent
-        parent_dir = self.vfs.base_dir
-        for path_dir in reversed(path):
-            parent_dir = self.vfs.get(path_dir, directory=parent_dir)
-        return parent_dir
+    def _label_to_name(self, node: Tree) -> str:
+        label = node.label.plain
+        return label.replace(self._locked, "").replace(self._writable, "").strip()
 
     def _fs_obj_from_node(self, node: Tree) -> Union[Directory, File]:
-        label = node.label.plain
-        fname = label.replace(self._locked, "").replace(self._writable, "").strip()
-        parent_dir = self._get_parent_directory(node=node)
-        return self.vfs.get(fname, directory=parent_dir)
+        path = []
+        while node is not self.root:
+            path.append(self._label_to_name(node))
+            node = node.parent
+        return self.vfs.get("/" + "/".join(reversed(path)))
 
     def on_tree_node_selected(self, event) -> None:
         doc = self._fs_obj_from_node(node=event.node)
         if isinstance(doc, File):
-            if self.vfs.current_user in doc.write:
-                self.vfs.read_files.append(doc.name)
+            if doc.can_write(self.vfs.current_user):
+                self.vfs.mark_read(doc.name)
                 self.game_screen.post_message(FileSystemUpdated(self))
                 self.app.push_screen(
                     EditorScreen(doc, bak=self.vfs.get(doc.name.split(".")[0] + ".bak"))
                 )
-            elif self.vfs.current_user in doc.read:
+            elif doc.can_read(self.vfs.current_user):
                 if not doc.is_command:
-                    self.vfs.read_files.append(doc.name)
+                    self.vfs.mark_read(doc.name)
                     self.game_screen.post_message(FileSystemUpdated(self))
                     self.app.push_screen(ViewerScreen(doc))
                 else:
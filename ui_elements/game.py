@@ -1,19 +1,24 @@
+import logging
 import os
 import re
-import threading
+from typing import Optional
 
 from base_objects.level import Level, TokenizerError
 from base_objects.vfs import File
-from events import FileSystemUpdated
+from events import FileSystemUpdated, GoalAchieved
 from llm.karma import Karma
-from llm.neuralsys import NeuralSys
+from llm.neuralsys import NeuralSys, NeuralSysError
+from requests import ConnectionError
+from session import SavedSession, SessionLog
 from settings import settings
+from templates import Template, load_template
 
 from textual.app import ComposeResult
 from textual.binding import Binding
 from textual.containers import Center, Horizontal, ScrollableContainer, Vertical
 from textual.screen import Screen
 from textual.widgets import Button, Footer, Header, Static
+from textual.worker import Worker
 from ui_elements.chat import ChatWidget
 from ui_elements.explorer import ExplorerWidget
 from ui_elements.goals import GoalsDisplay
@@ -21,6 +26,9 @@ from ui_elements.login import LoginScreen
 from ui_elements.quit import QuitScreen
 
 
+logger = logging.getLogger("prompt_override")
+
+
 class GameScreen(Screen):
     BINDINGS = [
         Binding(
@@ -53,7 +61,7 @@ class GameScreen(Screen):
         ),
     ]
 
-    def __init__(self, level: Level):
+    def __init__(self, level: Level, saved: Optional[SavedSession] = None):
         super().__init__()
         self.level = level
         self.title = f"Level #{self.level.number}: {self.level.name}"
@@ -63,19 +71,34 @@ class GameScreen(Screen):
         self.neuralsys = NeuralSys(parent=self)
 
         self.goals_display = GoalsDisplay(goals=self.level.goals, game_screen=self)
+        self._goal_check_pending = False
         self.file_explorer = ExplorerWidget(vfs=self.level.fs, game_screen=self)
 
         self.karma = Karma(
             parent=self, snippets=snippets, backstory=self.level.mission_backstory
         )
 
-        self.chat = ChatWidget(level=self.level, game_screen=self, karma=self.karma)
-        self._fs_title = "($user$) File System:"
+        self.chat = ChatWidget(
+            level=self.level,
+            game_screen=self,
+            karma=self.karma,
+            transcript=saved.transcript if saved is not None else "",
+        )
+        self._fs_title = Template("($user$) File System:")
 
         self.karma.include_fs(level=self.level)
         self.karma.include_goal_hints(level=self.level)
 
         self._game_over = False
+        self._neuralctl_worker: Worker | None = None
+
+        # the session is saved to after every turn, see `autosave`
+        self.session: Optional[SessionLog] = None
+        if saved is not None:
+            self.goals_display.restore(saved.game.get("goal_idx", 0))
+            self.karma.restore(saved.context)
+            self._game_over = saved.game.get("game_over", False)
+            self.session = saved.log
 
     def compose(self) -> ComposeResult:
         yield Header(show_clock=True, icon="")
@@ -83,9 +106,7 @@ class GameScreen(Screen):
             with Vertical():
                 with Vertical(classes="explorer-container"):
                     yield Static(
-                        content=self._fs_title.replace(
-                            "$user$", self.level.fs.current_user
-                        ),
+                        content=self._fs_title.render(user=self.level.fs.current_user),
                         classes="horizontal-centered",
                         id="fs_title",
                     )
@@ -100,22 +121,64 @@ class GameScreen(Screen):
                 yield self.chat
         yield Footer()
 
+    def on_mount(self) -> None:
+        if self._game_over:
+            self._end_game()
+        if self.session is None and settings.autosave:
+            self.session = SessionLog(
+                SessionLog.path_for(f"level{str(self.level.number).zfill(2)}")
+            )
+            try:
+                self.session.start(self.level)
+            except OSError as e:
+                logger.warning(f"Could not start saving the session: {e}")
+                self.session = None
+
+    def autosave(self) -> None:
+        if self.session is None:
+            return
+        try:
+            self.session.save(
+                level=self.level,
+                context=self.karma.context.state(),
+                transcript=self.chat.transcript,
+                game={
+                    "goal_idx": self.goals_display._goal_idx,
+                    "game_over": self._game_over,
+                },
+            )
+        except OSError as e:
+            logger.warning(f"Could not save the session: {e}")
+
     def on_button_pressed(self, event: Button.Pressed) -> None:
         button_id = event.button.id
         if button_id == "objectives_button":
             self.app.push_screen(self.goals_display)
 
     def on_file_system_updated(self, event: FileSystemUpdated):
+        self.request_goal_check()
+
+    def request_goal_check(self) -> None:
+        # changes already queued up are checked against the goals once
+        if not self._goal_check_pending:
+            self._goal_check_pending = True
+            self.call_later(self._check_goals)
+
+    def _check_goals(self) -> None:
+        self._goal_check_pending = False
         if self.goals_display.check_for_goal(vfs=self.level.fs):
-            self.on_goal_achieved()
+            self.post_message(GoalAchieved(self))
+        self.autosave()
 
-    def on_goal_achieved(self):
+    def on_goal_achieved(self, event: GoalAchieved):
+        if not self.goals_display.all_achieved:
+            # the next goal may already be met by the same changes
+            self.request_goal_check()
         goal_achieved = self.goals_display._goals[self.goals_display._goal_idx - 1]
         self.karma.include_goal_hints(level=self.level)
-        with open(os.path.join(settings.assets_dir, "goal_prompt_snippet"), "r") as f:
-            goal_msg = f.read()
-        goal_msg = goal_msg.replace("$goal_name$", goal_achieved.name)
-        goal_msg = goal_msg.replace("$goal_outcome$", goal_achieved.outcome)
+        goal_msg = load_template("goal_prompt_snippet").render(
+            goal_name=goal_achieved.name, goal_outcome=goal_achieved.outcome
+        )
 
         if self.goals_display.all_achieved:
             goal_msg = self.karma.combine_messages([goal_msg, self.mission_over()])
@@ -124,6 +187,12 @@ class GameScreen(Screen):
     def action_quit(self) -> None:
         self.app.push_screen(QuitScreen())
 
+    def on_unmount(self) -> None:
+        # drop in-flight LLM requests when the player leaves the level
+        self.workers.cancel_group(self, "llm")
+        self.workers.cancel_group(self.chat, "llm")
+        self.autosave()
+
     def intro_msg(self) -> None:
         with open(os.path.join(settings.assets_dir, "karma_intro"), "r") as f:
             self.chat.stream_chat(message=f.read())
@@ -140,11 +209,10 @@ class GameScreen(Screen):
                 )
                 static_fstitle = self.query_exactly_one("#fs_title", Static)
                 static_fstitle.update(
-                    content=self._fs_title.replace("$user$", self.level.fs.current_user)
+                    content=self._fs_title.render(user=self.level.fs.current_user)
                 )
                 self.karma.include_fs(level=self.level)
-                if self.goals_display.check_for_goal(vfs=self.level.fs):
-                    self.on_goal_achieved()
+                self.request_goal_check()
 
         self.app.push_screen(
             LoginScreen(credentials=self.level.credentials, vfs=self.level.fs),
@@ -152,111 +220,104 @@ class GameScreen(Screen):
         )
 
     def action_neuralctl(self) -> None:
+        if self._neuralctl_worker is not None and self._neuralctl_worker.is_running:
+            self.notify(
+                "An update request is already being processed.",
+                title="NeuralCtl",
+                severity="warning",
+            )
+            return
         self.notify(
             "Connecting to NeuralSys...", title="NeuralCtl", severity="information"
         )
+        self._neuralctl_worker = self.run_worker(
+            self.evaluate_neuralctl(), group="llm", exit_on_error=False
+        )
 
-        def evaluate_neuralctl():
-            try:
-                log_str = self.neuralsys.evaluate(
-                    snippets=[self.level.neuralsys_prompt_snippet],
-                    **{"level": self.level},
-                )
-                self.notify(
-                    "Disconnected from NeuralSys.",
-                    title="NeuralCtl",
-                    severity="information",
-                )
-                if log_str.endswith("."):
-                    log_str = log_str[:-1]
-                log_str += (
-                    f" (NeuralSys; Requested by user: {self.level.fs.current_user})."
-                )
-                self.level.add_log_msg(msg=log_str)
-                with open(
-                    os.path.join(settings.assets_dir, "promptedit_prompt_snippet"), "r"
-                ) as f:
-                    to_karma_msg = f.read()
-                to_karma_msg = to_karma_msg.replace(
-                    "$PREV_SYSPROMPT$", self.level.neuralsys_prompt_backup
-                )
-                to_karma_msg = to_karma_msg.replace(
-                    "$NEW_SYSPROMPT$", self.level.neuralsys_prompt_snippet
-                )
-                to_karma_msg = to_karma_msg.replace("$LOG_MSG$", log_str)
-                to_karma_msg = to_karma_msg.replace(
-                    "$CURRENT_USER$", self.level.fs.current_user
-                )
-                if log_str.startswith(self.neuralsys.check_fail_prefix):
-                    self.level.rollback_changes()
-                    self.level.max_retries -= 1
-                    if self.level.max_retries == 0:
-                        to_karma_msg = self.karma.combine_messages(
-                            [to_karma_msg, self.set_game_over()]
-                        )
-                else:
-                    self.file_explorer.reset(label="root")
-                    self.file_explorer.populate_tree(
-                        parent_node=self.file_explorer.root,
-                        directory=self.level.fs.base_dir,
+    async def evaluate_neuralctl(self) -> None:
+        try:
+            log_str = await self.neuralsys.aevaluate(
+                snippets=[self.level.neuralsys_prompt_snippet],
+                **{"level": self.level},
+            )
+            self.notify(
+                "Disconnected from NeuralSys.",
+                title="NeuralCtl",
+                severity="information",
+            )
+            if log_str.endswith("."):
+                log_str = log_str[:-1]
+            log_str += f" (NeuralSys; Requested by user: {self.level.fs.current_user})."
+            self.level.add_log_msg(msg=log_str)
+            to_karma_msg = load_template("promptedit_prompt_snippet").render(
+                PREV_SYSPROMPT=self.level.neuralsys_prompt_backup,
+                NEW_SYSPROMPT=self.level.neuralsys_prompt_snippet,
+                LOG_MSG=log_str,
+                CURRENT_USER=self.level.fs.current_user,
+            )
+            if log_str.startswith(self.neuralsys.check_fail_prefix):
+                self.level.rollback_changes()
+                self.level.max_retries -= 1
+                if self.level.max_retries == 0:
+                    to_karma_msg = self.karma.combine_messages(
+                        [to_karma_msg, self.set_game_over()]
                     )
-                self.chat.stream_chat(message=to_karma_msg)
-
-                if self.goals_display.check_for_goal(vfs=self.level.fs):
-                    self.on_goal_achieved()
-            except TokenizerError as e:
-                self.level.add_log_msg(msg=f"[TokenizerError]: {str(e)}")
-                # TODO: Message KARMA?
-
-                self.notify(
-                    "Received garbled input, ignoring request.",
-                    title="NeuralCtl",
-                    severity="error",
-                )
-                self.notify(
-                    "Disconnected from NeuralSys.",
-                    title="NeuralCtl",
-                    severity="information",
+            else:
+                self.file_explorer.reset(label="root")
+                self.file_explorer.populate_tree(
+                    parent_node=self.file_explorer.root,
+                    directory=self.level.fs.base_dir,
                 )
+            self.chat.stream_chat(message=to_karma_msg)
 
-        threading.Thread(target=evaluate_neuralctl, daemon=True).start()
+            self.request_goal_check()
+        except ConnectionError as e:
+            self.notify(
+                f"Lost connection to NeuralSys: {e}",
+                title="NeuralCtl",
+                severity="error",
+            )
+        except NeuralSysError as e:
+            self.notify(str(e), title="NeuralCtl", severity="error")
+        except TokenizerError as e:
+            self.level.add_log_msg(msg=f"[TokenizerError]: {str(e)}")
+            # TODO: Message KARMA?
 
-    def set_game_over(self) -> str:
+            self.notify(
+                "Received garbled input, ignoring request.",
+                title="NeuralCtl",
+                severity="error",
+            )
+            self.notify(
+                "Disconnected from NeuralSys.",
+                title="NeuralCtl",
+                severity="information",
+            )
+
+    def _end_game(self) -> None:
         self.file_explorer.disabled = True
         self.chat.disabled = True
         self.query_exactly_one(
             selector="#objectives_button", expect_type=Button
         ).disabled = True
         self._game_over = True
+        self.refresh_bindings()
+
+    def set_game_over(self) -> str:
+        self._end_game()
         with open(os.path.join(settings.assets_dir, "karma_gameover"), "r") as f:
             to_karma_msg = f.read()
-        self.refresh_bindings()
         return to_karma_msg
 
     def mission_over(self) -> str:
-        self.file_explorer.disabled = True
-        self.chat.disabled = True
         self.goals_display.timer.stop()
-        self.query_exactly_one(
-            selector="#objectives_button", expect_type=Button
-        ).disabled = True
-        self._game_over = True
-        self.refresh_bindings()
-        with open(
-            os.path.join(
-                settings.assets_dir,
-                f"level{str(self.level.number).zfill(2)}",
-                "level_complete",
-            ),
-            "r",
-        ) as f:
-            mission_over_msg = f.read()
-        return mission_over_msg
+        self._end_game()
+        return self.level.read_asset("level_complete")
 
     def check_action(self, action, parameters):
         if action in ["download", "login", "neuralctl"]:
             return (
-                self.level.fs.current_user in self.level.fs.get(f"{action}.com").read
+                self.level.fs.get(f"{action}.com").can_read(self.level.fs.current_user)
                 and not self._game_over
             )
         return True
@@ -265,12 +326,11 @@ class GameScreen(Screen):
         f = self.file_explorer.get_current_selected()
         if f:
             if isinstance(f, File):
-                if self.level.fs.current_user in f.read:
-                    self.level.fs.downloaded_files.append(f.name)
+                if f.can_read(self.level.fs.current_user):
+                    self.level.fs.mark_downloaded(f.name)
                     self.notify(f"{f.name} downloaded!", severity="information")
 
-                    if self.goals_display.check_for_goal(vfs=self.level.fs):
-                        self.on_goal_achieved()
+                    self.request_goal_check()
                 else:
                     self.notify(
                         f"Cannot download {f.name}: file is locked.", severity="warning"
@@ -1,6 +1,6 @@
 from typing import List, Optional
 
-from base_objects.goals import Goal
+from base_objects.goals import Goal, GoalTracker
 from base_objects.vfs import VirtualFileSystem
 
 from textual.app import ComposeResult
@@ -25,6 +25,7 @@ class GoalsDisplay(ModalScreen):
 
         self._goals = goals
         self._goal_idx = 0
+        self._tracker = GoalTracker(goals)
         self._goals_checkbox: List[Checkbox] = []
         for goal in self._goals:
             cbox = Checkbox(
@@ -59,6 +60,9 @@ class GoalsDisplay(ModalScreen):
             btn.label = f"[r]{btn.label.plain}[/r]"
 
     def start_timer(self) -> None:
+        if self.timer is not None:
+            # a goal achieved while the button still flashes for the previous one
+            self.timer.stop()
         self.timer = self.set_interval(interval=0.5, callback=self.flash_button)
 
     @property
@@ -69,14 +73,26 @@ class GoalsDisplay(ModalScreen):
     def all_achieved(self) -> bool:
         return self._goal_idx == len(self._goals)
 
-    def check_for_goal(self, vfs: VirtualFileSystem) -> bool:
+    def _achieve_next_goal(self) -> None:
         curr_goal = self.next_goal
-        if curr_goal.resolved(vfs=vfs):
-            curr_checkbox = self._goals_checkbox[self._goal_idx]
-            curr_checkbox.value = True
-            curr_checkbox.tooltip = curr_goal.outcome
-            curr_checkbox.BUTTON_INNER = self._completed
-            self._goal_idx += 1
+        curr_goal._solved = True
+        curr_checkbox = self._goals_checkbox[self._goal_idx]
+        curr_checkbox.value = True
+        curr_checkbox.tooltip = curr_goal.outcome
+        curr_checkbox.BUTTON_INNER = self._completed
+        self._goal_idx += 1
+
+    def restore(self, goal_idx: int) -> None:
+        """Mark the first `goal_idx` goals as achieved, e.g. in a resumed session."""
+        while self._goal_idx < min(goal_idx, len(self._goals)):
+            self._achieve_next_goal()
+
+    def check_for_goal(self, vfs: VirtualFileSystem) -> bool:
+        self._tracker.update(vfs=vfs)
+        if self.all_achieved:
+            return False
+        if self._tracker.holds(self._goal_idx):
+            self._achieve_next_goal()
             self._viewed = False
             self.start_timer()
             return True
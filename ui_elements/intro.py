@@ -1,7 +1,7 @@
-import os
-
 from base_objects.level import Level
-from settings import settings
+from llm.prewarm import model_warmer
+from llm.registry import model_registry
+from requests import ConnectionError
 
 from textual.app import ComposeResult
 from textual.containers import Center, Horizontal, ScrollableContainer
@@ -15,13 +15,7 @@ class IntroScreen(Screen):
         super().__init__()
         self.level = level
 
-        with open(
-            os.path.join(
-                settings.assets_dir, f"level{str(self.level.number).zfill(2)}", "intro"
-            ),
-            "r",
-        ) as f:
-            self.intro_text = f.read()
+        self.intro_text = self.level.read_asset("intro")
 
     def compose(self) -> ComposeResult:
         yield Center(
@@ -34,9 +28,34 @@ class IntroScreen(Screen):
             id="intro_screen",
         )
 
-    async def on_button_pressed(self, event: Button.Pressed) -> None:
+    def on_mount(self) -> None:
+        # the player reading the intro hides the model load time
+        self.run_worker(
+            model_warmer.warm_all, thread=True, group="prewarm", exit_on_error=False
+        )
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
         button_id = event.button.id
         if button_id == "start_level":
-            self.app.pop_screen()
-            await self.app.push_screen(GameScreen(level=self.level))
-            self.app.screen.intro_msg()
+            event.button.disabled = True
+            # pulling a missing model can take minutes, so it is done off the UI thread
+            self.run_worker(
+                self.prepare_models, thread=True, group="models", exit_on_error=False
+            )
+
+    def prepare_models(self) -> None:
+        try:
+            model_registry.ensure_game_models(notify=self.notify)
+        except ConnectionError as e:
+            self.notify(f"Cannot start the level: {e}", severity="error")
+            self.app.call_from_thread(self.enable_start)
+            return
+        self.app.call_from_thread(self.start_level)
+
+    def enable_start(self) -> None:
+        self.query_one("#start_level", Button).disabled = False
+
+    async def start_level(self) -> None:
+        self.app.pop_screen()
+        await self.app.push_screen(GameScreen(level=self.level))
+        self.app.screen.intro_msg()
@@ -1,7 +1,13 @@
 import glob
+import logging
 import os
 
+from base_objects.bundle import LevelBundle, is_stale
 from base_objects.level import Level
+from llm.prewarm import model_warmer
+from llm.registry import model_registry
+from requests import ConnectionError
+from session import SavedSession, SessionError, SessionLog
 from settings import settings
 
 from textual.app import ComposeResult
@@ -9,8 +15,11 @@ from textual.binding import Binding
 from textual.containers import Center, Container, Grid, Horizontal, Vertical
 from textual.screen import Screen
 from textual.widgets import Button, Footer, Static
+from ui_elements.game import GameScreen
 from ui_elements.intro import IntroScreen
-from utils import check_server_connection
+
+
+logger = logging.getLogger("prompt_override")
 
 
 class MenuScreen(Screen):
@@ -18,6 +27,12 @@ class MenuScreen(Screen):
         Binding(
             key="n", action="new_game", description="Start a [N]ew game.", priority=True
         ),
+        Binding(
+            key="c",
+            action="continue_game",
+            description="[C]ontinue the saved game.",
+            priority=True,
+        ),
         Binding(
             key="o", action="settings", description="Edit [O]ptions.", priority=True
         ),
@@ -35,8 +50,24 @@ class MenuScreen(Screen):
         self.selected_level_idx = 0
 
     def get_level_files(self):
-        pattern = os.path.join(settings.assets_dir, "level*.json")
-        return sorted([os.path.basename(f) for f in glob.glob(pattern)])
+        level_files = {}
+        for f in glob.glob(os.path.join(settings.assets_dir, "level*.json")):
+            level_files[os.path.splitext(os.path.basename(f))[0]] = f
+        # packed levels take the place of their manifest, unless it was edited
+        # after the level was packed
+        for f in glob.glob(
+            os.path.join(settings.assets_dir, f"level*{LevelBundle.extension}")
+        ):
+            name = os.path.splitext(os.path.basename(f))[0]
+            manifest_path = level_files.get(name)
+            if manifest_path is not None and is_stale(manifest_path):
+                logger.warning(
+                    f"{f} is older than {manifest_path} or its assets; "
+                    "loading the manifest. Re-pack the level to use the bundle."
+                )
+                continue
+            level_files[name] = f
+        return [os.path.basename(level_files[name]) for name in sorted(level_files)]
 
     def compose(self) -> ComposeResult:
         yield Center(
@@ -67,10 +98,30 @@ class MenuScreen(Screen):
                 ),
                 id="menu_container",
             ),
+            Static(
+                self.warm_status(), id="model_status", classes="horizontal-centered"
+            ),
         )
 
         yield Footer()
 
+    def on_mount(self) -> None:
+        self.set_interval(interval=1.0, callback=self.update_warm_status)
+
+    def on_screen_resume(self) -> None:
+        self.run_worker(
+            model_warmer.warm_all, thread=True, group="prewarm", exit_on_error=False
+        )
+
+    def warm_status(self) -> str:
+        return "Models: " + ", ".join(
+            f"{model_name} ({state.value})"
+            for model_name, state in model_warmer.status.items()
+        )
+
+    def update_warm_status(self) -> None:
+        self.query_one("#model_status", Static).update(self.warm_status())
+
     def load_title(self) -> str:
         try:
             with open(
@@ -91,7 +142,7 @@ class MenuScreen(Screen):
                     f"Level: {self.selected_level_idx + 1}"
                 )
         elif button_id == "new_game":
-            if check_server_connection():
+            if model_registry.is_reachable():
                 self.action_new_game()
             else:
                 self.notify(
@@ -112,6 +163,46 @@ class MenuScreen(Screen):
         level.initialize()
         self.app.push_screen(IntroScreen(level=level))
 
+    def action_continue_game(self) -> None:
+        if not self.level_files:
+            self.notify("No levels found!", severity="error")
+            return
+        level_name = os.path.splitext(self.level_files[self.selected_level_idx])[0]
+        path = SessionLog.path_for(level_name)
+        if not os.path.exists(path):
+            self.notify(f"No saved game for {level_name}.", severity="warning")
+            return
+        if not model_registry.is_reachable():
+            self.notify(
+                "Cannot continue the saved game: server is unreachable or username is wrong.",
+                severity="error",
+            )
+            return
+        try:
+            saved = SessionLog.load(path)
+        except SessionError as e:
+            self.notify(f"Cannot continue the saved game: {e}", severity="error")
+            return
+        # pulling a missing model can take minutes, so it is done off the UI thread
+        self.run_worker(
+            lambda: self.prepare_models(saved),
+            thread=True,
+            group="models",
+            exclusive=True,
+            exit_on_error=False,
+        )
+
+    def prepare_models(self, saved: SavedSession) -> None:
+        try:
+            model_registry.ensure_game_models(notify=self.notify)
+        except ConnectionError as e:
+            self.notify(f"Cannot continue the saved game: {e}", severity="error")
+            return
+        self.app.call_from_thread(self.resume_game, saved)
+
+    def resume_game(self, saved: SavedSession) -> None:
+        self.app.push_screen(GameScreen(level=saved.level, saved=saved))
+
     def action_settings(self) -> None:
         self.app.switch_mode("settings")
 
@@ -6,6 +6,7 @@ from textual.binding import Binding
 from textual.containers import Center, ScrollableContainer
 from textual.screen import Screen
 from textual.widgets import Button, Footer, Input, Static
+from utils import reset_session
 
 
 class SettingsScreen(Screen):
@@ -63,6 +64,8 @@ class SettingsScreen(Screen):
                     f"Invalid value for {key}: {raw_value}", severity="error"
                 )
                 return
+        # pooled connections are bound to the previous server and retry settings
+        reset_session()
         self.app.notify("Settings saved successfully!", severity="info")
 
     def get_nested_value(self, obj: BaseModel, key: str):
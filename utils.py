@@ -1,35 +1,345 @@
+import asyncio
 import json
 import logging
+import threading
+import time
+import weakref
 from hashlib import sha224
-from typing import Any, Dict, Optional
+from typing import (
+    Any,
+    AsyncGenerator,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from requests import ConnectionError, get, post, Response
+import httpx
+from requests import ConnectionError, RequestException, Response, Session
+from requests.adapters import HTTPAdapter
 from settings import settings
+from urllib3.util.retry import Retry
 
+# endpoints whose replies can take much longer than a plain request
+ENDPOINT_READ_TIMEOUTS = {
+    "ollama_generate": "generate_timeout",
+    "ollama_generate_stream": "generate_timeout",
+    "ollama_init_model": "init_model_timeout",
+}
 
-def check_server_connection() -> bool:
-    try:
-        response = get(f"{settings.server_url}/ollama_list_models")
-        if response.status_code == 200:
-            logging.getLogger("prompt_override").debug(
-                f"Server response: {response.status_code} - {response.text}"
-            )
+
+class EndpointNotFoundError(ConnectionError):
+    """The server does not provide the endpoint, e.g. an older server."""
+
+
+class CircuitBreaker:
+    """Fail fast while the server is down instead of waiting on every request.
+
+    After `breaker_threshold` consecutive failures the breaker opens and all
+    requests are refused until `breaker_cooldown` seconds have passed. A single
+    probe request is then let through: if it succeeds the breaker closes again,
+    otherwise it reopens for another cooldown. A probe that ends without an
+    outcome (e.g. it was cancelled) lets the next request probe instead.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._failure_callbacks: List[Callable[[], None]] = []
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_request(self) -> bool:
+        """Raise if requests are refused, otherwise return whether this one probes."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            elapsed = time.monotonic() - self._opened_at
+            if self._probing or elapsed < settings.connection.breaker_cooldown:
+                raise ConnectionError(
+                    "Server is unreachable; retrying in "
+                    f"{max(0, settings.connection.breaker_cooldown - elapsed):.0f}s."
+                )
+            self._probing = True
             return True
-        return False
-    except ConnectionError:
-        return False
+
+    def after_request(self, probe: bool) -> None:
+        """Call when a request ends in any way, with what `before_request` returned."""
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def record_response(self, status_code: int) -> None:
+        # only server errors count against the server
+        if status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def on_failure(self, callback: Callable[[], None]) -> None:
+        """Call `callback` after every failed request."""
+        self._failure_callbacks.append(callback)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= settings.connection.breaker_threshold:
+                if self._opened_at is None:
+                    logging.getLogger("prompt_override").warning(
+                        f"Opening circuit breaker after {self._failures} failures."
+                    )
+                self._opened_at = time.monotonic()
+            self._probing = False
+        for callback in self._failure_callbacks:
+            callback()
+
+
+breaker = CircuitBreaker()
+
+_session: Optional[Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            # connection errors are retried for any method (nothing was sent),
+            # read errors and bad gateways only for idempotent requests
+            retries = Retry(
+                total=settings.connection.max_retries,
+                backoff_factor=settings.connection.backoff_factor,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset({"GET", "HEAD"}),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.connection.pool_size,
+                max_retries=retries,
+            )
+            _session = Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def reset_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+    _async_clients.clear()
+
+
+def get_timeout(endpoint: str) -> Tuple[float, float]:
+    read_timeout = ENDPOINT_READ_TIMEOUTS.get(endpoint, "read_timeout")
+    return (
+        settings.connection.connect_timeout,
+        getattr(settings.connection, read_timeout),
+    )
+
+
+def server_error(status_code: int, text: str) -> ConnectionError:
+    logging.getLogger("prompt_override").error(f"Server error: {status_code} - {text}")
+    try:
+        message = json.loads(text)["message"]
+    except (ValueError, KeyError, TypeError):
+        # not one of the server's own errors, e.g. from a proxy
+        message = text.strip() or f"HTTP {status_code}"
+    if status_code in (404, 405):
+        return EndpointNotFoundError(message)
+    return ConnectionError(message)
 
 
-def send_to_server(data: Optional[Dict[str, Any]], endpoint) -> Response:
-    if data:
-        uid = sha224(settings.user_name.encode("utf-8")).hexdigest()
-        payload = {"uid": uid, **data}
-        response = post(f"{settings.server_url}/{endpoint}", json=payload)
+def send_to_server(data: Optional[Dict[str, Any]], endpoint) -> Dict[str, Any]:
+    probe = breaker.before_request()
+    url = f"{settings.server_url}/{endpoint}"
+    try:
+        if data:
+            uid = sha224(settings.user_name.encode("utf-8")).hexdigest()
+            payload = {"uid": uid, **data}
+            response = get_session().post(
+                url, json=payload, timeout=get_timeout(endpoint)
+            )
+        else:
+            response = get_session().get(url, timeout=get_timeout(endpoint))
+    except RequestException as e:
+        breaker.record_failure()
+        logging.getLogger("prompt_override").error(f"Server unreachable: {e}")
+        raise ConnectionError(f"Server unreachable: {e}") from e
     else:
-        response = get(f"{settings.server_url}/{endpoint}")
+        breaker.record_response(response.status_code)
+    finally:
+        breaker.after_request(probe)
     if response.status_code != 200:
-        logging.getLogger("prompt_override").error(
-            f"Server error: {response.status_code} - {response.text}"
+        raise server_error(response.status_code, response.text)
+    return response.json()
+
+
+def stream_from_server(
+    data: Dict[str, Any], endpoint
+) -> Generator[Dict[str, Any], None, None]:
+    """Post `data` to a chunked endpoint and yield each NDJSON chunk as it arrives.
+
+    The read timeout applies between chunks rather than to the whole reply.
+    """
+    probe = breaker.before_request()
+    uid = sha224(settings.user_name.encode("utf-8")).hexdigest()
+    payload = {"uid": uid, **data}
+    try:
+        response = get_session().post(
+            f"{settings.server_url}/{endpoint}",
+            json=payload,
+            timeout=get_timeout(endpoint),
+            stream=True,
+        )
+    except RequestException as e:
+        breaker.record_failure()
+        logging.getLogger("prompt_override").error(f"Server unreachable: {e}")
+        raise ConnectionError(f"Server unreachable: {e}") from e
+    else:
+        breaker.record_response(response.status_code)
+    finally:
+        breaker.after_request(probe)
+    with response:
+        if response.status_code != 200:
+            raise server_error(response.status_code, response.text)
+        for chunk in _iter_chunks(response):
+            if "error" in chunk:
+                raise ConnectionError(chunk["error"])
+            yield chunk
+
+
+def _parse_chunk(line: Union[str, bytes]) -> Dict[str, Any]:
+    try:
+        chunk = json.loads(line)
+    except ValueError:
+        chunk = None
+    if not isinstance(chunk, dict) or not (
+        "error" in chunk or isinstance(chunk.get("message"), dict)
+    ):
+        raise ConnectionError(f"Malformed reply from the server: {line!r}")
+    return chunk
+
+
+def _iter_chunks(response: Response) -> Generator[Dict[str, Any], None, None]:
+    try:
+        for line in response.iter_lines():
+            if line:
+                yield _parse_chunk(line)
+    except RequestException as e:
+        breaker.record_failure()
+        logging.getLogger("prompt_override").error(f"Stream interrupted: {e}")
+        raise ConnectionError(f"Stream interrupted: {e}") from e
+
+
+# one async client per event loop, as connection pools are bound to their loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        transport = httpx.AsyncHTTPTransport(
+            retries=settings.connection.max_retries,
+            limits=httpx.Limits(
+                max_connections=settings.connection.pool_size,
+                max_keepalive_connections=settings.connection.pool_size,
+            ),
         )
-        raise ConnectionError(json.loads(response.text)["message"])
+        client = httpx.AsyncClient(transport=transport)
+        _async_clients[loop] = client
+    return client
+
+
+def get_async_timeout(endpoint: str) -> httpx.Timeout:
+    connect_timeout, read_timeout = get_timeout(endpoint)
+    return httpx.Timeout(read_timeout, connect=connect_timeout)
+
+
+async def asend_to_server(data: Optional[Dict[str, Any]], endpoint) -> Dict[str, Any]:
+    """Async counterpart of `send_to_server`; cancelling the caller aborts the request."""
+    probe = breaker.before_request()
+    url = f"{settings.server_url}/{endpoint}"
+    client = get_async_client()
+    # the transport only retries failed connects; idempotent GETs are also
+    # retried on read errors, with the same backoff as the sync session
+    attempts = 1 if data else settings.connection.max_retries + 1
+    try:
+        for attempt in range(attempts):
+            try:
+                if data:
+                    uid = sha224(settings.user_name.encode("utf-8")).hexdigest()
+                    payload = {"uid": uid, **data}
+                    response = await client.post(
+                        url, json=payload, timeout=get_async_timeout(endpoint)
+                    )
+                else:
+                    response = await client.get(
+                        url, timeout=get_async_timeout(endpoint)
+                    )
+                break
+            except httpx.TransportError as e:
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(settings.connection.backoff_factor * 2**attempt)
+                    continue
+                breaker.record_failure()
+                logging.getLogger("prompt_override").error(f"Server unreachable: {e}")
+                raise ConnectionError(f"Server unreachable: {e}") from e
+        breaker.record_response(response.status_code)
+    finally:
+        # a cancelled probe has no outcome
+        breaker.after_request(probe)
+    if response.status_code != 200:
+        raise server_error(response.status_code, response.text)
     return response.json()
+
+
+async def astream_from_server(
+    data: Dict[str, Any], endpoint
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Async counterpart of `stream_from_server`."""
+    probe = breaker.before_request()
+    uid = sha224(settings.user_name.encode("utf-8")).hexdigest()
+    payload = {"uid": uid, **data}
+    try:
+        async with get_async_client().stream(
+            "POST",
+            f"{settings.server_url}/{endpoint}",
+            json=payload,
+            timeout=get_async_timeout(endpoint),
+        ) as response:
+            breaker.record_response(response.status_code)
+            if response.status_code != 200:
+                text = (await response.aread()).decode("utf-8")
+                raise server_error(response.status_code, text)
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = _parse_chunk(line)
+                if "error" in chunk:
+                    raise ConnectionError(chunk["error"])
+                yield chunk
+    except httpx.TransportError as e:
+        breaker.record_failure()
+        logging.getLogger("prompt_override").error(f"Server unreachable: {e}")
+        raise ConnectionError(f"Server unreachable: {e}") from e
+    finally:
+        breaker.after_request(probe)